@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Loot Telemetry Server Benchmark
+
+Starts the server against a scratch database, preloads it with generated stat
+sheets, then drives each API endpoint at a fixed concurrency and reports
+requests/sec plus p50/p95/p99 latency. Results are written as JSON and can be
+compared against a saved baseline to flag regressions.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import chain
+
+import numpy as np
+import requests
+
+from data_generator import LootTelemetryDataGenerator, UploadStats
+from db_handler import open_database
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+
+# Relative change that counts as a regression when comparing to a baseline
+DEFAULT_THRESHOLD = 0.10
+
+# Hotspot distribution: most loot lands near a few map locations
+HOTSPOTS = [(20.0, 30.0), (70.0, 75.0), (50.0, 10.0)]
+HOTSPOT_SPREAD = 6.0
+
+
+def find_free_port():
+    """Ask the OS for an unused local TCP port."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def apply_distribution(chunk, distribution, rng):
+    """Reshape a generated chunk's locations to match the chosen distribution."""
+    if distribution == 'uniform':
+        return chunk
+
+    for sheet in chunk:
+        for item in sheet['locations']:
+            cx, cy = HOTSPOTS[rng.integers(len(HOTSPOTS))]
+            x, y = np.clip(rng.normal((cx, cy), HOTSPOT_SPREAD), 0, 100)
+            sheet['locations'][item] = (float(x), float(y))
+    return chunk
+
+
+def preload_database(db_path, num_sheets, players_per_match, distribution, seed, shards=1):
+    """Fill a (possibly sharded) database with generated stat sheets, bypassing HTTP."""
+    generator = LootTelemetryDataGenerator(seed=seed)
+    rng = np.random.default_rng(seed)
+    num_matches = max(1, -(-num_sheets // players_per_match))
+
+    db = open_database(db_path, shards)
+    loaded = 0
+    for chunk in generator.generate_chunks(num_matches, players_per_match):
+        chunk = apply_distribution(chunk[:num_sheets - loaded], distribution, rng)
+        if not chunk:
+            break
+        db.insert_stat_sheets(chunk)
+        loaded += len(chunk)
+    db.close()
+    return loaded
+
+
+class ServerProcess:
+    """Run server.py in a subprocess against a given database file.
+
+    The response cache is off unless cache=True: repeated identical reads
+    would otherwise be served from memory and measure only cache hits.
+    """
+
+    def __init__(self, db_path, port, server_args=(), shards=1, cache=False):
+        self.db_path = db_path
+        self.shards = shards
+        self.port = port
+        # Ahead of server_args, so an explicit --cache-mb there still wins
+        self.server_args = ([] if cache else ['--cache-mb', '0']) + list(server_args)
+        self.base_url = f"http://127.0.0.1:{port}"
+        self.process = None
+
+    def start(self, timeout=30):
+        env = dict(os.environ, LOOT_DB_PATH=self.db_path, LOOT_DB_SHARDS=str(self.shards))
+        command = [sys.executable, SERVER_SCRIPT, '--host', '127.0.0.1', '--port', str(self.port),
+                   '--no-debug', *self.server_args]
+        self.process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited early with code {self.process.returncode}")
+            try:
+                if requests.get(f"{self.base_url}/api/health", timeout=1).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError("Server did not become healthy in time")
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+def build_workloads(base_url, seed):
+    """Map each endpoint name to a function that performs one request with a session."""
+    generator = LootTelemetryDataGenerator(seed=seed + 1)
+    # Benchmark submits use match IDs that never collide with preloaded data
+    submit_sheets = chain.from_iterable(generator.generate_chunks(10 ** 7, 1))
+    submit_lock = threading.Lock()
+
+    def submit(session):
+        with submit_lock:
+            sheet = next(submit_sheets)
+        sheet['match_id'] = f"bench_{sheet['match_id']}"
+        return session.post(f"{base_url}/api/submit", json=sheet, timeout=30)
+
+    return {
+        'submit': submit,
+        'stats': lambda session: session.get(f"{base_url}/api/stats", params={'limit': 100}, timeout=30),
+        'aggregate': lambda session: session.get(f"{base_url}/api/aggregate", timeout=30),
+        'heatmap': lambda session: session.get(f"{base_url}/api/heatmap/rubber_duck", params={'limit': 1000}, timeout=30),
+        'heatmap_grid': lambda session: session.get(f"{base_url}/api/heatmap/rubber_duck/grid", timeout=30)
+    }
+
+
+def run_endpoint(workload, num_requests, concurrency):
+    """Issue num_requests calls across concurrency threads; return throughput and latency."""
+    stats = UploadStats()
+    local = threading.local()
+
+    def one_request(_):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            ok = workload(session).status_code < 400
+        except requests.RequestException:
+            ok = False
+        stats.record(1, int(ok), time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one_request, range(num_requests)))
+    elapsed = time.perf_counter() - start
+
+    p50, p95, p99, p100 = stats.percentiles(50, 95, 99, 100)
+    return {
+        'requests': num_requests,
+        'errors': stats.failed,
+        'elapsed_s': round(elapsed, 3),
+        'rps': round(num_requests / elapsed, 1),
+        'p50_ms': round(p50, 2),
+        'p95_ms': round(p95, 2),
+        'p99_ms': round(p99, 2),
+        'max_ms': round(p100, 2)
+    }
+
+
+def compare_results(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """List regressions: throughput down or p95 latency up by more than threshold."""
+    regressions = []
+    for endpoint, result in current['results'].items():
+        base = baseline['results'].get(endpoint)
+        if not base:
+            continue
+        if result['rps'] < base['rps'] * (1 - threshold):
+            regressions.append(f"{endpoint}: rps {base['rps']} -> {result['rps']}")
+        if result['p95_ms'] > base['p95_ms'] * (1 + threshold):
+            regressions.append(f"{endpoint}: p95 {base['p95_ms']}ms -> {result['p95_ms']}ms")
+        if result['errors'] > base['errors']:
+            regressions.append(f"{endpoint}: errors {base['errors']} -> {result['errors']}")
+    return regressions
+
+
+def print_results(results, baseline=None):
+    print(f"\n{'Endpoint':<14}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    print("-" * 62)
+    for endpoint, result in results['results'].items():
+        line = (f"{endpoint:<14}{result['rps']:>10.1f}{result['p50_ms']:>10.2f}"
+                f"{result['p95_ms']:>10.2f}{result['p99_ms']:>10.2f}{result['errors']:>8}")
+        base = (baseline or {}).get('results', {}).get(endpoint)
+        if base and base['rps']:
+            line += f"   ({(result['rps'] / base['rps'] - 1) * 100:+.1f}% rps)"
+        print(line)
+
+
+def run_benchmark(args):
+    workdir = tempfile.mkdtemp(prefix='loot_bench_')
+    db_path = os.path.join(workdir, 'bench.db')
+
+    print(f"📦 Preloading {args.sheets} stat sheets ({args.distribution} locations)...")
+    loaded = preload_database(db_path, args.sheets, args.players, args.distribution, args.seed, args.shards)
+
+    server = ServerProcess(db_path, args.port or find_free_port(), args.server_arg, args.shards, args.cache)
+    try:
+        server.start()
+        print(f"🌐 Server running at {server.base_url}")
+
+        workloads = build_workloads(server.base_url, args.seed)
+        endpoints = args.endpoints or list(workloads)
+        results = {}
+        for endpoint in endpoints:
+            print(f"⏱️  {endpoint}: {args.requests} requests at concurrency {args.concurrency}...")
+            results[endpoint] = run_endpoint(workloads[endpoint], args.requests, args.concurrency)
+    finally:
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'preloaded_sheets': loaded,
+            'players_per_match': args.players,
+            'distribution': args.distribution,
+            'requests_per_endpoint': args.requests,
+            'concurrency': args.concurrency,
+            'server_args': args.server_arg,
+            'response_cache': args.cache,
+            'shards': args.shards,
+            'seed': args.seed
+        },
+        'results': results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the loot telemetry server API')
+    parser.add_argument('--sheets', type=int, default=10000, help='Stat sheets to preload')
+    parser.add_argument('--players', type=int, default=4, help='Players per match in preloaded data')
+    parser.add_argument('--distribution', choices=['uniform', 'hotspot'], default='uniform', help='Preloaded location distribution')
+    parser.add_argument('--requests', type=int, default=500, help='Requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent client threads')
+    parser.add_argument('--endpoints', nargs='+', choices=['submit', 'stats', 'aggregate', 'heatmap', 'heatmap_grid'], help='Endpoints to benchmark (default: all)')
+    parser.add_argument('--server-arg', action='append', default=[], help='Extra server.py argument (repeatable, e.g. --server-arg=--async-ingest)')
+    parser.add_argument('--shards', type=int, default=1, help='Database shards for the preloaded data and server')
+    parser.add_argument('--cache', action='store_true', help='Keep the response cache on (read endpoints then mostly measure cache hits)')
+    parser.add_argument('--port', type=int, default=None, help='Server port (default: a free port)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for generated data')
+    parser.add_argument('--output', default='bench_results.json', help='Where to write the JSON results')
+    parser.add_argument('--compare', metavar='BASELINE', help='Baseline results file to compare against')
+    parser.add_argument('--results', metavar='RESULTS', help='Compare this saved results file instead of running')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='Relative change treated as a regression')
+
+    args = parser.parse_args()
+
+    print("🏁 Loot Telemetry Server Benchmark")
+    print("=" * 40)
+
+    if args.results:
+        with open(args.results) as f:
+            results = json.load(f)
+    else:
+        results = run_benchmark(args)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Results saved to {args.output}")
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    print_results(results, baseline)
+
+    cached = [run['meta'].get('response_cache', True) for run in (baseline, results) if run]
+    if len(set(cached)) > 1:
+        print("\n⚠️  One run used the response cache and the other did not; read endpoints are not comparable")
+
+    if baseline:
+        regressions = compare_results(baseline, results, args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s) beyond {args.threshold:.0%}:")
+            for regression in regressions:
+                print(f"   • {regression}")
+            sys.exit(1)
+        print(f"\n✅ No regressions beyond {args.threshold:.0%} against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,21 +3,235 @@
 Loot Telemetry Data Generator
 
 This script simulates multiple game clients sending stat sheet data to the server.
-It generates realistic game session data and uploads it via the REST API.
+It generates realistic game session data and uploads it via the REST API, or
+streams it to the TCP/UDP ingest listener (see ingest_listener.py).
 """
 
 import json
+import math
+import os
 import random
+import socket
+import threading
 import time
+import uuid
+import numpy as np
 import requests
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime, timedelta
+from itertools import chain, islice
+from urllib.parse import urlparse
 import argparse
 
+import payloads
+from ingest_listener import LineSender, DEFAULT_TCP_PORT, DEFAULT_UDP_PORT
+
+# Upload transports: HTTP requests to the server, or NDJSON lines to the ingest listener
+TRANSPORTS = ('http', 'tcp', 'udp')
+
+# Seconds between live progress reports during an upload
+PROGRESS_INTERVAL = 2.0
+
+# Latency histogram for progress reports: log-spaced buckets 1% apart from
+# LATENCY_MIN seconds up to about 1000 seconds (slower requests share the last)
+LATENCY_MIN = 0.0001
+LATENCY_LOG_GROWTH = math.log(1.01)
+LATENCY_BUCKETS = 1621
+
+# Stat sheets drawn per vectorized generation step
+GENERATION_CHUNK = 10000
+
+# Upload retries: exponential backoff from RETRY_BASE_DELAY seconds, capped at
+# RETRY_MAX_DELAY, for connection errors, timeouts and these statuses
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30.0
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+def backoff_delay(attempt, base=RETRY_BASE_DELAY, cap=RETRY_MAX_DELAY):
+    """Seconds to wait before retry number attempt (0-based), with jitter so clients spread out."""
+    # Module-level random: the seeded generator must not be perturbed by retries
+    return min(cap, base * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+class UploadError(str):
+    """Error message of a failed upload request.
+    
+    final is True when the server answered and refused the request itself
+    (a non-retryable 4xx): sending it again would only be refused again, so
+    the chunk counts as answered. Transport errors and 429/5xx are not final.
+    """
+    
+    def __new__(cls, message, final=False):
+        error = super().__new__(cls, message)
+        error.final = final
+        return error
+    
+    @classmethod
+    def from_response(cls, response):
+        final = 400 <= response.status_code < 500 and response.status_code not in RETRYABLE_STATUSES
+        return cls(f"HTTP {response.status_code}: {response.text}", final)
+
+
+class TokenBucket:
+    """Thread-safe token bucket rate limiter (one token per stat sheet)."""
+    
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)  # allow up to one second of burst
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self, tokens=1):
+        """Block until the given number of tokens is available, then take them."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait_time = (tokens - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+class UploadStats:
+    """Thread-safe counters and request latencies for an upload run.
+    
+    Latencies are counted in a fixed set of log-spaced buckets, so memory
+    stays constant however long the upload runs and a progress report walks
+    the buckets instead of sorting every latency seen so far.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.monotonic()
+        self.sent = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.requests = 0
+        self.latency_buckets = [0] * LATENCY_BUCKETS
+        self.min_latency = None
+        self.max_latency = None
+    
+    def record(self, sent, succeeded, latency):
+        bucket = int(math.log(max(latency, LATENCY_MIN) / LATENCY_MIN) / LATENCY_LOG_GROWTH)
+        with self.lock:
+            self.sent += sent
+            self.succeeded += succeeded
+            self.failed += sent - succeeded
+            self.requests += 1
+            self.latency_buckets[min(bucket, LATENCY_BUCKETS - 1)] += 1
+            self.min_latency = latency if self.min_latency is None else min(self.min_latency, latency)
+            self.max_latency = latency if self.max_latency is None else max(self.max_latency, latency)
+    
+    def throughput(self):
+        """Sheets per second since the upload started."""
+        elapsed = time.monotonic() - self.start_time
+        return self.sent / elapsed if elapsed > 0 else 0.0
+    
+    def percentiles(self, *percents):
+        """Request latency percentiles in milliseconds (nearest-rank, within about 1%)."""
+        with self.lock:
+            buckets = list(self.latency_buckets)
+            requests, lowest, highest = self.requests, self.min_latency, self.max_latency
+        if not requests:
+            return [0.0 for _ in percents]
+        
+        results = []
+        for p in percents:
+            rank = min(requests, int(requests * p / 100) + 1)
+            if rank == requests:
+                results.append(highest * 1000)
+                continue
+            seen = 0
+            for bucket, count in enumerate(buckets):
+                seen += count
+                if seen >= rank:
+                    break
+            # The bucket's geometric midpoint, kept within the latencies actually seen
+            latency = LATENCY_MIN * math.exp((bucket + 0.5) * LATENCY_LOG_GROWTH)
+            results.append(min(max(latency, lowest), highest) * 1000)
+        return results
+
+
+class UploadCheckpoint:
+    """Persisted count of leading stat sheets the server has answered, for resuming an upload.
+    
+    Chunks finish out of order, so completed chunks beyond the first gap are
+    held until the gap closes; only the contiguous prefix is saved. run
+    describes the generated data (e.g. seed and sizes) and must match the
+    saved checkpoint, so a resume never skips sheets of a different dataset.
+    """
+    
+    def __init__(self, path, run=None):
+        self.path = path
+        self.run = run or {}
+        self.completed = 0
+        self._finished = {}  # offset -> size of chunks done past the watermark
+        self.lock = threading.Lock()
+        
+        if os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            if saved.get('run', {}) != self.run:
+                raise ValueError(f"Checkpoint {path} was written for a different run: {saved.get('run')}")
+            self.completed = saved['completed']
+    
+    def mark_done(self, offset, size):
+        """Record that the chunk starting at offset was answered, advancing the watermark."""
+        with self.lock:
+            self._finished[offset] = size
+            while self.completed in self._finished:
+                self.completed += self._finished.pop(self.completed)
+    
+    def save(self):
+        """Write the watermark atomically (a crash never leaves a torn checkpoint)."""
+        with self.lock:
+            state = {'run': self.run, 'completed': self.completed, 'updated': datetime.now().isoformat()}
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(self.path + '.tmp', self.path)
+
 
 class LootTelemetryDataGenerator:
-    def __init__(self, server_url="http://localhost:5000"):
+    def __init__(self, server_url="http://localhost:5000", seed=None, encoding='json', compress=False,
+                 transport='http', listener=None, run_id=None):
         self.server_url = server_url
         self.session = requests.Session()
+        self._local = threading.local()  # one pooled session (or line sender) per upload thread
+        
+        # With transport 'tcp' or 'udp', sheets go to the ingest listener at
+        # listener=(host, port) instead; every thread's sender is kept so the
+        # upload can close them and collect the listener's summaries
+        self.transport = transport
+        self.listener = listener
+        self._senders = []
+        
+        # Upload body encoding (see payloads.ENCODINGS), optionally gzipped,
+        # with bytes-on-wire and encode CPU totals for the current upload
+        self.encoding = encoding
+        self.compress = compress
+        self.payload_lock = threading.Lock()
+        self.payload_bytes = 0
+        self.encode_seconds = 0.0
+        
+        # Retries of failed requests (see _post), counted per upload under payload_lock
+        self.max_retries = MAX_RETRIES
+        self.retries = 0
+        
+        # Seeded generators make runs reproducible (timestamps aside)
+        self.random = random.Random(seed)
+        self.rng = np.random.default_rng(seed)
+        
+        # Generated match IDs start with the run ID, so separate runs never
+        # share a (match_id, player_id) key the server would treat as a resend.
+        # A seeded run reuses its seed's ID: uploading it again (or resuming
+        # it from a checkpoint) resends the same sheets, which are stored once
+        self.run_id = run_id or (f"seed{seed}" if seed is not None else uuid.uuid4().hex[:8])
         
         # Game configuration
         self.items = ['rubber_duck', 'medkit', 'ammo_box', 'grenade', 'gold_coin']
@@ -26,14 +240,14 @@ class LootTelemetryDataGenerator:
     def generate_stat_sheet(self, match_id, player_id):
         """Generate a realistic stat sheet for a player in a match."""
         # Random item counts (0-5 each)
-        looted_items = {item: random.randint(0, 5) for item in self.items}
+        looted_items = {item: self.random.randint(0, 5) for item in self.items}
         
         # Generate locations for items that were looted
         locations = {}
         for item, count in looted_items.items():
             if count > 0:
-                x = random.uniform(0, self.map_size[0])
-                y = random.uniform(0, self.map_size[1])
+                x = self.random.uniform(0, self.map_size[0])
+                y = self.random.uniform(0, self.map_size[1])
                 locations[item] = (x, y)
         
         return {
@@ -42,85 +256,378 @@ class LootTelemetryDataGenerator:
             "timestamp": datetime.now().isoformat(),
             "looted_items": looted_items,
             "locations": locations,
-            "match_duration": random.randint(300, 1800),  # 5-30 minutes
-            "player_level": random.randint(1, 50)
+            "match_duration": self.random.randint(300, 1800),  # 5-30 minutes
+            "player_level": self.random.randint(1, 50)
         }
     
     def test_server_connection(self):
-        """Test if the server is available."""
+        """Test if the server (or, for TCP, the ingest listener) is available."""
+        if self.transport == 'udp':
+            return True  # datagrams are fire-and-forget; nothing to check
+        if self.transport == 'tcp':
+            try:
+                socket.create_connection(self.listener, timeout=5).close()
+                return True
+            except OSError:
+                return False
         try:
             response = self.session.get(f"{self.server_url}/api/health", timeout=5)
             return response.status_code == 200
         except requests.RequestException:
             return False
     
+    def _thread_session(self):
+        """Return the calling thread's session so keep-alive connections are reused."""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            self._local.session = session
+        return session
+    
+    def encode_payload(self, obj):
+        """Encode a request body with the configured encoding, counting its bytes and CPU time."""
+        start = time.thread_time()
+        body, headers = payloads.encode(obj, self.encoding, self.compress)
+        elapsed = time.thread_time() - start
+        with self.payload_lock:
+            self.payload_bytes += len(body)
+            self.encode_seconds += elapsed
+        return body, headers
+    
+    def _post(self, path, obj, timeout):
+        """POST an encoded body, retrying connection errors, timeouts, 429 and 5xx with backoff.
+        
+        Retries are safe because the server stores one stat sheet per match
+        and player. Returns the last response, or raises the last
+        requests.RequestException once max_retries is used up.
+        """
+        body, headers = self.encode_payload(obj)
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self._thread_session().post(
+                    f"{self.server_url}{path}",
+                    data=body,
+                    headers=headers,
+                    timeout=timeout
+                )
+                if response.status_code not in RETRYABLE_STATUSES or attempt == self.max_retries:
+                    return response
+                retry_after = response.headers.get('Retry-After', '')
+                delay = float(retry_after) if retry_after.isdigit() else 0.0
+            except requests.RequestException:
+                if attempt == self.max_retries:
+                    raise
+                delay = 0.0
+            
+            with self.payload_lock:
+                self.retries += 1
+            time.sleep(max(delay, backoff_delay(attempt)))
+    
     def send_stat_sheet(self, stat_sheet):
         """Send a single stat sheet to the server."""
         try:
-            response = self.session.post(
-                f"{self.server_url}/api/submit", 
-                json=stat_sheet, 
-                timeout=10
-            )
-            if response.status_code == 201:
+            response = self._post("/api/submit", stat_sheet, timeout=10)
+            # 200 for a sheet the server already had, 202 when it queues writes
+            if response.status_code in (200, 201, 202):
                 return True, response.json()
             else:
-                return False, f"HTTP {response.status_code}: {response.text}"
+                return False, UploadError.from_response(response)
         except requests.RequestException as e:
-            return False, f"Request error: {str(e)}"
+            return False, UploadError(f"Request error: {str(e)}")
+    
+    def send_stat_sheet_batch(self, stat_sheets):
+        """Send many stat sheets to the server in a single batch request."""
+        try:
+            response = self._post("/api/submit/batch", stat_sheets, timeout=30)
+            if response.status_code in (201, 202):  # 202 when the server queues writes
+                return True, response.json()
+            if response.status_code == 400:
+                # Every sheet failed validation: still an answer, with per-item errors
+                try:
+                    result = response.json()
+                except ValueError:
+                    result = None
+                if isinstance(result, dict) and 'results' in result:
+                    return True, result
+            return False, UploadError.from_response(response)
+        except requests.RequestException as e:
+            return False, UploadError(f"Request error: {str(e)}")
+    
+    def _thread_sender(self):
+        """Return the calling thread's line sender, connecting on first use."""
+        sender = getattr(self._local, 'sender', None)
+        if sender is None:
+            sender = LineSender(*self.listener, transport=self.transport)
+            self._local.sender = sender
+            with self.payload_lock:
+                self._senders.append(sender)
+        return sender
+    
+    def send_stat_sheet_lines(self, stat_sheets):
+        """Send stat sheets to the ingest listener as NDJSON lines (no per-sheet response)."""
+        start = time.thread_time()
+        lines = LineSender.encode(stat_sheets)
+        elapsed = time.thread_time() - start
+        with self.payload_lock:
+            self.payload_bytes += sum(len(line) for line in lines)
+            self.encode_seconds += elapsed
+        try:
+            self._thread_sender().send_lines(lines)
+            return True, None
+        except OSError as e:
+            self._local.sender = None  # reconnect on the next chunk
+            return False, f"Send error: {e}"
+    
+    def close_senders(self):
+        """Close every line sender, summing the listener's TCP summaries (None for UDP)."""
+        with self.payload_lock:
+            senders, self._senders = self._senders, []
+        self._local = threading.local()
+        totals = None
+        for sender in senders:
+            try:
+                summary = sender.close()
+            except OSError as e:
+                print(f"⚠️  Listener connection closed without a summary: {e}")
+                continue
+            if summary is not None:
+                totals = totals or {'received': 0, 'accepted': 0, 'rejected': 0,
+                                    'committed': 0, 'duplicates': 0, 'failed': 0}
+                for key in totals:
+                    totals[key] += summary[key]
+        return totals
+    
+    def generate_chunks(self, num_matches=50, players_per_match=4, chunk_size=GENERATION_CHUNK):
+        """Yield stat sheets in chunks, drawing every random field as a NumPy array.
+        
+        Produces the same shape of data as generate_stat_sheet, but item counts,
+        coordinates, durations and levels for a whole chunk come from a handful
+        of vectorized draws. Only one chunk is held in memory at a time.
+        """
+        total = num_matches * players_per_match
+        num_items = len(self.items)
+        
+        for start in range(0, total, chunk_size):
+            size = min(chunk_size, total - start)
+            index = np.arange(start, start + size)
+            match_nums = (index // players_per_match + 1).tolist()
+            player_nums = (index % players_per_match + 1).tolist()
+            
+            counts = self.rng.integers(0, 6, size=(size, num_items)).tolist()  # 0-5 each
+            xs = self.rng.uniform(0, self.map_size[0], size=(size, num_items)).tolist()
+            ys = self.rng.uniform(0, self.map_size[1], size=(size, num_items)).tolist()
+            durations = self.rng.integers(300, 1801, size=size).tolist()  # 5-30 minutes
+            levels = self.rng.integers(1, 51, size=size).tolist()
+            timestamp = datetime.now().isoformat()
+            
+            chunk = []
+            for row in range(size):
+                row_counts = counts[row]
+                chunk.append({
+                    "match_id": f"{self.run_id}_match_{match_nums[row]:03d}",
+                    "player_id": f"player_{match_nums[row]}_{player_nums[row]}",
+                    "timestamp": timestamp,
+                    "looted_items": dict(zip(self.items, row_counts)),
+                    # Locations only for items that were looted
+                    "locations": {
+                        item: (xs[row][col], ys[row][col])
+                        for col, item in enumerate(self.items) if row_counts[col] > 0
+                    },
+                    "match_duration": durations[row],
+                    "player_level": levels[row]
+                })
+            yield chunk
     
     def generate_match_data(self, num_matches=50, players_per_match=4):
         """Generate stat sheets for multiple matches."""
         print(f"🎮 Generating data for {num_matches} matches ({players_per_match} players each)")
         
-        stat_sheets = []
-        for match_num in range(1, num_matches + 1):
-            match_id = f"match_{match_num:03d}"
-            
-            for player_num in range(1, players_per_match + 1):
-                player_id = f"player_{match_num}_{player_num}"
-                stat_sheet = self.generate_stat_sheet(match_id, player_id)
-                stat_sheets.append(stat_sheet)
+        stat_sheets = list(chain.from_iterable(self.generate_chunks(num_matches, players_per_match)))
         
         print(f"📊 Generated {len(stat_sheets)} stat sheets")
         return stat_sheets
     
-    def upload_data_to_server(self, stat_sheets):
-        """Upload all stat sheets to the server with progress tracking."""
+    def write_ndjson(self, path, num_matches=50, players_per_match=4):
+        """Stream generated stat sheets to an NDJSON file, one chunk at a time."""
+        written = 0
+        with open(path, 'w') as f:
+            for chunk in self.generate_chunks(num_matches, players_per_match):
+                f.write(''.join(json.dumps(sheet) + '\n' for sheet in chunk))
+                written += len(chunk)
+        return written
+    
+    def _send_chunk(self, chunk, batch_size, rate_limiter):
+        """Send one chunk (a single sheet or a batch), returning (succeeded, errors, latency, answered).
+        
+        answered is False when the request failed after retries without a
+        final answer (transport errors, 429/5xx), or some batch items were
+        still refused as retryable (the ingest queue was full), i.e. the
+        chunk must be sent again on resume. Sheets the server rejected as
+        invalid are answered: resending them would not change the answer.
+        """
+        if rate_limiter:
+            rate_limiter.acquire(len(chunk))
+        
+        start = time.perf_counter()
+        if self.transport != 'http':
+            success, result = self.send_stat_sheet_lines(chunk)
+            latency = time.perf_counter() - start
+            return (len(chunk), [], latency, True) if success else (0, [(0, result)], latency, False)
+        
+        if batch_size > 1:
+            # Items the server could not queue yet are resent on their own, and
+            # the chunk only counts as answered once none of them is left
+            pending = list(range(len(chunk)))
+            succeeded, errors, latency = 0, [], 0.0
+            for attempt in range(self.max_retries + 1):
+                success, result = self.send_stat_sheet_batch([chunk[position] for position in pending])
+                latency += time.perf_counter() - start
+                if not success:
+                    return succeeded, errors + [(pending[0], result)], latency, result.final
+                succeeded += result['accepted']
+                retryable = []
+                for r in result['results']:
+                    if r['success']:
+                        continue
+                    if r.get('retryable') and attempt < self.max_retries:
+                        retryable.append(pending[r['index']])
+                    else:
+                        errors.append((pending[r['index']], r['error']))
+                if not retryable:
+                    answered = not any(r.get('retryable') for r in result['results'])
+                    return succeeded, errors, latency, answered
+                
+                pending = retryable
+                with self.payload_lock:
+                    self.retries += 1
+                time.sleep(backoff_delay(attempt))
+                start = time.perf_counter()
+        
+        success, result = self.send_stat_sheet(chunk[0])
+        latency = time.perf_counter() - start
+        return (1, [], latency, True) if success else (0, [(0, result)], latency, result.final)
+    
+    def upload_data_to_server(self, stat_sheets, batch_size=1, concurrency=1, target_rate=None, total=None,
+                              checkpoint=None):
+        """Upload stat sheets to the server with progress tracking.
+        
+        Chunks of batch_size sheets (batch_size > 1 uses /api/submit/batch) are
+        sent from `concurrency` worker threads, each with its own keep-alive
+        session, or with transport 'tcp'/'udp' its own listener connection. target_rate caps throughput in sheets/sec with a token bucket.
+        stat_sheets may be any iterable (pass total for progress reporting);
+        only a few chunks per worker are held in flight at a time. With an
+        UploadCheckpoint, sheets it already covers are skipped and progress
+        is saved as chunks are answered, so an interrupted upload resumes.
+        """
         if not self.test_server_connection():
-            print("❌ Cannot connect to server. Make sure it's running at", self.server_url)
+            if self.transport == 'tcp':
+                host, port = self.listener
+                print(f"❌ Cannot connect to the ingest listener at {host}:{port} (python ingest_listener.py)")
+            else:
+                print("❌ Cannot connect to server. Make sure it's running at", self.server_url)
             return False
         
         print("✅ Server connection verified")
-        print(f"📤 Uploading {len(stat_sheets)} stat sheets...")
+        if total is None and hasattr(stat_sheets, '__len__'):
+            total = len(stat_sheets)
+        skipped = checkpoint.completed if checkpoint else 0
+        if skipped:
+            print(f"⏩ Resuming after {skipped} stat sheets already uploaded (checkpoint: {checkpoint.path})")
+            if total is not None:
+                total = max(0, total - skipped)
+                if not total:
+                    print("✅ Nothing left to upload")
+                    return True
+        mode = f"in batches of {batch_size}" if batch_size > 1 else "one at a time"
+        if self.transport != 'http':
+            mode += f" over {self.transport.upper()} to {self.listener[0]}:{self.listener[1]}"
+        rate = f", target {target_rate:.0f} sheets/sec" if target_rate else ""
+        print(f"📤 Uploading {total if total is not None else 'streamed'} stat sheets "
+              f"({mode}, {concurrency} workers{rate})...")
         
-        success_count = 0
-        failed_count = 0
-        start_time = time.time()
+        rate_limiter = TokenBucket(target_rate, capacity=max(target_rate, batch_size)) if target_rate else None
+        upload_stats = UploadStats()
+        with self.payload_lock:
+            self.payload_bytes = 0
+            self.encode_seconds = 0.0
+            self.retries = 0
+        shown_errors = 0
+        next_report = time.monotonic() + PROGRESS_INTERVAL
+        sheets = islice(stat_sheets, skipped, None)
+        offset = skipped
         
-        for i, stat_sheet in enumerate(stat_sheets):
-            success, result = self.send_stat_sheet(stat_sheet)
-            
-            if success:
-                success_count += 1
-            else:
-                failed_count += 1
-                if failed_count <= 5:  # Show first 5 errors only
-                    print(f"❌ Failed to send sheet {i+1}: {result}")
-            
-            # Progress update every 50 sheets
-            if (i + 1) % 50 == 0:
-                elapsed = time.time() - start_time
-                rate = (i + 1) / elapsed
-                print(f"Progress: {i+1}/{len(stat_sheets)} sheets sent ({rate:.1f}/sec)")
-            
-            # Small delay to avoid overwhelming the server
-            time.sleep(0.01)
+        # Save the checkpoint however the upload ends (including Ctrl+C)
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                in_flight = {}
+                exhausted = False
+                
+                while in_flight or not exhausted:
+                    # Keep every worker busy without materializing the whole upload
+                    while not exhausted and len(in_flight) < concurrency * 2:
+                        chunk = list(islice(sheets, batch_size))
+                        if not chunk:
+                            exhausted = True
+                            break
+                        future = executor.submit(self._send_chunk, chunk, batch_size, rate_limiter)
+                        in_flight[future] = (offset, len(chunk))
+                        offset += len(chunk)
+                
+                    if not in_flight:
+                        break
+                
+                    done, _ = wait(in_flight, timeout=PROGRESS_INTERVAL, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        start, size = in_flight.pop(future)
+                        succeeded, errors, latency, answered = future.result()
+                        upload_stats.record(size, succeeded, latency)
+                        if checkpoint and answered:
+                            checkpoint.mark_done(start, size)
+                        for index, error in errors[:max(0, 5 - shown_errors)]:  # Show first 5 errors only
+                            print(f"❌ Failed to send sheet {start + index + 1}: {error}")
+                        shown_errors += len(errors)
+                
+                    # Live progress: throughput and latency so far
+                    if time.monotonic() >= next_report:
+                        next_report = time.monotonic() + PROGRESS_INTERVAL
+                        p50, p95 = upload_stats.percentiles(50, 95)
+                        progress = f"{upload_stats.sent}/{total}" if total is not None else f"{upload_stats.sent}"
+                        print(f"Progress: {progress} sheets sent ({upload_stats.throughput():.1f}/sec, "
+                              f"p50 {p50:.1f}ms, p95 {p95:.1f}ms)")
+                        if checkpoint:
+                            checkpoint.save()
+        finally:
+            if checkpoint:
+                checkpoint.save()
         
-        elapsed = time.time() - start_time
-        print(f"\n📊 Upload completed in {elapsed:.1f} seconds")
+        elapsed = time.monotonic() - upload_stats.start_time
+        p50, p95, p99 = upload_stats.percentiles(50, 95, 99)
+        success_count = upload_stats.succeeded
+        print(f"\n📊 Upload completed in {elapsed:.1f} seconds ({upload_stats.throughput():.1f} sheets/sec)")
+        print(f"⏱️  Request latency: p50 {p50:.1f}ms | p95 {p95:.1f}ms | p99 {p99:.1f}ms")
+        if upload_stats.sent:
+            if self.transport != 'http':
+                encoding = f"ndjson over {self.transport}"
+            else:
+                encoding = self.encoding + ('+gzip' if self.compress else '')
+            print(f"📦 Payload ({encoding}): {self.payload_bytes / upload_stats.sent:.1f} bytes/sheet on the wire, "
+                  f"{self.encode_seconds / upload_stats.sent * 1e6:.1f}µs encode CPU/sheet")
         print(f"✅ Successfully sent: {success_count} stat sheets")
-        print(f"❌ Failed: {failed_count} stat sheets")
+        print(f"❌ Failed: {upload_stats.failed} stat sheets")
+        if self.retries:
+            print(f"🔁 Retried requests: {self.retries}")
+        if checkpoint:
+            print(f"💾 Checkpoint: {checkpoint.completed} stat sheets done ({checkpoint.path})")
+        if self.transport != 'http':
+            # TCP summaries arrive once the listener has settled everything sent
+            summary = self.close_senders()
+            if summary:
+                print(f"📨 Listener committed {summary['committed']} of {summary['received']} stat sheets "
+                      f"({summary['duplicates']} already stored, {summary['rejected']} rejected, "
+                      f"{summary['failed']} failed to commit)")
+                success_count = summary['committed']
+            else:
+                print("📨 UDP datagrams are not acknowledged; check the listener's counters")
         
         # Get final server stats
         try:
@@ -144,26 +651,72 @@ def main():
     parser.add_argument('--players', type=int, default=4, help='Number of players per match')
     parser.add_argument('--server', default='http://localhost:5000', help='Server URL')
     parser.add_argument('--generate-only', action='store_true', help='Generate data but don\'t upload')
+    parser.add_argument('--batch-size', type=int, default=1, help='Stat sheets per upload request (>1 uses /api/submit/batch)')
+    parser.add_argument('--concurrency', type=int, default=1, help='Number of parallel upload workers')
+    parser.add_argument('--target-rate', type=float, default=None, help='Max stat sheets per second (default: unlimited)')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed for reproducible data')
+    parser.add_argument('--run-id', default=None, help='Prefix for generated match IDs (default: from --seed, else random)')
+    parser.add_argument('--output', default='generated_stat_sheets.ndjson', help='NDJSON file written by --generate-only')
+    parser.add_argument('--encoding', choices=payloads.ENCODINGS, default='json', help='Upload body encoding')
+    parser.add_argument('--gzip', action='store_true', help='gzip-compress upload bodies (Content-Encoding: gzip)')
+    parser.add_argument('--checkpoint', default=None, help='Progress file for resuming an interrupted upload (requires --seed)')
+    parser.add_argument('--max-retries', type=int, default=MAX_RETRIES, help='Retries per request, with exponential backoff')
+    parser.add_argument('--transport', choices=TRANSPORTS, default='http', help='Upload over HTTP, or as NDJSON lines to ingest_listener.py over TCP or UDP')
+    parser.add_argument('--listener', default=None, help='Ingest listener HOST:PORT for --transport tcp/udp '
+                        f'(default: the --server host, port {DEFAULT_TCP_PORT} for TCP or {DEFAULT_UDP_PORT} for UDP)')
     
     args = parser.parse_args()
+    if args.encoding == 'msgpack' and payloads.msgpack is None:
+        parser.error("--encoding msgpack requires the 'msgpack' package (pip install msgpack)")
+    if args.checkpoint and args.seed is None:
+        parser.error("--checkpoint requires --seed so a resumed run regenerates the same stat sheets")
+    listener = None
+    if args.transport != 'http':
+        if args.encoding != 'json' or args.gzip:
+            parser.error("--transport tcp/udp always sends uncompressed NDJSON")
+        if args.checkpoint:
+            parser.error("--checkpoint needs --transport http (line transports are not acknowledged per sheet)")
+        listener = (urlparse(args.server).hostname or 'localhost',
+                    DEFAULT_TCP_PORT if args.transport == 'tcp' else DEFAULT_UDP_PORT)
+        if args.listener:
+            host, _, port = args.listener.rpartition(':')
+            if not host or not port.isdigit():
+                parser.error("--listener must be HOST:PORT")
+            listener = (host, int(port))
     
     print("🎯 Loot Telemetry Data Generator")
     print("=" * 40)
     
-    generator = LootTelemetryDataGenerator(args.server)
-    
-    # Generate the data
-    stat_sheets = generator.generate_match_data(args.matches, args.players)
+    generator = LootTelemetryDataGenerator(args.server, seed=args.seed, encoding=args.encoding, compress=args.gzip,
+                                           transport=args.transport, listener=listener, run_id=args.run_id)
+    generator.max_retries = args.max_retries
+    total = args.matches * args.players
+    print(f"🎮 Generating data for {args.matches} matches ({args.players} players each), run {generator.run_id}")
     
     if args.generate_only:
+        # Stream chunks straight to disk instead of building the whole dataset
         print("📁 Saving data to files...")
-        # Save to JSON files for inspection
-        with open('generated_stat_sheets.json', 'w') as f:
-            json.dump(stat_sheets, f, indent=2)
-        print("✅ Data saved to generated_stat_sheets.json")
+        start_time = time.time()
+        written = generator.write_ndjson(args.output, args.matches, args.players)
+        print(f"✅ {written} stat sheets saved to {args.output} in {time.time() - start_time:.1f} seconds")
     else:
-        # Upload to server
-        success = generator.upload_data_to_server(stat_sheets)
+        # Generated chunks feed the uploader as they are produced
+        checkpoint = None
+        if args.checkpoint:
+            run = {'matches': args.matches, 'players': args.players, 'seed': args.seed, 'run_id': generator.run_id}
+            try:
+                checkpoint = UploadCheckpoint(args.checkpoint, run)
+            except ValueError as e:
+                parser.error(str(e))
+        stat_sheets = chain.from_iterable(generator.generate_chunks(args.matches, args.players))
+        success = generator.upload_data_to_server(
+            stat_sheets,
+            batch_size=args.batch_size,
+            concurrency=args.concurrency,
+            target_rate=args.target_rate,
+            total=total,
+            checkpoint=checkpoint
+        )
         if success:
             print("🎉 Data generation and upload completed successfully!")
         else:
@@ -3,20 +3,205 @@ Database Handler for Loot Telemetry Simulator
 Handles SQLite database operations for storing and retrieving stat sheets
 """
 
+import argparse
+import gzip
+import heapq
 import sqlite3
 import json
-from datetime import datetime
+import numpy as np
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+from datetime import datetime, timedelta, timezone
 import os
 
+import metrics
+from sketches import HyperLogLog, KllSketch, hll_register
+
+# Connection tuning applied to every pooled connection
+BUSY_TIMEOUT_SECONDS = 30
+CACHE_SIZE_KB = 16384  # 16 MB page cache per connection
+MAX_IDLE_CONNECTIONS = 8
+
+# Bumped whenever init_database needs to migrate existing databases
+SCHEMA_VERSION = 10
+
+# Running totals kept in rollup_counters
+ROLLUP_COUNTERS = ('stat_sheets', 'matches', 'players', 'archived_stat_sheets', 'sketched_through')
+
+# Time rollup granularities: ISO-8601 prefix length kept, and the suffix that
+# turns the prefix back into the bucket's start time
+TIME_BUCKETS = {
+    'minute': (16, ':00'),
+    'hour': (13, ':00:00'),
+    'day': (10, 'T00:00:00')
+}
+TIMESERIES_MAX_POINTS = 50000
+
+# stat_sheets columns read back into stat sheet dicts
+STAT_SHEET_COLUMNS = 'id, match_id, player_id, timestamp, created_at, match_duration, player_level, loot_per_minute'
+
+# Range filters on the typed, indexed stat sheet columns: query param ->
+# (column, comparison, value type)
+RANGE_FILTERS = {
+    'min_level': ('player_level', '>=', int),
+    'max_level': ('player_level', '<=', int),
+    'min_duration': ('match_duration', '>=', int),
+    'max_duration': ('match_duration', '<=', int),
+    'min_loot_rate': ('loot_per_minute', '>=', float),
+    'max_loot_rate': ('loot_per_minute', '<=', float),
+}
+
+# Player levels per level band: band b covers levels b*size+1 .. (b+1)*size
+LEVEL_BAND_SIZE = 10
+LEVEL_BAND_ALL_ITEMS = '*'
+
+# Stat sheet IDs per sheet_items lookup (SQLite caps bound parameters)
+ITEM_FETCH_CHUNK = 500
+
+# Stat sheets fetched per keyset query when iterating or paging
+STAT_SHEET_CHUNK = 500
+
+# Heatmap defaults: the game map spans 0-100 on both axes
+HEATMAP_BINS = 20
+HEATMAP_RANGE = ((0.0, 100.0), (0.0, 100.0))
+HEATMAP_FETCH_CHUNK = 50000  # sheet_items rows per vectorized histogram pass
+
+# Spatial grid: 10x10 cells over the 0-100 map; sheet_items.cell = cx * SPATIAL_GRID + cy
+SPATIAL_GRID = 10
+SPATIAL_CELL_SIZE = 10.0
+
+# Retention: archived sheets go to gzip NDJSON files in ARCHIVE_CHUNK batches;
+# their heatmap points are kept as counts on a 1x1 grid
+ARCHIVE_DIR = 'archive'
+# Duplicate stat sheets removed on upgrade are archived next to the database,
+# in its file name without the extension plus this suffix
+DUPLICATES_ARCHIVE_SUFFIX = '.duplicates'
+ARCHIVE_CHUNK = 5000
+RETENTION_INTERVAL = 3600  # seconds between background retention runs
+HEATMAP_ARCHIVE_CELL = 1.0
+VACUUM_STEP_PAGES = 1000  # free pages released per incremental vacuum transaction
+
+# Leaderboards: board name -> (totals table, owner column). Each table keeps
+# all-time per-owner item totals; item LEADERBOARD_ALL_ITEMS holds the sum
+# over every item
+LEADERBOARDS = {
+    'players': ('player_totals', 'player_id'),
+    'matches': ('match_totals', 'match_id'),
+}
+LEADERBOARD_ALL_ITEMS = '*'
+LEADERBOARD_DEFAULT_K = 10
+LEADERBOARD_MAX_K = 1000
+
+# Mergeable sketches kept on ingest (see sketches.py): HyperLogLog registers
+# per distinct-count name -> stat sheet column, and a KLL sketch of per-sheet
+# counts per item ('*' = all items of the sheet summed). Each is kept all
+# time (day SKETCH_ALL_TIME) and per day (day = the day bucket's start).
+DISTINCT_SKETCHES = {'matches': 'match_id', 'players': 'player_id'}
+SKETCH_ALL_ITEMS = '*'
+SKETCH_ALL_TIME = ''
+# Inserts leave the quantile sketches alone: stat sheets past the
+# 'sketched_through' rollup counter (a stat sheet ID) are merged in at read
+# time, and folded into the stored sketches once this many have piled up
+SKETCH_COMPACT_SHEETS = 1000
+
+# Columnar export: rows copied per chunk and the manifest format version
+EXPORT_CHUNK = 50000
+COLUMNAR_FORMAT_VERSION = 1
+
+# Write-behind ingest defaults
+INGEST_QUEUE_SIZE = 10000
+INGEST_FLUSH_SIZE = 500
+INGEST_FLUSH_INTERVAL = 0.05  # seconds
+
+class ConnectionPool:
+    """Thread-safe pool of long-lived SQLite connections in WAL mode"""
+    
+    def __init__(self, db_path, max_idle=MAX_IDLE_CONNECTIONS):
+        self.db_path = db_path
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+        self._lock = threading.Lock()
+        self._closed = False
+        self.opened = 0
+    
+    def _connect(self):
+        """Open a new connection with WAL journaling and tuned pragmas"""
+        conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_SECONDS, check_same_thread=False)
+        # Must precede the switch to WAL to apply to a new file; older files
+        # need a one-time VACUUM to change it (see enable_incremental_vacuum)
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        # WAL lets readers proceed while a writer holds the lock
+        conn.execute("PRAGMA journal_mode=WAL")
+        # NORMAL is durable across application crashes in WAL mode and skips
+        # the fsync on every commit
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        with self._lock:
+            self.opened += 1
+        return conn
+    
+    def _acquire(self):
+        """Take an idle connection, or open a new one if none is available"""
+        if self._closed:
+            raise sqlite3.ProgrammingError("Connection pool is closed")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+    
+    def _release(self, conn):
+        """Return a connection to the pool, closing it if the pool is full or closed"""
+        if self._closed:
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+    
+    @contextmanager
+    def connection(self):
+        """Check out a connection for one transaction (commit on success, rollback on error)"""
+        conn = self._acquire()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self._release(conn)
+    
+    def close(self):
+        """Close all idle connections; checked-out connections close on release"""
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
 class DatabaseHandler:
     def __init__(self, db_path="loot_telemetry.db"):
         """Initialize database connection and create tables if they don't exist"""
         self.db_path = db_path
+        self.pool = ConnectionPool(db_path)
         self.init_database()
     
+    def connection(self):
+        """Check out a pooled connection (use as a context manager)"""
+        return self.pool.connection()
+    
+    @property
+    def connections_opened(self):
+        """SQLite connections opened so far by the pool"""
+        return self.pool.opened
+    
     def init_database(self):
         """Create database tables if they don't exist"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connection() as conn:
             cursor = conn.cursor()
             
             # Create stat_sheets table
@@ -26,11 +211,171 @@ class DatabaseHandler:
                     match_id TEXT NOT NULL,
                     player_id TEXT NOT NULL,
                     timestamp TEXT NOT NULL,
-                    looted_items TEXT NOT NULL,
-                    locations TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    match_duration INTEGER,
+                    player_level INTEGER,
+                    items_looted INTEGER NOT NULL DEFAULT 0,
+                    loot_per_minute REAL
+                )
+            ''')
+            
+            # One row per looted item; x/y/cell are NULL when no location was reported
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS sheet_items (
+                    sheet_id INTEGER NOT NULL,
+                    item TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    x REAL,
+                    y REAL,
+                    cell INTEGER
+                )
+            ''')
+            
+            # Rollup tables, maintained in the same transaction as each insert
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS item_totals (
+                    item TEXT PRIMARY KEY,
+                    total INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS seen_matches (
+                    match_id TEXT PRIMARY KEY
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS seen_players (
+                    player_id TEXT PRIMARY KEY
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS rollup_counters (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            cursor.executemany(
+                "INSERT OR IGNORE INTO rollup_counters (name, value) VALUES (?, 0)",
+                [(name,) for name in ROLLUP_COUNTERS]
+            )
+            
+            # Items looted per time bucket, one table per granularity
+            for bucket in TIME_BUCKETS:
+                cursor.execute(f'''
+                    CREATE TABLE IF NOT EXISTS item_totals_{bucket} (
+                        bucket_start TEXT NOT NULL,
+                        item TEXT NOT NULL,
+                        total INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (bucket_start, item)
+                    ) WITHOUT ROWID
+                ''')
+            
+            # Contributions of archived stat sheets, so rebuilds and heatmaps
+            # still cover data that left the raw tables. kind is 'all' (with
+            # an empty bucket_start) or a TIME_BUCKETS granularity.
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS archived_totals (
+                    kind TEXT NOT NULL,
+                    bucket_start TEXT NOT NULL,
+                    item TEXT NOT NULL,
+                    total INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (kind, bucket_start, item)
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS heatmap_archive (
+                    item TEXT NOT NULL,
+                    cx INTEGER NOT NULL,
+                    cy INTEGER NOT NULL,
+                    total INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (item, cx, cy)
+                ) WITHOUT ROWID
+            ''')
+            # Keys of archived stat sheets, so retries of them are still duplicates
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS archived_sheet_keys (
+                    match_id TEXT NOT NULL,
+                    player_id TEXT NOT NULL,
+                    sheet_id INTEGER NOT NULL,
+                    PRIMARY KEY (match_id, player_id)
+                ) WITHOUT ROWID
+            ''')
+            
+            # Per-player and per-match leaderboard totals. archived is the part
+            # of total contributed by archived stat sheets, kept on rebuilds.
+            # The rank index covers "top k owners for an item" so it is read
+            # in order and stops after k rows.
+            for table, owner in LEADERBOARDS.values():
+                cursor.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        item TEXT NOT NULL,
+                        {owner} TEXT NOT NULL,
+                        total INTEGER NOT NULL DEFAULT 0,
+                        archived INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (item, {owner})
+                    ) WITHOUT ROWID
+                ''')
+                cursor.execute(f'''
+                    CREATE INDEX IF NOT EXISTS idx_{table}_rank ON {table}(item, total DESC, {owner})
+                ''')
+            
+            # Sketches. HyperLogLog registers are stored one row each, so an
+            # insert only rewrites the registers it raises. archived is the
+            # part of a quantile sketch from archived stat sheets, kept on rebuilds.
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS hll_registers (
+                    name TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    register INTEGER NOT NULL,
+                    rank INTEGER NOT NULL,
+                    PRIMARY KEY (name, day, register)
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS quantile_sketches (
+                    item TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    sketch BLOB NOT NULL,
+                    archived BLOB,
+                    PRIMARY KEY (item, day)
+                ) WITHOUT ROWID
+            ''')
+            
+            # Loot per level band, per item ('*' = all items). timed_total is
+            # the part of total from sheets with a match_duration, which is
+            # what loot per minute divides by duration_seconds.
+            for table in ('level_band_totals', 'archived_level_band_totals'):
+                cursor.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        band INTEGER NOT NULL,
+                        item TEXT NOT NULL,
+                        stat_sheets INTEGER NOT NULL DEFAULT 0,
+                        total INTEGER NOT NULL DEFAULT 0,
+                        timed_total INTEGER NOT NULL DEFAULT 0,
+                        duration_seconds INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (band, item)
+                    ) WITHOUT ROWID
+                ''')
+            
+            # Single-row data version, bumped by every write so readers can
+            # cheaply tell whether cached results are still current
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS data_generation (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    generation INTEGER NOT NULL DEFAULT 0,
+                    modified_at REAL NOT NULL
                 )
             ''')
+            cursor.execute(
+                "INSERT OR IGNORE INTO data_generation (id, generation, modified_at) VALUES (1, 0, ?)",
+                (time.time(),)
+            )
+            
+            # Bring databases created by older versions up to date
+            version = cursor.execute("PRAGMA user_version").fetchone()[0]
+            if version < SCHEMA_VERSION:
+                self._migrate(cursor, version)
+                cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
             
             # Create index for faster queries
             cursor.execute('''
@@ -39,133 +384,2490 @@ class DatabaseHandler:
             cursor.execute('''
                 CREATE INDEX IF NOT EXISTS idx_player_id ON stat_sheets(player_id)
             ''')
+            # One stat sheet per player per match: resubmits are idempotent
+            cursor.execute('''
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_match_player ON stat_sheets(match_id, player_id)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_timestamp ON stat_sheets(timestamp)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_created_at ON stat_sheets(created_at)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_player_level ON stat_sheets(player_level)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_match_duration ON stat_sheets(match_duration)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_loot_per_minute ON stat_sheets(loot_per_minute)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_sheet_items_sheet ON sheet_items(sheet_id)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_sheet_items_item ON sheet_items(item)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_sheet_items_cell ON sheet_items(item, cell)
+            ''')
             
             conn.commit()
             print("Database initialized successfully")
     
+    def _migrate(self, cursor, version):
+        """Upgrade an existing database from the given schema version"""
+        if version < 2:
+            # looted_items/locations moved from JSON columns into sheet_items
+            self._normalize_json_columns(cursor)
+        if version < 3:
+            # idx_sheet_items_item changed from (item, count) to (item) so
+            # per-item scans come back in rowid order for keyset pagination
+            cursor.execute("DROP INDEX IF EXISTS idx_sheet_items_item")
+        if version < 9:
+            # stat_sheets gained match_duration, player_level and derived columns
+            self._add_sheet_metrics(cursor)
+        # (match_id, player_id) became unique: resolve earlier repeats first
+        changed = self._unique_sheet_keys(cursor) if version < 6 else 0
+        if version < 1 or changed:
+            # Rollup tables are new (or counted the old keys): rebuild them
+            # from the raw stat sheets
+            self._rebuild_rollups(cursor)
+        else:
+            if version < 4:
+                # Time-bucketed rollups are new: backfill just those
+                self._rebuild_time_rollups(cursor)
+            if version < 7:
+                # Leaderboard totals are new: backfill just those
+                self._rebuild_leaderboards(cursor)
+            if version < 8:
+                # Sketches are new: backfill just those
+                self._rebuild_sketches(cursor)
+            if version < 9:
+                # Level band totals are new: backfill just those
+                self._rebuild_level_bands(cursor)
+        if version < 5:
+            # sheet_items gained the spatial grid cell column
+            self._add_spatial_cells(cursor)
+        if version < 10:
+            # Inserts stopped updating the quantile sketches; every sheet so
+            # far is already in them
+            cursor.execute('''
+                UPDATE rollup_counters SET value = (SELECT COALESCE(MAX(id), 0) FROM stat_sheets)
+                WHERE name = 'sketched_through'
+            ''')
+    
+    def _normalize_json_columns(self, cursor):
+        """Move the legacy looted_items/locations JSON columns into sheet_items"""
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(stat_sheets)")]
+        if 'looted_items' not in columns:
+            return
+        
+        cursor.execute('''
+            INSERT INTO sheet_items (sheet_id, item, count, x, y)
+            SELECT s.id, loot.key, loot.value,
+                   json_extract(loc.value, '$[0]'), json_extract(loc.value, '$[1]')
+            FROM stat_sheets AS s
+            JOIN json_each(s.looted_items) AS loot
+            LEFT JOIN json_each(s.locations) AS loc ON loc.key = loot.key
+            ORDER BY s.id, loot.id
+        ''')
+        
+        # Rebuild stat_sheets without the JSON columns, keeping IDs and the
+        # AUTOINCREMENT sequence so deleted IDs are never reused
+        sequence = cursor.execute(
+            "SELECT seq FROM sqlite_sequence WHERE name = 'stat_sheets'"
+        ).fetchone()
+        cursor.execute('''
+            CREATE TABLE stat_sheets_normalized (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                match_id TEXT NOT NULL,
+                player_id TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            INSERT INTO stat_sheets_normalized (id, match_id, player_id, timestamp, created_at)
+            SELECT id, match_id, player_id, timestamp, created_at FROM stat_sheets
+        ''')
+        cursor.execute("DROP TABLE stat_sheets")
+        cursor.execute("ALTER TABLE stat_sheets_normalized RENAME TO stat_sheets")
+        if sequence:
+            cursor.execute(
+                "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'stat_sheets'",
+                sequence
+            )
+    
+    def _unique_sheet_keys(self, cursor):
+        """Make (match_id, player_id) unique in an older database, returning how many sheets changed.
+        
+        Repeats with the same timestamp are resends of one submission: all but
+        the first are archived and deleted. Repeats with other timestamps came
+        from separate runs that reused the key (older generators numbered
+        every run's matches from match_001), so they are kept and the nth copy
+        of a key gets match_id '<match_id>~<n>' instead.
+        """
+        cursor.execute('''
+            CREATE TEMP TABLE duplicate_sheets AS
+            SELECT id FROM stat_sheets
+            WHERE id NOT IN (SELECT MIN(id) FROM stat_sheets GROUP BY match_id, player_id, timestamp)
+        ''')
+        
+        # Nothing is deleted before it is in an archive file: a failed upgrade
+        # rolls back and rewrites the same files on the next open
+        archive_dir = os.path.splitext(self.db_path)[0] + DUPLICATES_ARCHIVE_SUFFIX
+        last_id = 0
+        while True:
+            rows = cursor.execute(f'''
+                SELECT {STAT_SHEET_COLUMNS} FROM stat_sheets
+                WHERE id IN (SELECT id FROM duplicate_sheets WHERE id > ? ORDER BY id LIMIT ?)
+                ORDER BY id
+            ''', (last_id, ARCHIVE_CHUNK)).fetchall()
+            if not rows:
+                break
+            os.makedirs(archive_dir, exist_ok=True)
+            self._write_archive(archive_dir, self._load_stat_sheets(cursor, rows))
+            last_id = rows[-1][0]
+        
+        cursor.execute("DELETE FROM sheet_items WHERE sheet_id IN (SELECT id FROM duplicate_sheets)")
+        cursor.execute("DELETE FROM stat_sheets WHERE id IN (SELECT id FROM duplicate_sheets)")
+        removed = cursor.rowcount
+        cursor.execute("DROP TABLE duplicate_sheets")
+        if removed:
+            print(f"Removed {removed} duplicate stat sheets (archived to {archive_dir})")
+        
+        cursor.execute('''
+            UPDATE stat_sheets SET match_id = stat_sheets.match_id || '~' || copies.copy
+            FROM (
+                SELECT id, ROW_NUMBER() OVER (PARTITION BY match_id, player_id ORDER BY id) AS copy
+                FROM stat_sheets
+            ) AS copies
+            WHERE stat_sheets.id = copies.id AND copies.copy > 1
+        ''')
+        renamed = cursor.rowcount
+        if renamed:
+            print(f"Renamed the matches of {renamed} stat sheets that reused an earlier sheet's key")
+        return removed + renamed
+    
+    def _add_spatial_cells(self, cursor):
+        """Add and backfill sheet_items.cell for databases created before it existed"""
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(sheet_items)")]
+        if 'cell' not in columns:
+            cursor.execute("ALTER TABLE sheet_items ADD COLUMN cell INTEGER")
+        
+        # Same clamped truncation as spatial_cell()
+        cursor.execute('''
+            UPDATE sheet_items SET cell =
+                MIN(MAX(CAST(x / :size AS INTEGER), 0), :grid - 1) * :grid +
+                MIN(MAX(CAST(y / :size AS INTEGER), 0), :grid - 1)
+            WHERE x IS NOT NULL AND cell IS NULL
+        ''', {'size': SPATIAL_CELL_SIZE, 'grid': SPATIAL_GRID})
+    
+    def _add_sheet_metrics(self, cursor):
+        """Add the match_duration/player_level and derived columns, backfilling items_looted"""
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(stat_sheets)")]
+        for name, column_type in (('match_duration', 'INTEGER'), ('player_level', 'INTEGER'),
+                                  ('items_looted', 'INTEGER NOT NULL DEFAULT 0'), ('loot_per_minute', 'REAL')):
+            if name not in columns:
+                cursor.execute(f"ALTER TABLE stat_sheets ADD COLUMN {name} {column_type}")
+        
+        # Earlier versions dropped durations and levels, so there is no rate to backfill
+        cursor.execute('''
+            UPDATE stat_sheets SET items_looted =
+                (SELECT COALESCE(SUM(count), 0) FROM sheet_items WHERE sheet_id = stat_sheets.id)
+        ''')
+    
     def insert_stat_sheet(self, stat_sheet):
         """Insert a single stat sheet into the database"""
+        sheet_ids = self.insert_stat_sheets([stat_sheet])
+        return sheet_ids[0] if sheet_ids else None
+    
+    @metrics.timed_query('insert_stat_sheets')
+    def insert_stat_sheets(self, stat_sheets, report_duplicates=False):
+        """Insert many stat sheets with one executemany in a single transaction.
+        
+        Stat sheets are unique per (match_id, player_id) and the first one
+        stored wins: a resubmitted sheet is not written again (nor counted in
+        the rollups) and gets the ID of the stored one, so retries are safe.
+        Returns the list of IDs in input order, or (id, duplicate) pairs with
+        report_duplicates, or None if the batch failed (the whole batch is
+        rolled back in that case).
+        """
+        if not stat_sheets:
+            return []
+        
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connection() as conn:
                 cursor = conn.cursor()
+                # Take the write lock before looking for duplicates, so no
+                # other writer can store one of these keys in between
+                cursor.execute("BEGIN IMMEDIATE")
+                
+                keys = [(sheet['match_id'], sheet['player_id']) for sheet in stat_sheets]
+                existing = self._existing_sheet_ids(cursor, keys)
+                new_positions = []
+                for position, key in enumerate(keys):
+                    if key not in existing:
+                        existing[key] = None  # later copies in this batch are duplicates
+                        new_positions.append(position)
+                new_sheets = [stat_sheets[position] for position in new_positions]
                 
-                cursor.execute('''
-                    INSERT INTO stat_sheets (match_id, player_id, timestamp, looted_items, locations)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (
-                    stat_sheet['match_id'],
-                    stat_sheet['player_id'],
-                    stat_sheet['timestamp'],
-                    json.dumps(stat_sheet['looted_items']),
-                    json.dumps(stat_sheet.get('locations', {}))
-                ))
+                if new_sheets:
+                    cursor.executemany('''
+                        INSERT INTO stat_sheets (match_id, player_id, timestamp, match_duration, player_level,
+                                                 items_looted, loot_per_minute)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ''', [self._stat_sheet_row(sheet) for sheet in new_sheets])
+                    
+                    # The write lock is held until commit, so AUTOINCREMENT hands out
+                    # a contiguous block of IDs ending at the last inserted row
+                    last_id = cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
+                    first_id = last_id - len(new_sheets) + 1
+                    for position, sheet_id in zip(new_positions, range(first_id, last_id + 1)):
+                        existing[keys[position]] = sheet_id
+                    
+                    cursor.executemany('''
+                        INSERT INTO sheet_items (sheet_id, item, count, x, y, cell)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    ''', [
+                        item_row
+                        for sheet_id, sheet in zip(range(first_id, last_id + 1), new_sheets)
+                        for item_row in self._sheet_item_rows(sheet_id, sheet)
+                    ])
+                    
+                    self._update_rollups(cursor, new_sheets)
+                    self._bump_generation(cursor)
+                    compact = last_id - self._sketch_watermark(cursor) >= SKETCH_COMPACT_SHEETS
+                else:
+                    compact = False
+                conn.commit()
+                if compact:
+                    self.compact_sketches()
                 
+                sheet_ids = [existing[key] for key in keys]
+                if not report_duplicates:
+                    return sheet_ids
+                new = set(new_positions)
+                return [(sheet_id, position not in new) for position, sheet_id in enumerate(sheet_ids)]
+        except Exception as e:
+            print(f"Error inserting stat sheets: {e}")
+            metrics.record_db_error('insert_stat_sheets')
+            return None
+    
+    @staticmethod
+    def _existing_sheet_ids(cursor, keys):
+        """Map the (match_id, player_id) keys that are already stored (or archived) to their stat sheet IDs"""
+        wanted = set(keys)
+        match_ids = list({match_id for match_id, _ in wanted})
+        existing = {}
+        for start in range(0, len(match_ids), ITEM_FETCH_CHUNK):
+            chunk = match_ids[start:start + ITEM_FETCH_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            for sheet_id, match_id, player_id in cursor.execute(f'''
+                SELECT id, match_id, player_id FROM stat_sheets WHERE match_id IN ({placeholders})
+                UNION ALL
+                SELECT sheet_id, match_id, player_id FROM archived_sheet_keys WHERE match_id IN ({placeholders})
+            ''', chunk + chunk):
+                if (match_id, player_id) in wanted:
+                    existing[(match_id, player_id)] = sheet_id
+        return existing
+    
+    def _update_rollups(self, cursor, stat_sheets):
+        """Fold newly inserted stat sheets into the rollup tables"""
+        item_totals = {}
+        for sheet in stat_sheets:
+            for item, count in sheet['looted_items'].items():
+                item_totals[item] = item_totals.get(item, 0) + count
+        
+        cursor.executemany('''
+            INSERT INTO item_totals (item, total) VALUES (?, ?)
+            ON CONFLICT(item) DO UPDATE SET total = total + excluded.total
+        ''', list(item_totals.items()))
+        
+        # executemany's rowcount sums the rows actually inserted, i.e. the new IDs
+        cursor.executemany(
+            "INSERT OR IGNORE INTO seen_matches (match_id) VALUES (?)",
+            [(match_id,) for match_id in {sheet['match_id'] for sheet in stat_sheets}]
+        )
+        new_matches = cursor.rowcount
+        cursor.executemany(
+            "INSERT OR IGNORE INTO seen_players (player_id) VALUES (?)",
+            [(player_id,) for player_id in {sheet['player_id'] for sheet in stat_sheets}]
+        )
+        new_players = cursor.rowcount
+        
+        cursor.executemany(
+            "UPDATE rollup_counters SET value = value + ? WHERE name = ?",
+            [(len(stat_sheets), 'stat_sheets'), (new_matches, 'matches'), (new_players, 'players')]
+        )
+        
+        for bucket in TIME_BUCKETS:
+            cursor.executemany(f'''
+                INSERT INTO item_totals_{bucket} (bucket_start, item, total) VALUES (?, ?, ?)
+                ON CONFLICT(bucket_start, item) DO UPDATE SET total = total + excluded.total
+            ''', self._time_bucket_rows(stat_sheets, bucket))
+        
+        self._update_leaderboards(cursor, stat_sheets)
+        self._update_distinct_sketches(cursor, stat_sheets)
+        self._update_level_bands(cursor, stat_sheets)
+    
+    def _update_leaderboards(self, cursor, stat_sheets, column='total'):
+        """Add stat sheets' item counts to the per-player and per-match totals.
+        
+        With column='archived' the counts are recorded as archived instead
+        (their total already includes them).
+        """
+        for table, owner in LEADERBOARDS.values():
+            cursor.executemany(f'''
+                INSERT INTO {table} (item, {owner}, total, archived) VALUES (?, ?, ?, ?)
+                ON CONFLICT(item, {owner}) DO UPDATE SET {column} = {column} + excluded.{column}
+            ''', [(*key, total, total if column == 'archived' else 0)
+                  for key, total in self._leaderboard_rows(stat_sheets, owner).items()])
+    
+    @staticmethod
+    def _leaderboard_rows(stat_sheets, owner):
+        """Sum stat sheets per (item, owner), skipping zero counts"""
+        totals = {}
+        for sheet in stat_sheets:
+            owner_id = sheet[owner]
+            for item, count in sheet['looted_items'].items():
+                if count > 0:
+                    for key in ((item, owner_id), (LEADERBOARD_ALL_ITEMS, owner_id)):
+                        totals[key] = totals.get(key, 0) + count
+        return totals
+    
+    def _update_sketches(self, cursor, stat_sheets, column='sketch'):
+        """Add stat sheets to the distinct-count and quantile sketches.
+        
+        With column='archived' only the archived part of the quantile
+        sketches is updated (the sketches already include the sheets, and
+        HyperLogLog registers never go down).
+        """
+        if column == 'sketch':
+            self._update_distinct_sketches(cursor, stat_sheets)
+        self._update_quantile_sketches(cursor, self._quantile_inputs(stat_sheets), column)
+    
+    def _update_distinct_sketches(self, cursor, stat_sheets):
+        """Raise the HyperLogLog registers for stat sheets (inserts skip the quantile sketches)"""
+        cursor.executemany('''
+            INSERT INTO hll_registers (name, day, register, rank) VALUES (?, ?, ?, ?)
+            ON CONFLICT(name, day, register) DO UPDATE SET rank = excluded.rank
+            WHERE excluded.rank > rank
+        ''', [(*key, rank) for key, rank in self._register_ranks(stat_sheets).items()])
+    
+    def _update_quantile_sketches(self, cursor, counts, column='sketch'):
+        """Add per-sheet counts, keyed by (item, day), to the stored KLL sketches"""
+        for (item, day), values in counts.items():
+            row = cursor.execute(
+                f"SELECT {column} FROM quantile_sketches WHERE item = ? AND day = ?", (item, day)
+            ).fetchone()
+            sketch = KllSketch.from_bytes(row[0]) if row and row[0] else KllSketch()
+            sketch.update(values)
+            data = sketch.to_bytes()
+            cursor.execute(f'''
+                INSERT INTO quantile_sketches (item, day, sketch, archived) VALUES (?, ?, ?, ?)
+                ON CONFLICT(item, day) DO UPDATE SET {column} = excluded.{column}
+            ''', (item, day, data, data if column == 'archived' else None))
+    
+    @staticmethod
+    def _sheets_by_day(stat_sheets):
+        by_day = {}
+        for sheet in stat_sheets:
+            by_day.setdefault(time_bucket_start(sheet['timestamp'], 'day'), []).append(sheet)
+        return by_day
+    
+    @classmethod
+    def _register_ranks(cls, stat_sheets):
+        """Highest HyperLogLog rank per (name, day, register)"""
+        registers = {}
+        for day, sheets in cls._sheets_by_day(stat_sheets).items():
+            for name, column in DISTINCT_SKETCHES.items():
+                for register, rank in map(hll_register, {sheet[column] for sheet in sheets}):
+                    for key in ((name, day, register), (name, SKETCH_ALL_TIME, register)):
+                        if rank > registers.get(key, 0):
+                            registers[key] = rank
+        return registers
+    
+    @classmethod
+    def _quantile_inputs(cls, stat_sheets):
+        """Per-sheet counts per (item, day), for the daily and all-time quantile sketches"""
+        counts = {}
+        for day, sheets in cls._sheets_by_day(stat_sheets).items():
+            looted = [sheet['looted_items'] for sheet in sheets]
+            day_counts = {item: [items[item] for items in looted if item in items]
+                          for item in {item for items in looted for item in items}}
+            day_counts[SKETCH_ALL_ITEMS] = [sum(items.values()) for items in looted]
+            for item, values in day_counts.items():
+                counts[(item, day)] = values
+                counts.setdefault((item, SKETCH_ALL_TIME), []).extend(values)
+        return counts
+    
+    @staticmethod
+    def _sketch_watermark(cursor):
+        """Highest stat sheet ID already folded into the quantile sketches"""
+        return cursor.execute("SELECT value FROM rollup_counters WHERE name = 'sketched_through'").fetchone()[0]
+    
+    def _compact_sketches(self, cursor):
+        """Fold the stat sheets past the watermark into the quantile sketches, returning how many"""
+        watermark = self._sketch_watermark(cursor)
+        through = cursor.execute("SELECT COALESCE(MAX(id), 0) FROM stat_sheets").fetchone()[0]
+        if through <= watermark:
+            return 0
+        
+        # Counts repeat a lot, so SQL hands back each distinct value once per day
+        prefix_length, suffix = TIME_BUCKETS['day']
+        rows = cursor.execute('''
+            SELECT ?, replace(substr(timestamp, 1, ?), ' ', 'T') || ? AS day, items_looted, COUNT(*)
+            FROM stat_sheets WHERE id > ? AND id <= ?
+            GROUP BY day, items_looted
+            UNION ALL
+            SELECT i.item, replace(substr(s.timestamp, 1, ?), ' ', 'T') || ? AS day, i.count, COUNT(*)
+            FROM sheet_items AS i JOIN stat_sheets AS s ON s.id = i.sheet_id
+            WHERE i.sheet_id > ? AND i.sheet_id <= ?
+            GROUP BY i.item, day, i.count
+        ''', (SKETCH_ALL_ITEMS, prefix_length, suffix, watermark, through,
+              prefix_length, suffix, watermark, through)).fetchall()
+        
+        counts = {}
+        compacted = 0
+        for item, day, value, copies in rows:
+            counts.setdefault((item, day), []).extend([value] * copies)
+            counts.setdefault((item, SKETCH_ALL_TIME), []).extend([value] * copies)
+            if item == SKETCH_ALL_ITEMS:
+                compacted += copies
+        
+        self._update_quantile_sketches(cursor, counts)
+        cursor.execute("UPDATE rollup_counters SET value = ? WHERE name = 'sketched_through'", (through,))
+        return compacted
+    
+    @metrics.timed_query('compact_sketches')
+    def compact_sketches(self):
+        """Fold stat sheets inserted since the last compaction into the quantile sketches.
+        
+        Inserts only raise the HyperLogLog registers; deserializing, updating
+        and rewriting a KLL sketch per item per insert would dominate the
+        write transaction. Instead reads merge in the sheets past the
+        watermark, and once SKETCH_COMPACT_SHEETS of them have piled up the
+        insert that crossed the line runs this after its own commit.
+        Returns the number of stat sheets folded in, or None on error.
+        """
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                compacted = self._compact_sketches(cursor)
                 conn.commit()
-                return cursor.lastrowid
+                return compacted
         except Exception as e:
-            print(f"Error inserting stat sheet: {e}")
+            print(f"Error compacting sketches: {e}")
+            metrics.record_db_error('compact_sketches')
             return None
     
-    def get_stat_sheets(self, match_id=None, player_id=None, limit=None):
-        """Retrieve stat sheets with optional filtering"""
+    def _update_level_bands(self, cursor, stat_sheets, table='level_band_totals'):
+        """Add stat sheets with a player_level to the level band totals (or to their archive table)"""
+        cursor.executemany(f'''
+            INSERT INTO {table} (band, item, stat_sheets, total, timed_total, duration_seconds)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(band, item) DO UPDATE SET
+                stat_sheets = stat_sheets + excluded.stat_sheets,
+                total = total + excluded.total,
+                timed_total = timed_total + excluded.timed_total,
+                duration_seconds = duration_seconds + excluded.duration_seconds
+        ''', [(*key, *sums) for key, sums in self._level_band_rows(stat_sheets).items()])
+    
+    @staticmethod
+    def _level_band_rows(stat_sheets):
+        """[stat_sheets, total, timed_total, duration_seconds] per (band, item)"""
+        totals = {}
+        for sheet in stat_sheets:
+            level = sheet.get('player_level')
+            if level is None or level < 1:
+                continue
+            band = (level - 1) // LEVEL_BAND_SIZE
+            duration = sheet.get('match_duration') or 0
+            looted_items = sheet['looted_items']
+            for item, count in (*looted_items.items(), (LEVEL_BAND_ALL_ITEMS, sum(looted_items.values()))):
+                sums = totals.setdefault((band, item), [0, 0, 0, 0])
+                sums[0] += 1
+                sums[1] += count
+                if duration > 0:
+                    sums[2] += count
+                    sums[3] += duration
+        return totals
+    
+    @staticmethod
+    def _time_bucket_rows(stat_sheets, bucket):
+        """(bucket_start, item, total) rows summing stat sheets into one granularity"""
+        bucket_totals = {}
+        for sheet in stat_sheets:
+            bucket_start = time_bucket_start(sheet['timestamp'], bucket)
+            for item, count in sheet['looted_items'].items():
+                key = (bucket_start, item)
+                bucket_totals[key] = bucket_totals.get(key, 0) + count
+        return [(bucket_start, item, total) for (bucket_start, item), total in bucket_totals.items()]
+    
+    @staticmethod
+    def _bump_generation(cursor):
+        """Mark the data as changed (call inside the writing transaction)"""
+        cursor.execute(
+            "UPDATE data_generation SET generation = generation + 1, modified_at = ? WHERE id = 1",
+            (time.time(),)
+        )
+    
+    @metrics.timed_query('get_data_generation')
+    def get_data_generation(self):
+        """Return (generation, modified_at epoch seconds), or (None, None) on error"""
+        try:
+            with self.connection() as conn:
+                row = conn.execute(
+                    "SELECT generation, modified_at FROM data_generation WHERE id = 1"
+                ).fetchone()
+            return tuple(row) if row else (None, None)
+        except Exception as e:
+            print(f"Error reading data generation: {e}")
+            metrics.record_db_error('get_data_generation')
+            return None, None
+    
+    def _rebuild_rollups(self, cursor):
+        """Recompute every rollup table from the raw stat sheets plus archived totals"""
+        cursor.execute("DELETE FROM item_totals")
+        cursor.execute('''
+            INSERT INTO item_totals (item, total)
+            SELECT item, SUM(total) FROM (
+                SELECT item, total, 0 AS ord FROM archived_totals WHERE kind = 'all'
+                UNION ALL
+                SELECT item, count, rowid FROM sheet_items
+            )
+            GROUP BY item
+            ORDER BY MIN(ord)
+        ''')
+        
+        # The seen sets only grow: archived sheets' matches and players stay counted
+        cursor.execute("INSERT OR IGNORE INTO seen_matches (match_id) SELECT DISTINCT match_id FROM stat_sheets")
+        cursor.execute("INSERT OR IGNORE INTO seen_players (player_id) SELECT DISTINCT player_id FROM stat_sheets")
+        
+        cursor.execute('''
+            UPDATE rollup_counters SET value = CASE name
+                WHEN 'stat_sheets' THEN (SELECT COUNT(*) FROM stat_sheets) +
+                    (SELECT value FROM rollup_counters WHERE name = 'archived_stat_sheets')
+                WHEN 'matches' THEN (SELECT COUNT(*) FROM seen_matches)
+                WHEN 'players' THEN (SELECT COUNT(*) FROM seen_players)
+                ELSE value
+            END
+        ''')
+        
+        self._rebuild_time_rollups(cursor)
+        self._rebuild_leaderboards(cursor)
+        self._rebuild_sketches(cursor)
+        self._rebuild_level_bands(cursor)
+    
+    def _rebuild_time_rollups(self, cursor):
+        """Recompute the minute/hour/day item totals from the raw stat sheets plus archived totals"""
+        for bucket, (prefix_length, suffix) in TIME_BUCKETS.items():
+            cursor.execute(f"DELETE FROM item_totals_{bucket}")
+            cursor.execute(f'''
+                INSERT INTO item_totals_{bucket} (bucket_start, item, total)
+                SELECT bucket_start, item, SUM(total) FROM (
+                    SELECT bucket_start, item, total FROM archived_totals WHERE kind = ?
+                    UNION ALL
+                    SELECT replace(substr(s.timestamp, 1, ?), ' ', 'T') || ?, i.item, i.count
+                    FROM sheet_items AS i JOIN stat_sheets AS s ON s.id = i.sheet_id
+                )
+                GROUP BY bucket_start, item
+            ''', (bucket, prefix_length, suffix))
+    
+    def _rebuild_leaderboards(self, cursor):
+        """Recompute the player/match leaderboard totals from the raw stat sheets plus archived totals"""
+        for table, owner in LEADERBOARDS.values():
+            cursor.execute(f"DELETE FROM {table} WHERE archived = 0")
+            cursor.execute(f"UPDATE {table} SET total = archived")
+            cursor.execute(f'''
+                INSERT INTO {table} (item, {owner}, total)
+                SELECT i.item, s.{owner}, SUM(i.count)
+                FROM sheet_items AS i JOIN stat_sheets AS s ON s.id = i.sheet_id
+                WHERE i.count > 0
+                GROUP BY i.item, s.{owner}
+                UNION ALL
+                SELECT ?, s.{owner}, SUM(i.count)
+                FROM sheet_items AS i JOIN stat_sheets AS s ON s.id = i.sheet_id
+                WHERE i.count > 0
+                GROUP BY s.{owner}
+                ON CONFLICT DO UPDATE SET total = total + excluded.total
+            ''', (LEADERBOARD_ALL_ITEMS,))
+    
+    def _rebuild_level_bands(self, cursor):
+        """Recompute the level band totals from the raw stat sheets plus archived totals"""
+        cursor.execute("DELETE FROM level_band_totals")
+        cursor.execute('''
+            INSERT INTO level_band_totals (band, item, stat_sheets, total, timed_total, duration_seconds)
+            SELECT band, item, SUM(stat_sheets), SUM(total), SUM(timed_total), SUM(duration_seconds) FROM (
+                SELECT band, item, stat_sheets, total, timed_total, duration_seconds
+                FROM archived_level_band_totals
+                UNION ALL
+                SELECT (s.player_level - 1) / :size AS band, i.item, 1, i.count,
+                       CASE WHEN s.match_duration > 0 THEN i.count ELSE 0 END,
+                       CASE WHEN s.match_duration > 0 THEN s.match_duration ELSE 0 END
+                FROM sheet_items AS i JOIN stat_sheets AS s ON s.id = i.sheet_id
+                WHERE s.player_level >= 1
+                UNION ALL
+                SELECT (player_level - 1) / :size, :all_items, 1, items_looted,
+                       CASE WHEN match_duration > 0 THEN items_looted ELSE 0 END,
+                       CASE WHEN match_duration > 0 THEN match_duration ELSE 0 END
+                FROM stat_sheets
+                WHERE player_level >= 1
+            )
+            GROUP BY band, item
+        ''', {'size': LEVEL_BAND_SIZE, 'all_items': LEVEL_BAND_ALL_ITEMS})
+    
+    def _rebuild_sketches(self, cursor, chunk_size=ARCHIVE_CHUNK):
+        """Recompute the quantile sketches from the raw stat sheets plus their archived parts.
+        
+        HyperLogLog registers are only raised, like the seen sets, so archived
+        sheets' matches and players stay counted.
+        """
+        cursor.execute("DELETE FROM quantile_sketches WHERE archived IS NULL")
+        cursor.execute("UPDATE quantile_sketches SET sketch = archived")
+        last_id = 0
+        while True:
+            rows = cursor.execute(f'''
+                SELECT {STAT_SHEET_COLUMNS} FROM stat_sheets
+                WHERE id > ? ORDER BY id LIMIT ?
+            ''', (last_id, chunk_size)).fetchall()
+            if not rows:
+                break
+            self._update_sketches(cursor, self._load_stat_sheets(cursor, rows))
+            last_id = rows[-1][0]
+        cursor.execute("UPDATE rollup_counters SET value = ? WHERE name = 'sketched_through'", (last_id,))
+    
+    @metrics.timed_query('rebuild_rollups')
+    def rebuild_rollups(self):
+        """Rebuild the rollup tables for an existing database"""
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                self._rebuild_rollups(cursor)
+                self._bump_generation(cursor)
+                conn.commit()
+                print("Rollup tables rebuilt successfully")
+                return True
+        except Exception as e:
+            print(f"Error rebuilding rollups: {e}")
+            metrics.record_db_error('rebuild_rollups')
+            return False
+    
+    @staticmethod
+    def _stat_sheet_row(stat_sheet):
+        """Build the stat_sheets column values for a stat sheet dict, deriving loot per minute"""
+        match_duration = stat_sheet.get('match_duration')
+        items_looted = sum(stat_sheet['looted_items'].values())
+        return (
+            stat_sheet['match_id'],
+            stat_sheet['player_id'],
+            stat_sheet['timestamp'],
+            match_duration,
+            stat_sheet.get('player_level'),
+            items_looted,
+            loot_per_minute(items_looted, match_duration)
+        )
+    
+    @staticmethod
+    def _sheet_item_rows(sheet_id, stat_sheet):
+        """Build the sheet_items rows (one per looted item) for a stat sheet dict"""
+        locations = stat_sheet.get('locations') or {}
+        rows = []
+        for item, count in stat_sheet['looted_items'].items():
+            x, y = locations.get(item) or (None, None)
+            cell = spatial_cell(x, y) if x is not None else None
+            rows.append((sheet_id, item, count, x, y, cell))
+        return rows
+    
+    def _load_stat_sheets(self, cursor, rows):
+        """Turn stat_sheets rows (STAT_SHEET_COLUMNS) into dicts, attaching items from sheet_items"""
+        stat_sheets = []
+        for row in rows:
+            sheet = {
+                'id': row[0],
+                'match_id': row[1],
+                'player_id': row[2],
+                'timestamp': row[3],
+                'looted_items': {},
+                'locations': {},
+                'created_at': row[4]
+            }
+            # Optional fields are left out when the sheet did not report them
+            for name, value in zip(('match_duration', 'player_level', 'loot_per_minute'), row[5:8]):
+                if value is not None:
+                    sheet[name] = value
+            stat_sheets.append(sheet)
+        by_id = {sheet['id']: sheet for sheet in stat_sheets}
+        
+        # Fetch items in chunks to stay under SQLite's bound-parameter limit
+        ids = list(by_id)
+        for start in range(0, len(ids), ITEM_FETCH_CHUNK):
+            chunk = ids[start:start + ITEM_FETCH_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f'''
+                SELECT sheet_id, item, count, x, y FROM sheet_items
+                WHERE sheet_id IN ({placeholders})
+                ORDER BY rowid
+            ''', chunk)
+            for sheet_id, item, count, x, y in cursor.fetchall():
+                sheet = by_id[sheet_id]
+                sheet['looted_items'][item] = count
+                if x is not None:
+                    sheet['locations'][item] = [x, y]
+        
+        return stat_sheets
+    
+    @staticmethod
+    def _range_conditions(ranges, prefix=''):
+        """SQL conditions and params for RANGE_FILTERS values, e.g. {'min_level': 20}"""
+        query = ''
+        params = []
+        for name, value in (ranges or {}).items():
+            if value is not None:
+                column, comparison, _ = RANGE_FILTERS[name]
+                query += f" AND {prefix}{column} {comparison} ?"
+                params.append(value)
+        return query, params
+    
+    def iter_stat_sheets(self, match_id=None, player_id=None, item=None, cursor=None,
+                         chunk_size=STAT_SHEET_CHUNK, start=None, end=None, ranges=None):
+        """Yield stat sheets newest first (by id), fetching chunk_size rows at a time.
+        
+        Uses keyset pagination on id, so memory stays constant however many
+        rows match. cursor starts after a previously seen id; start/end
+        restrict the ISO-8601 timestamp to [start, end); ranges holds
+        RANGE_FILTERS bounds (e.g. {'min_level': 20}), checked in SQL so an
+        index range scan can serve them. Each chunk is a short read on its
+        own pooled connection; errors propagate to the caller.
+        """
+        query = f"SELECT {STAT_SHEET_COLUMNS} FROM stat_sheets WHERE 1=1"
+        params = []
+        
+        if match_id:
+            query += " AND match_id = ?"
+            params.append(match_id)
+        
+        if player_id:
+            query += " AND player_id = ?"
+            params.append(player_id)
+        
+        if item:
+            query += " AND id IN (SELECT sheet_id FROM sheet_items WHERE item = ? AND count > 0)"
+            params.append(item)
+        
+        if start:
+            query += " AND timestamp >= ?"
+            params.append(start)
+        
+        if end:
+            query += " AND timestamp < ?"
+            params.append(end)
+        
+        range_query, range_params = self._range_conditions(ranges)
+        query += range_query
+        params.extend(range_params)
+        
+        while True:
+            page_query = query
+            page_params = list(params)
+            if cursor:
+                page_query += " AND id < ?"
+                page_params.append(cursor)
+            page_query += " ORDER BY id DESC LIMIT ?"
+            page_params.append(chunk_size)
+            
+            with metrics.db_timer('iter_stat_sheets'), self.connection() as conn:
+                db_cursor = conn.cursor()
+                db_cursor.execute(page_query, page_params)
+                stat_sheets = self._load_stat_sheets(db_cursor, db_cursor.fetchall())
+            metrics.record_rows('iter_stat_sheets', len(stat_sheets))
+            
+            yield from stat_sheets
+            
+            if len(stat_sheets) < chunk_size:
+                return
+            cursor = stat_sheets[-1]['id']
+    
+    def get_stat_sheets(self, match_id=None, player_id=None, limit=None, item=None, cursor=None,
+                        start=None, end=None, ranges=None):
+        """Retrieve stat sheets with optional filtering (item: sheets that looted it)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            chunk_size = min(limit, STAT_SHEET_CHUNK) if limit else STAT_SHEET_CHUNK
+            stat_sheets = self.iter_stat_sheets(match_id=match_id, player_id=player_id, item=item,
+                                                cursor=cursor, chunk_size=chunk_size,
+                                                start=start, end=end, ranges=ranges)
+            return list(islice(stat_sheets, limit))
+        except Exception as e:
+            print(f"Error retrieving stat sheets: {e}")
+            metrics.record_db_error('get_stat_sheets')
+            return []
+    
+    def get_stat_sheets_page(self, match_id=None, player_id=None, item=None, cursor=None, limit=STAT_SHEET_CHUNK,
+                             start=None, end=None, ranges=None):
+        """Retrieve one page of stat sheets plus the next_cursor (None on the last page)"""
+        # Ask for one extra row to know whether another page exists
+        stat_sheets = self.get_stat_sheets(match_id=match_id, player_id=player_id, item=item,
+                                           cursor=cursor, limit=limit + 1, start=start, end=end,
+                                           ranges=ranges)
+        if len(stat_sheets) > limit:
+            stat_sheets = stat_sheets[:limit]
+            return stat_sheets, stat_sheets[-1]['id']
+        return stat_sheets, None
+    
+    @metrics.timed_query('get_item_totals')
+    def get_item_totals(self, match_id=None, player_id=None):
+        """Sum looted items per item type for a match and/or player (SQL GROUP BY)"""
+        try:
+            with self.connection() as conn:
                 cursor = conn.cursor()
                 
-                query = "SELECT * FROM stat_sheets WHERE 1=1"
+                query = '''
+                    SELECT sheet_items.item, SUM(sheet_items.count)
+                    FROM sheet_items JOIN stat_sheets ON stat_sheets.id = sheet_items.sheet_id
+                    WHERE 1=1
+                '''
                 params = []
                 
                 if match_id:
-                    query += " AND match_id = ?"
+                    query += " AND stat_sheets.match_id = ?"
                     params.append(match_id)
                 
                 if player_id:
-                    query += " AND player_id = ?"
+                    query += " AND stat_sheets.player_id = ?"
                     params.append(player_id)
                 
-                query += " ORDER BY created_at DESC"
+                query += " GROUP BY sheet_items.item ORDER BY MIN(sheet_items.rowid)"
                 
-                if limit:
-                    query += " LIMIT ?"
-                    params.append(limit)
-                
-                cursor.execute(query, params)
-                rows = cursor.fetchall()
-                
-                # Convert to list of dictionaries
-                stat_sheets = []
-                for row in rows:
-                    stat_sheet = {
-                        'id': row[0],
-                        'match_id': row[1],
-                        'player_id': row[2],
-                        'timestamp': row[3],
-                        'looted_items': json.loads(row[4]),
-                        'locations': json.loads(row[5]) if row[5] else {},
-                        'created_at': row[6]
-                    }
-                    stat_sheets.append(stat_sheet)
-                
-                return stat_sheets
+                totals = dict(cursor.execute(query, params))
+            metrics.record_rows('get_item_totals', len(totals))
+            return totals
         except Exception as e:
-            print(f"Error retrieving stat sheets: {e}")
-            return []
+            print(f"Error getting item totals: {e}")
+            metrics.record_db_error('get_item_totals')
+            return {}
     
-    def get_aggregate_stats(self):
-        """Get aggregated loot statistics across all matches"""
+    def _sheet_conditions(self, ranges=None, start=None, end=None, prefix=''):
+        """SQL conditions and params restricting stat sheets to a timestamp window and RANGE_FILTERS"""
+        query, params = self._range_conditions(ranges, prefix)
+        if start:
+            query += f" AND {prefix}timestamp >= ?"
+            params.append(start)
+        if end:
+            query += f" AND {prefix}timestamp < ?"
+            params.append(end)
+        return query, params
+    
+    def _filtered_aggregate_stats(self, cursor, ranges, start=None, end=None):
+        """Aggregate stats over the retained stat sheets matching RANGE_FILTERS (and a timestamp window)"""
+        conditions, params = self._sheet_conditions(ranges, start, end)
+        stat_sheets, matches, players = cursor.execute(
+            f"SELECT COUNT(*), COUNT(DISTINCT match_id), COUNT(DISTINCT player_id) FROM stat_sheets WHERE 1=1{conditions}",
+            params
+        ).fetchone()
+        conditions, params = self._sheet_conditions(ranges, start, end, prefix='s.')
+        all_loots = dict(cursor.execute(f'''
+            SELECT i.item, SUM(i.count)
+            FROM stat_sheets AS s JOIN sheet_items AS i ON i.sheet_id = s.id
+            WHERE 1=1{conditions}
+            GROUP BY i.item ORDER BY MIN(i.rowid)
+        ''', params))
+        metrics.record_rows('get_aggregate_stats', stat_sheets + len(all_loots))
+        return {
+            'total_items': all_loots,
+            'total_matches': matches,
+            'total_players': players,
+            'total_stat_sheets': stat_sheets
+        }
+    
+    def _filtered_player_ids(self, ranges, start=None, end=None):
+        """Distinct player_ids of the stat sheets matching RANGE_FILTERS (and a timestamp window)"""
+        conditions, params = self._sheet_conditions(ranges, start, end)
+        with self.connection() as conn:
+            return {row[0] for row in conn.execute(
+                f"SELECT DISTINCT player_id FROM stat_sheets WHERE 1=1{conditions}", params)}
+    
+    @metrics.timed_query('get_aggregate_stats')
+    def get_aggregate_stats(self, approx=False, start=None, end=None, ranges=None):
+        """Get aggregated loot statistics across all matches (read from rollup tables).
+        
+        With approx=True the match and player counts are HyperLogLog
+        estimates, and start/end (ISO-8601, start rounded down to its day,
+        end exclusive) restrict every figure to a window: item totals from
+        the day rollups, stat sheets from the per-day quantile sketches.
+        With ranges (RANGE_FILTERS bounds) every figure is counted exactly
+        from the retained stat sheets matching them, read through the
+        column indexes, with start/end compared to the exact timestamp;
+        approx is ignored then. Otherwise windows are ignored without approx.
+        """
         try:
-            stat_sheets = self.get_stat_sheets()
-            
-            # Aggregate totals
-            all_loots = {}
-            total_matches = set()
-            total_players = set()
-            
-            for sheet in stat_sheets:
-                total_matches.add(sheet['match_id'])
-                total_players.add(sheet['player_id'])
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                if ranges:
+                    return self._filtered_aggregate_stats(cursor, ranges, start, end)
                 
-                for item, count in sheet['looted_items'].items():
-                    all_loots[item] = all_loots.get(item, 0) + count
+                counters = dict(cursor.execute("SELECT name, value FROM rollup_counters"))
+                if approx and (start or end):
+                    query = "SELECT item, SUM(total) FROM item_totals_day WHERE 1=1"
+                    params = []
+                    if start:
+                        query += " AND bucket_start >= ?"
+                        params.append(time_bucket_start(start, 'day'))
+                    if end:
+                        query += " AND bucket_start < ?"
+                        params.append(end.replace(' ', 'T'))
+                    all_loots = dict(cursor.execute(query + " GROUP BY item", params))
+                    counters['stat_sheets'] = self._quantile_sketch(cursor, None, start, end).n
+                else:
+                    all_loots = dict(cursor.execute("SELECT item, total FROM item_totals ORDER BY rowid"))
+                if approx:
+                    for name in DISTINCT_SKETCHES:
+                        counters[name] = self._distinct_sketch(cursor, name, start, end).count()
+            metrics.record_rows('get_aggregate_stats', len(counters) + len(all_loots))
             
             return {
                 'total_items': all_loots,
-                'total_matches': len(total_matches),
-                'total_players': len(total_players),
-                'total_stat_sheets': len(stat_sheets)
+                'total_matches': counters.get('matches', 0),
+                'total_players': counters.get('players', 0),
+                'total_stat_sheets': counters.get('stat_sheets', 0)
             }
         except Exception as e:
             print(f"Error getting aggregate stats: {e}")
+            metrics.record_db_error('get_aggregate_stats')
             return {}
     
+    @metrics.timed_query('get_level_bands')
+    def get_level_bands(self, item=None, ranges=None, start=None, end=None):
+        """Loot per player level band, for one item or (without one) all items.
+        
+        Read from the level band rollups, or with ranges/start/end from the
+        retained stat sheets matching them. Sheets without a player_level are
+        left out. Returns (band, stat_sheets, total, timed_total,
+        duration_seconds) tuples by band, where timed_total is the part of
+        total from sheets with a match_duration; None on error.
+        """
+        try:
+            if ranges or start or end:
+                conditions, params = self._sheet_conditions(ranges, start, end, prefix='s.')
+                if item:
+                    looted = "i.count"
+                    source = "stat_sheets AS s JOIN sheet_items AS i ON i.sheet_id = s.id"
+                    conditions += " AND i.item = ?"
+                    params.append(item)
+                else:
+                    looted = "s.items_looted"
+                    source = "stat_sheets AS s"
+                query = f'''
+                    SELECT (s.player_level - 1) / ? AS band, COUNT(*), SUM({looted}),
+                           SUM(CASE WHEN s.match_duration > 0 THEN {looted} ELSE 0 END),
+                           SUM(CASE WHEN s.match_duration > 0 THEN s.match_duration ELSE 0 END)
+                    FROM {source}
+                    WHERE s.player_level >= 1{conditions}
+                    GROUP BY band ORDER BY band
+                '''
+                params = [LEVEL_BAND_SIZE] + params
+            else:
+                query = '''
+                    SELECT band, stat_sheets, total, timed_total, duration_seconds FROM level_band_totals
+                    WHERE item = ? ORDER BY band
+                '''
+                params = [item or LEVEL_BAND_ALL_ITEMS]
+            
+            with self.connection() as conn:
+                bands = conn.execute(query, params).fetchall()
+            metrics.record_rows('get_level_bands', len(bands))
+            return bands
+        except Exception as e:
+            print(f"Error getting level bands: {e}")
+            metrics.record_db_error('get_level_bands')
+            return None
+    
+    @staticmethod
+    def _sketch_days(query, params, start, end):
+        """Restrict a sketch query to the all-time row, or to the days of a window"""
+        if not (start or end):
+            return query + " AND day = ?", params + [SKETCH_ALL_TIME]
+        query += " AND day != ?"
+        params = params + [SKETCH_ALL_TIME]
+        if start:
+            query += " AND day >= ?"
+            params.append(time_bucket_start(start, 'day'))
+        if end:
+            query += " AND day < ?"
+            params.append(end.replace(' ', 'T'))
+        return query, params
+    
+    def _distinct_sketch(self, cursor, name, start=None, end=None):
+        query, params = self._sketch_days(
+            "SELECT register, MAX(rank) FROM hll_registers WHERE name = ?", [name], start, end)
+        sketch = HyperLogLog()
+        sketch.set_registers(cursor.execute(query + " GROUP BY register", params))
+        return sketch
+    
+    def _quantile_sketch(self, cursor, item=None, start=None, end=None):
+        query, params = self._sketch_days(
+            "SELECT sketch FROM quantile_sketches WHERE item = ?", [item or SKETCH_ALL_ITEMS], start, end)
+        sketch = KllSketch()
+        for (data,) in cursor.execute(query, params):
+            sketch.merge(KllSketch.from_bytes(data))
+        
+        # Plus the stat sheets inserted since the last compaction
+        watermark = self._sketch_watermark(cursor)
+        if item:
+            rows = cursor.execute('''
+                SELECT s.timestamp, i.count
+                FROM sheet_items AS i INDEXED BY idx_sheet_items_sheet
+                JOIN stat_sheets AS s ON s.id = i.sheet_id
+                WHERE i.sheet_id > ? AND i.item = ?
+            ''', (watermark, item))
+        else:
+            rows = cursor.execute("SELECT timestamp, items_looted FROM stat_sheets WHERE id > ?", (watermark,))
+        first_day = time_bucket_start(start, 'day') if start else None
+        end_day = end.replace(' ', 'T') if end else None
+        values = []
+        for timestamp, value in rows:
+            day = time_bucket_start(timestamp, 'day')
+            if (first_day is None or day >= first_day) and (end_day is None or day < end_day):
+                values.append(value)
+        if values:
+            sketch.update(values)
+        return sketch
+    
+    @metrics.timed_query('get_distinct_sketch')
+    def get_distinct_sketch(self, name, start=None, end=None):
+        """HyperLogLog of the distinct matches or players (a DISTINCT_SKETCHES name).
+        
+        All time by default, or the union of the per-day sketches for a
+        start/end window (ISO-8601, start rounded down to its day, end
+        exclusive). Returns a sketches.HyperLogLog, or None on error.
+        """
+        try:
+            with self.connection() as conn:
+                return self._distinct_sketch(conn.cursor(), name, start, end)
+        except Exception as e:
+            print(f"Error reading distinct-count sketch: {e}")
+            metrics.record_db_error('get_distinct_sketch')
+            return None
+    
+    @metrics.timed_query('get_quantile_sketch')
+    def get_quantile_sketch(self, item=None, start=None, end=None):
+        """KLL sketch of per-stat-sheet counts of an item (all items summed without one).
+        
+        All time by default, or the per-day sketches of a start/end window
+        merged (same rounding as get_distinct_sketch). Returns a
+        sketches.KllSketch (n is 0 when nothing matched), or None on error.
+        """
+        try:
+            with self.connection() as conn:
+                return self._quantile_sketch(conn.cursor(), item, start, end)
+        except Exception as e:
+            print(f"Error reading quantile sketch: {e}")
+            metrics.record_db_error('get_quantile_sketch')
+            return None
+    
+    @metrics.timed_query('get_timeseries')
+    def get_timeseries(self, item=None, start=None, end=None, bucket='hour', limit=TIMESERIES_MAX_POINTS):
+        """Items looted per time bucket from the time rollups, oldest first.
+        
+        start/end are ISO-8601 timestamps compared as wall-clock time; start
+        is rounded down to its bucket and end is exclusive. Without an item
+        the totals of every item are summed. Empty buckets are omitted.
+        Returns a list of (bucket_start, total) pairs, or None on error.
+        """
+        try:
+            query = f"SELECT bucket_start, SUM(total) FROM item_totals_{bucket} WHERE 1=1"
+            params = []
+            
+            if item:
+                query += " AND item = ?"
+                params.append(item)
+            
+            if start:
+                query += " AND bucket_start >= ?"
+                params.append(time_bucket_start(start, bucket))
+            
+            if end:
+                query += " AND bucket_start < ?"
+                params.append(end.replace(' ', 'T'))
+            
+            query += " GROUP BY bucket_start ORDER BY bucket_start LIMIT ?"
+            params.append(limit)
+            
+            with self.connection() as conn:
+                points = conn.execute(query, params).fetchall()
+            metrics.record_rows('get_timeseries', len(points))
+            return points
+        except Exception as e:
+            print(f"Error getting timeseries: {e}")
+            metrics.record_db_error('get_timeseries')
+            return None
+    
+    @metrics.timed_query('get_leaderboard')
+    def get_leaderboard(self, board, item=None, k=LEADERBOARD_DEFAULT_K, start=None, end=None, owners=None):
+        """Top k players or matches by items looted.
+        
+        board is a LEADERBOARDS key; without an item every item counts.
+        Without start/end the all-time totals are read in rank-index order, so
+        only k rows are touched however much data is stored. A start/end
+        window (ISO-8601 wall-clock time, end exclusive) sums the retained
+        raw stat sheets in range through the timestamp index instead, so it
+        costs time proportional to the window and does not see archived
+        sheets. owners restricts the result to those IDs (used to complete
+        sharded leaderboards). Returns a list of (owner_id, total) pairs,
+        highest first (ties by ID), or None on error.
+        """
+        try:
+            table, owner = LEADERBOARDS[board]
+            if start or end:
+                query = f'''
+                    SELECT s.{owner}, SUM(i.count) AS rank_total
+                    FROM stat_sheets AS s INDEXED BY idx_timestamp
+                    JOIN sheet_items AS i ON i.sheet_id = s.id
+                    WHERE i.count > 0
+                '''
+                params = []
+                if item:
+                    query += " AND i.item = ?"
+                    params.append(item)
+                if start:
+                    query += " AND s.timestamp >= ?"
+                    params.append(start)
+                if end:
+                    query += " AND s.timestamp < ?"
+                    params.append(end)
+                owner_column = f"s.{owner}"
+            else:
+                query = f"SELECT {owner}, total AS rank_total FROM {table} WHERE item = ?"
+                params = [item or LEADERBOARD_ALL_ITEMS]
+                owner_column = owner
+            
+            if owners is not None:
+                owners = list(owners)
+                query += f" AND {owner_column} IN ({','.join('?' * len(owners))})"
+                params.extend(owners)
+            if start or end:
+                query += f" GROUP BY {owner_column}"
+            query += f" ORDER BY rank_total DESC, {owner_column} LIMIT ?"
+            params.append(k)
+            
+            with self.connection() as conn:
+                entries = conn.execute(query, params).fetchall()
+            metrics.record_rows('get_leaderboard', len(entries))
+            return entries
+        except Exception as e:
+            print(f"Error getting leaderboard: {e}")
+            metrics.record_db_error('get_leaderboard')
+            return None
+    
+    @metrics.timed_query('get_locations')
+    def get_locations(self, bbox, item=None, limit=None, cursor=None):
+        """Get looted-item locations inside a bounding box, newest first.
+        
+        bbox is (x0, y0, x1, y1), inclusive. Without an item every item type
+        is searched. Pages are keyed on the sheet_items rowid like
+        get_heatmap_page. Returns (locations, next_cursor).
+        """
+        try:
+            return self._locations_page(self._location_rows(bbox, item, limit, cursor), limit)
+        except Exception as e:
+            print(f"Error getting locations: {e}")
+            metrics.record_db_error('get_locations')
+            return [], None
+    
+    def _location_rows(self, bbox, item=None, limit=None, cursor=None):
+        """(rowid, sheet_id, item, x, y, count) rows inside bbox, newest first.
+        
+        Only the grid cells overlapping the box are read through
+        idx_sheet_items_cell; x/y are then checked exactly. The index is
+        forced because the planner would otherwise prefer idx_sheet_items_item
+        to avoid sorting by rowid.
+        """
+        x0, y0, x1, y1 = bbox
+        (cx0, cy0), (cx1, cy1) = spatial_cell_coords(x0, y0), spatial_cell_coords(x1, y1)
+        cells = [cx * SPATIAL_GRID + cy for cx in range(cx0, cx1 + 1) for cy in range(cy0, cy1 + 1)]
+        
+        query = f'''
+            SELECT rowid, sheet_id, item, x, y, count
+            FROM sheet_items INDEXED BY idx_sheet_items_cell
+            WHERE cell IN ({','.join('?' * len(cells))})
+              AND x BETWEEN ? AND ? AND y BETWEEN ? AND ? AND count > 0
+        '''
+        params = [*cells, x0, x1, y0, y1]
+        
+        if item:
+            query += " AND item = ?"
+            params.append(item)
+        else:
+            # Lets the (item, cell) index serve an all-items search
+            query += " AND item IN (SELECT item FROM item_totals)"
+        
+        if cursor:
+            query += " AND rowid < ?"
+            params.append(cursor)
+        
+        query += " ORDER BY rowid DESC"
+        
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        
+        with self.connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+        metrics.record_rows('get_locations', len(rows))
+        return rows
+    
+    @staticmethod
+    def _locations_page(rows, limit):
+        """Turn location rows into dicts plus the next_cursor"""
+        locations = [
+            {'sheet_id': sheet_id, 'item': item_name, 'x': x, 'y': y, 'count': count}
+            for _, sheet_id, item_name, x, y, count in rows
+        ]
+        next_cursor = rows[-1][0] if limit and len(rows) == limit else None
+        return locations, next_cursor
+    
+    def _registered_player_count(self):
+        """Players this database registers as a shard (see ShardedDatabaseHandler)"""
+        with self.connection() as conn:
+            row = conn.execute("SELECT value FROM rollup_counters WHERE name = 'registered_players'").fetchone()
+            return row[0] if row else 0
+    
     def get_heatmap_data(self, item_name):
         """Get location data for heatmap visualization"""
+        locations, _ = self.get_heatmap_page(item_name)
+        return locations
+    
+    @metrics.timed_query('get_heatmap_page')
+    def get_heatmap_page(self, item_name, limit=None, cursor=None):
+        """Get one page of heatmap points, newest first.
+        
+        Pages are keyed on the sheet_items rowid: pass the returned next_cursor
+        back in to continue. next_cursor is None on the last page.
+        """
         try:
-            stat_sheets = self.get_stat_sheets()
+            return self._heatmap_page(self._heatmap_rows(item_name, limit, cursor), limit)
+        except Exception as e:
+            print(f"Error getting heatmap data: {e}")
+            metrics.record_db_error('get_heatmap_page')
+            return [], None
+    
+    def _heatmap_rows(self, item_name, limit=None, cursor=None):
+        """(rowid, x, y, count) rows for an item's located loot, newest first"""
+        with self.connection() as conn:
+            query = '''
+                SELECT rowid, x, y, count FROM sheet_items
+                WHERE item = ? AND count > 0 AND x IS NOT NULL
+            '''
+            params = [item_name]
             
-            locations = []
-            for sheet in stat_sheets:
-                if item_name in sheet['locations'] and sheet['looted_items'].get(item_name, 0) > 0:
-                    x, y = sheet['locations'][item_name]
-                    count = sheet['looted_items'][item_name]
-                    locations.extend([(x, y)] * count)  # Repeat based on count
+            if cursor:
+                query += " AND rowid < ?"
+                params.append(cursor)
+            
+            query += " ORDER BY rowid DESC"
+            
+            if limit:
+                query += " LIMIT ?"
+                params.append(limit)
+            
+            rows = conn.execute(query, params).fetchall()
+        metrics.record_rows('get_heatmap_page', len(rows))
+        return rows
+    
+    @staticmethod
+    def _heatmap_page(rows, limit):
+        """Expand heatmap rows into points plus the next_cursor"""
+        locations = []
+        for _, x, y, count in rows:
+            locations.extend([(x, y)] * count)  # Repeat based on count
+        
+        next_cursor = rows[-1][0] if limit and len(rows) == limit else None
+        return locations, next_cursor
+    
+    def _heatmap_grids(self, conn, item_name=None, bins=HEATMAP_BINS, value_range=HEATMAP_RANGE):
+        """Count-weighted 2D histograms per item, from one pass over the located items.
+        
+        Bins only item_name when given, otherwise every item at once: each
+        chunk goes through a single np.histogramdd over (item code, x, y).
+        Returns ({item: int64 grid}, x_edges, y_edges).
+        """
+        x_edges = np.linspace(value_range[0][0], value_range[0][1], bins + 1)
+        y_edges = np.linspace(value_range[1][0], value_range[1][1], bins + 1)
+        item_codes = {}
+        grids = []
+        
+        def add(names, points, weights):
+            codes = np.array([item_codes.setdefault(name, len(item_codes)) for name in names], dtype=np.float64)
+            while len(grids) < len(item_codes):
+                grids.append(np.zeros((bins, bins), dtype=np.int64))
+            hist, _ = np.histogramdd(
+                np.column_stack((codes, points)),
+                bins=(np.arange(len(item_codes) + 1) - 0.5, x_edges, y_edges), weights=weights
+            )
+            for code, item_hist in enumerate(hist):
+                grids[code] += item_hist.astype(np.int64)
+        
+        where, params = ("item = ? AND ", (item_name,)) if item_name is not None else ("", ())
+        cursor = conn.execute(f'''
+            SELECT item, x, y, count FROM sheet_items
+            WHERE {where}count > 0 AND x IS NOT NULL
+        ''', params)
+        
+        # One vectorized histogram per chunk keeps memory flat
+        while True:
+            rows = cursor.fetchmany(HEATMAP_FETCH_CHUNK)
+            if not rows:
+                break
+            metrics.record_rows('get_heatmap_grid', len(rows))
+            names, *columns = zip(*rows)
+            points = np.array(columns, dtype=np.float64).T
+            add(names, points[:, :2], points[:, 2])
+        
+        # Archived points count at the centre of their archive cell; a
+        # cell starting on the upper edge holds points exactly on it
+        archived = conn.execute(
+            f"SELECT item, cx, cy, total FROM heatmap_archive{' WHERE item = ?' if params else ''}", params
+        ).fetchall()
+        if archived:
+            names, *columns = zip(*archived)
+            cells = np.array(columns, dtype=np.float64).T
+            starts = cells[:, :2] * HEATMAP_ARCHIVE_CELL
+            uppers = np.array([value_range[0][1], value_range[1][1]])
+            centres = np.where(starts == uppers, uppers, starts + HEATMAP_ARCHIVE_CELL / 2)
+            add(names, centres, cells[:, 2])
+        
+        return {name: grids[code] for name, code in item_codes.items()}, x_edges, y_edges
+    
+    @metrics.timed_query('get_heatmap_grid')
+    def get_heatmap_grid(self, item_name, bins=HEATMAP_BINS, value_range=HEATMAP_RANGE):
+        """Bin an item's locations into a count-weighted 2D histogram.
+        
+        grid[i][j] counts items looted in x bin i and y bin j, matching
+        np.histogram2d. Points outside value_range are dropped.
+        """
+        try:
+            with self.connection() as conn:
+                grids, x_edges, y_edges = self._heatmap_grids(conn, item_name, bins, value_range)
+            grid = grids.get(item_name, np.zeros((bins, bins), dtype=np.int64))
             
-            return locations
+            return {
+                'item_name': item_name,
+                'bins': bins,
+                'x_edges': x_edges.tolist(),
+                'y_edges': y_edges.tolist(),
+                'grid': grid.tolist(),
+                'total': int(grid.sum())
+            }
         except Exception as e:
-            print(f"Error getting heatmap data: {e}")
-            return []
+            print(f"Error getting heatmap grid: {e}")
+            metrics.record_db_error('get_heatmap_grid')
+            return None
+    
+    @metrics.timed_query('get_heatmap_grids')
+    def get_heatmap_grids(self, bins=HEATMAP_BINS, value_range=HEATMAP_RANGE):
+        """Heatmap grids for every item with located loot, binned in a single pass.
+        
+        Returns {bins, x_edges, y_edges, grids: {item: grid}, totals: {item: total}}
+        with each grid laid out as in get_heatmap_grid.
+        """
+        try:
+            with self.connection() as conn:
+                grids, x_edges, y_edges = self._heatmap_grids(conn, bins=bins, value_range=value_range)
+            
+            return {
+                'bins': bins,
+                'x_edges': x_edges.tolist(),
+                'y_edges': y_edges.tolist(),
+                'grids': {item: grid.tolist() for item, grid in sorted(grids.items())},
+                'totals': {item: int(grid.sum()) for item, grid in sorted(grids.items())}
+            }
+        except Exception as e:
+            print(f"Error getting heatmap grids: {e}")
+            metrics.record_db_error('get_heatmap_grids')
+            return None
     
+    @metrics.timed_query('export_columnar')
+    def export_columnar(self, out_dir, chunk_size=EXPORT_CHUNK):
+        """Export all stat sheets as typed, memory-mappable .npy columns.
+        
+        Writes one .npy file per column into out_dir plus manifest.json. Sheet
+        columns (sheet_id, match_code, player_code, timestamp, created_at,
+        match_duration and player_level with -1 when absent, loot_per_minute
+        with NaN) have one row per stat sheet; item columns (item_sheet_id, item_code,
+        item_count, item_x, item_y) have one row per sheet_items row. String
+        IDs are dictionary-encoded against the matches/players/items
+        vocabulary arrays. Rows are copied in chunks from a single read
+        snapshot, so memory stays flat. Returns the manifest dict.
+        """
+        os.makedirs(out_dir, exist_ok=True)
+        
+        with self.connection() as conn:
+            # One read transaction so every column sees the same snapshot
+            conn.execute("BEGIN")
+            
+            matches = [row[0] for row in conn.execute("SELECT DISTINCT match_id FROM stat_sheets ORDER BY match_id")]
+            players = [row[0] for row in conn.execute("SELECT DISTINCT player_id FROM stat_sheets ORDER BY player_id")]
+            items = [row[0] for row in conn.execute("SELECT DISTINCT item FROM sheet_items ORDER BY item")]
+            num_sheets = conn.execute("SELECT COUNT(*) FROM stat_sheets").fetchone()[0]
+            num_items = conn.execute("SELECT COUNT(*) FROM sheet_items").fetchone()[0]
+            
+            vocabularies = {'matches': matches, 'players': players, 'items': items}
+            for name, values in vocabularies.items():
+                np.save(os.path.join(out_dir, f"{name}.npy"), np.array(values, dtype=str))
+            
+            match_codes = {value: code for code, value in enumerate(matches)}
+            player_codes = {value: code for code, value in enumerate(players)}
+            item_codes = {value: code for code, value in enumerate(items)}
+            
+            def column(name, dtype, length):
+                return np.lib.format.open_memmap(
+                    os.path.join(out_dir, f"{name}.npy"), mode='w+', dtype=dtype, shape=(length,)
+                )
+            
+            sheet_columns = {
+                'sheet_id': column('sheet_id', np.int64, num_sheets),
+                'match_code': column('match_code', np.int32, num_sheets),
+                'player_code': column('player_code', np.int32, num_sheets),
+                'timestamp': column('timestamp', 'datetime64[us]', num_sheets),
+                'created_at': column('created_at', 'datetime64[s]', num_sheets),
+                'match_duration': column('match_duration', np.int32, num_sheets),
+                'player_level': column('player_level', np.int16, num_sheets),
+                'loot_per_minute': column('loot_per_minute', np.float64, num_sheets)
+            }
+            item_columns = {
+                'item_sheet_id': column('item_sheet_id', np.int64, num_items),
+                'item_code': column('item_code', np.int16, num_items),
+                'item_count': column('item_count', np.int32, num_items),
+                'item_x': column('item_x', np.float64, num_items),  # NaN when no location
+                'item_y': column('item_y', np.float64, num_items)
+            }
+            
+            # Copy stat sheets in keyset chunks
+            position = 0
+            last_id = 0
+            while position < num_sheets:
+                rows = conn.execute(f'''
+                    SELECT {STAT_SHEET_COLUMNS} FROM stat_sheets
+                    WHERE id > ? ORDER BY id LIMIT ?
+                ''', (last_id, chunk_size)).fetchall()
+                if not rows:
+                    break
+                end = position + len(rows)
+                ids, match_ids, player_ids, timestamps, created, durations, levels, rates = zip(*rows)
+                sheet_columns['sheet_id'][position:end] = ids
+                sheet_columns['match_code'][position:end] = [match_codes[m] for m in match_ids]
+                sheet_columns['player_code'][position:end] = [player_codes[p] for p in player_ids]
+                sheet_columns['timestamp'][position:end] = _to_datetime64(timestamps, 'us')
+                sheet_columns['created_at'][position:end] = _to_datetime64(created, 's')
+                sheet_columns['match_duration'][position:end] = [-1 if d is None else d for d in durations]
+                sheet_columns['player_level'][position:end] = [-1 if l is None else l for l in levels]
+                sheet_columns['loot_per_minute'][position:end] = np.array(rates, dtype=np.float64)  # None -> NaN
+                position = end
+                last_id = ids[-1]
+            
+            # Copy sheet items in keyset chunks
+            position = 0
+            last_rowid = 0
+            while position < num_items:
+                rows = conn.execute('''
+                    SELECT rowid, sheet_id, item, count, x, y FROM sheet_items
+                    WHERE rowid > ? ORDER BY rowid LIMIT ?
+                ''', (last_rowid, chunk_size)).fetchall()
+                if not rows:
+                    break
+                end = position + len(rows)
+                rowids, sheet_ids, item_names, counts, xs, ys = zip(*rows)
+                item_columns['item_sheet_id'][position:end] = sheet_ids
+                item_columns['item_code'][position:end] = [item_codes[i] for i in item_names]
+                item_columns['item_count'][position:end] = counts
+                item_columns['item_x'][position:end] = np.array(xs, dtype=np.float64)  # None -> NaN
+                item_columns['item_y'][position:end] = np.array(ys, dtype=np.float64)
+                position = end
+                last_rowid = rowids[-1]
+        
+        columns = {}
+        for name, array in {**sheet_columns, **item_columns}.items():
+            array.flush()
+            columns[name] = str(array.dtype)
+        
+        manifest = {
+            'format_version': COLUMNAR_FORMAT_VERSION,
+            'exported_at': datetime.now().isoformat(),
+            'num_sheets': num_sheets,
+            'num_items': num_items,
+            'columns': columns,
+            'vocabularies': list(vocabularies)
+        }
+        with open(os.path.join(out_dir, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        
+        print(f"Exported {num_sheets} stat sheets ({num_items} item rows) to {out_dir}")
+        return manifest
+    
+    @metrics.timed_query('clear_database')
     def clear_database(self):
         """Clear all stat sheets (useful for testing)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("DELETE FROM stat_sheets")
+                cursor.execute("DELETE FROM sheet_items")
+                for table in ('item_totals', 'seen_matches', 'seen_players', 'archived_totals', 'heatmap_archive',
+                              'archived_sheet_keys',
+                              *(f'item_totals_{bucket}' for bucket in TIME_BUCKETS),
+                              *(table for table, _ in LEADERBOARDS.values()),
+                              'hll_registers', 'quantile_sketches',
+                              'level_band_totals', 'archived_level_band_totals'):
+                    cursor.execute(f"DELETE FROM {table}")
+                cursor.execute("UPDATE rollup_counters SET value = 0")
+                self._bump_generation(cursor)
                 conn.commit()
                 print("Database cleared successfully")
         except Exception as e:
             print(f"Error clearing database: {e}")
+            metrics.record_db_error('clear_database')
+    
+    @metrics.timed_query('apply_retention')
+    def apply_retention(self, cutoff, archive_dir=ARCHIVE_DIR, chunk_size=ARCHIVE_CHUNK):
+        """Archive and delete stat sheets created before cutoff ('YYYY-MM-DD HH:MM:SS' UTC).
+        
+        Works oldest first in chunk_size batches. Each batch is written to a
+        gzip NDJSON file named by its ID range (rewritten, not duplicated, if
+        a crash interrupts a run), then folded into archived_totals and
+        heatmap_archive and deleted in one transaction. The insert-time
+        rollups are left alone, so long-range totals stay correct. Freed
+        pages are then released with an incremental vacuum. Returns the
+        number of sheets archived, or None on error.
+        """
+        archived = 0
+        try:
+            os.makedirs(archive_dir, exist_ok=True)
+            while True:
+                with self.connection() as conn:
+                    cursor = conn.cursor()
+                    rows = cursor.execute(f'''
+                        SELECT {STAT_SHEET_COLUMNS} FROM stat_sheets
+                        WHERE created_at < ? ORDER BY id LIMIT ?
+                    ''', (cutoff, chunk_size)).fetchall()
+                    stat_sheets = self._load_stat_sheets(cursor, rows)
+                if not stat_sheets:
+                    break
+                
+                self._write_archive(archive_dir, stat_sheets)
+                
+                with self.connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute("BEGIN IMMEDIATE")
+                    # The sketches must hold these sheets before they are deleted
+                    self._compact_sketches(cursor)
+                    self._fold_into_archive(cursor, stat_sheets)
+                    ids = [sheet['id'] for sheet in stat_sheets]
+                    for start in range(0, len(ids), ITEM_FETCH_CHUNK):
+                        chunk = ids[start:start + ITEM_FETCH_CHUNK]
+                        placeholders = ','.join('?' * len(chunk))
+                        cursor.execute(f"DELETE FROM sheet_items WHERE sheet_id IN ({placeholders})", chunk)
+                        cursor.execute(f"DELETE FROM stat_sheets WHERE id IN ({placeholders})", chunk)
+                    self._bump_generation(cursor)
+                    conn.commit()
+                
+                archived += len(stat_sheets)
+                metrics.RETENTION_ARCHIVED.inc(len(stat_sheets))
+                if len(stat_sheets) < chunk_size:
+                    break
+        except Exception as e:
+            print(f"Error applying retention: {e}")
+            metrics.record_db_error('apply_retention')
+            return None
+        
+        if archived:
+            print(f"Archived {archived} stat sheets created before {cutoff} to {archive_dir}")
+            self.incremental_vacuum()
+        return archived
+    
+    @staticmethod
+    def _write_archive(archive_dir, stat_sheets):
+        """Write stat sheets to a gzip NDJSON archive file, atomically"""
+        path = os.path.join(
+            archive_dir, f"stat_sheets_{stat_sheets[0]['id']:010d}-{stat_sheets[-1]['id']:010d}.ndjson.gz"
+        )
+        with gzip.open(path + '.tmp', 'wt', encoding='utf-8') as f:
+            for sheet in stat_sheets:
+                f.write(json.dumps(sheet) + '\n')
+        os.replace(path + '.tmp', path)
+        return path
+    
+    def _fold_into_archive(self, cursor, stat_sheets):
+        """Add stat sheets' totals and heatmap points to the archive aggregate tables"""
+        item_totals = {}
+        for sheet in stat_sheets:
+            for item, count in sheet['looted_items'].items():
+                item_totals[item] = item_totals.get(item, 0) + count
+        rows = [('all', '', item, total) for item, total in item_totals.items()]
+        for bucket in TIME_BUCKETS:
+            rows.extend((bucket, *row) for row in self._time_bucket_rows(stat_sheets, bucket))
+        cursor.executemany('''
+            INSERT INTO archived_totals (kind, bucket_start, item, total) VALUES (?, ?, ?, ?)
+            ON CONFLICT(kind, bucket_start, item) DO UPDATE SET total = total + excluded.total
+        ''', rows)
+        
+        cells = {}
+        for sheet in stat_sheets:
+            for item, (x, y) in sheet['locations'].items():
+                count = sheet['looted_items'][item]
+                if count > 0:
+                    key = (item, int(x // HEATMAP_ARCHIVE_CELL), int(y // HEATMAP_ARCHIVE_CELL))
+                    cells[key] = cells.get(key, 0) + count
+        cursor.executemany('''
+            INSERT INTO heatmap_archive (item, cx, cy, total) VALUES (?, ?, ?, ?)
+            ON CONFLICT(item, cx, cy) DO UPDATE SET total = total + excluded.total
+        ''', [(*key, total) for key, total in cells.items()])
+        
+        cursor.execute(
+            "UPDATE rollup_counters SET value = value + ? WHERE name = 'archived_stat_sheets'",
+            (len(stat_sheets),)
+        )
+        cursor.executemany(
+            "INSERT OR IGNORE INTO archived_sheet_keys (match_id, player_id, sheet_id) VALUES (?, ?, ?)",
+            [(sheet['match_id'], sheet['player_id'], sheet['id']) for sheet in stat_sheets]
+        )
+        self._update_leaderboards(cursor, stat_sheets, column='archived')
+        self._update_sketches(cursor, stat_sheets, column='archived')
+        self._update_level_bands(cursor, stat_sheets, table='archived_level_band_totals')
+    
+    def incremental_vacuum(self, step_pages=VACUUM_STEP_PAGES):
+        """Return free pages to the OS a step at a time, keeping each write lock short"""
+        try:
+            with self.connection() as conn:
+                if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                    print("Incremental vacuum is off for this database; run "
+                          "'python db_handler.py vacuum' once to enable it")
+                    return False
+            
+            while True:
+                with self.connection() as conn:
+                    if not conn.execute("PRAGMA freelist_count").fetchone()[0]:
+                        return True
+                    conn.execute(f"PRAGMA incremental_vacuum({int(step_pages)})").fetchall()
+        except Exception as e:
+            print(f"Error running incremental vacuum: {e}")
+            metrics.record_db_error('incremental_vacuum')
+            return False
+    
+    def enable_incremental_vacuum(self):
+        """Switch an existing database to auto_vacuum=INCREMENTAL (rewrites the file once)"""
+        try:
+            with self.connection() as conn:
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                conn.execute("VACUUM")
+            print("Incremental vacuum enabled")
+            return True
+        except Exception as e:
+            print(f"Error enabling incremental vacuum: {e}")
+            metrics.record_db_error('enable_incremental_vacuum')
+            return False
+    
+    def close(self):
+        """Close all pooled database connections"""
+        self.pool.close()
+
+class ShardedDatabaseHandler:
+    """Stat sheets hash-partitioned by match_id across several SQLite files.
+    
+    Offers the same query interface as DatabaseHandler. Each match lives in
+    exactly one shard, so inserts for different matches take different write
+    locks; reads fan out across the shards on a thread pool and merge the
+    partial results. Stat sheet and sheet_items IDs are global:
+    local_id * num_shards + shard, so they are unique and keyset cursors work
+    across shards (ordering interleaves shards rather than following exact
+    insertion time). A player plays in matches on any shard, so each player
+    is also registered in the one shard its player_id hashes to, which keeps
+    the global distinct player count a sum of per-shard counters.
+    """
+    
+    def __init__(self, db_path="loot_telemetry.db", num_shards=2):
+        root, ext = os.path.splitext(db_path)
+        self.db_path = db_path
+        self.num_shards = num_shards
+        self.shards = [DatabaseHandler(f"{root}.shard{index}{ext}") for index in range(num_shards)]
+        for index, shard in enumerate(self.shards):
+            self._check_shard(index, shard)
+        self._executor = ThreadPoolExecutor(max_workers=num_shards, thread_name_prefix='shard')
+        self._init_player_registry()
+    
+    def _check_shard(self, index, shard):
+        """Record (or verify) which shard of how many a file is, so routing stays stable"""
+        with shard.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS shard_config (
+                    shard INTEGER NOT NULL,
+                    num_shards INTEGER NOT NULL
+                )
+            ''')
+            row = conn.execute("SELECT shard, num_shards FROM shard_config").fetchone()
+            if row is None:
+                conn.execute("INSERT INTO shard_config (shard, num_shards) VALUES (?, ?)",
+                             (index, self.num_shards))
+            elif tuple(row) != (index, self.num_shards):
+                raise ValueError(f"{shard.db_path} is shard {row[0]} of {row[1]}, "
+                                 f"not {index} of {self.num_shards}")
+    
+    def _init_player_registry(self):
+        """Create the per-shard player registry, filling it from the seen players on first use"""
+        for shard in self.shards:
+            with shard.connection() as conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS registered_players (
+                        player_id TEXT PRIMARY KEY
+                    ) WITHOUT ROWID
+                ''')
+                conn.executemany("INSERT OR IGNORE INTO rollup_counters (name, value) VALUES (?, 0)",
+                                 [('registered_players',), ('players_registry_filled',)])
+                conn.commit()
+        
+        with self.shards[0].connection() as conn:
+            filled = conn.execute(
+                "SELECT value FROM rollup_counters WHERE name = 'players_registry_filled'").fetchone()[0]
+        if filled:
+            return
+        # Registering is idempotent, so a fill interrupted (or run twice) stays exact
+        for shard in self.shards:
+            with shard.connection() as conn:
+                rows = conn.execute("SELECT player_id FROM seen_players")
+                while True:
+                    player_ids = [row[0] for row in rows.fetchmany(ITEM_FETCH_CHUNK)]
+                    if not player_ids:
+                        break
+                    self._register_players(player_ids)
+        with self.shards[0].connection() as conn:
+            conn.execute("UPDATE rollup_counters SET value = 1 WHERE name = 'players_registry_filled'")
+            conn.commit()
+    
+    def player_shard_for(self, player_id):
+        """Index of the shard that registers a player"""
+        return zlib.crc32(player_id.encode('utf-8')) % self.num_shards
+    
+    def _register_players(self, player_ids):
+        """Add player IDs to their registry shards, counting the ones not registered before"""
+        groups = {}
+        for player_id in set(player_ids):
+            groups.setdefault(self.player_shard_for(player_id), []).append(player_id)
+        
+        def register(index):
+            try:
+                with self.shards[index].connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute("BEGIN IMMEDIATE")
+                    cursor.executemany("INSERT OR IGNORE INTO registered_players (player_id) VALUES (?)",
+                                       [(player_id,) for player_id in groups[index]])
+                    cursor.execute("UPDATE rollup_counters SET value = value + ? WHERE name = 'registered_players'",
+                                   (cursor.rowcount,))
+                    conn.commit()
+            except Exception as e:
+                print(f"Error registering players: {e}")
+                metrics.record_db_error('sharded_register_players')
+        
+        self._fan_out(register, list(groups))
+    
+    @property
+    def connections_opened(self):
+        return sum(shard.connections_opened for shard in self.shards)
+    
+    def shard_for(self, match_id):
+        """Index of the shard that stores a match"""
+        return zlib.crc32(match_id.encode('utf-8')) % self.num_shards
+    
+    def _global_id(self, local_id, index):
+        return local_id * self.num_shards + index
+    
+    def _local_cursor(self, cursor, index):
+        """Translate a global "id < cursor" bound to one shard's local IDs"""
+        if not cursor:
+            return None
+        return -(-(cursor - index) // self.num_shards)
+    
+    def _fan_out(self, func, indexes=None):
+        """Run func(index) for each shard in parallel, returning results in shard order"""
+        indexes = range(self.num_shards) if indexes is None else indexes
+        return list(self._executor.map(func, indexes))
+    
+    def _query_shards(self, match_id=None, cursor=None):
+        """Shards a read has to visit, with each one's local cursor"""
+        indexes = [self.shard_for(match_id)] if match_id else range(self.num_shards)
+        targets = []
+        for index in indexes:
+            local_cursor = self._local_cursor(cursor, index)
+            if local_cursor is not None and local_cursor <= 0:
+                continue  # Nothing in this shard sorts before the cursor
+            targets.append((index, local_cursor))
+        return targets
+    
+    @metrics.timed_query('sharded_insert_stat_sheets')
+    def insert_stat_sheets(self, stat_sheets, report_duplicates=False):
+        """Route each stat sheet to its match's shard and insert the groups in parallel.
+        
+        Returns global IDs (or (id, duplicate) pairs with report_duplicates)
+        in input order, or None if any shard failed. Each shard's group is one
+        transaction, so a failure in one shard does not roll back the groups
+        other shards already committed. A match lives on one shard, so the
+        per-shard (match_id, player_id) uniqueness holds globally.
+        """
+        if not stat_sheets:
+            return []
+        
+        positions = {}
+        for position, sheet in enumerate(stat_sheets):
+            positions.setdefault(self.shard_for(sheet['match_id']), []).append(position)
+        
+        def insert(index):
+            return self.shards[index].insert_stat_sheets([stat_sheets[p] for p in positions[index]],
+                                                         report_duplicates=True)
+        
+        results = dict(zip(positions, self._fan_out(insert, list(positions))))
+        # Duplicates are registered again too (a no-op), so a retry repairs a
+        # registration lost after its shard had committed
+        self._register_players([
+            stat_sheets[position]['player_id']
+            for index, local_results in results.items() if local_results is not None
+            for position in positions[index]
+        ])
+        if any(local_results is None for local_results in results.values()):
+            return None
+        
+        sheet_ids = [None] * len(stat_sheets)
+        for index, local_results in results.items():
+            for position, (local_id, duplicate) in zip(positions[index], local_results):
+                sheet_id = self._global_id(local_id, index)
+                sheet_ids[position] = (sheet_id, duplicate) if report_duplicates else sheet_id
+        return sheet_ids
+    
+    def insert_stat_sheet(self, stat_sheet):
+        """Insert a single stat sheet into its shard"""
+        sheet_ids = self.insert_stat_sheets([stat_sheet])
+        return sheet_ids[0] if sheet_ids else None
+    
+    def get_data_generation(self):
+        """Sum of the shards' generations (changes whenever any shard does), latest modified_at"""
+        versions = self._fan_out(lambda index: self.shards[index].get_data_generation())
+        if any(generation is None for generation, _ in versions):
+            return None, None
+        return sum(generation for generation, _ in versions), max(modified for _, modified in versions)
+    
+    def _globalize_sheets(self, stat_sheets, index):
+        # Copy rather than mutate: the shard's iterator reads the last local id back
+        for sheet in stat_sheets:
+            yield {**sheet, 'id': self._global_id(sheet['id'], index)}
+    
+    def iter_stat_sheets(self, match_id=None, player_id=None, item=None, cursor=None,
+                         chunk_size=STAT_SHEET_CHUNK, start=None, end=None, ranges=None):
+        """Yield stat sheets by descending global id, lazily merging every shard's stream"""
+        streams = [
+            self._globalize_sheets(self.shards[index].iter_stat_sheets(
+                match_id=match_id, player_id=player_id, item=item, cursor=local_cursor,
+                chunk_size=chunk_size, start=start, end=end, ranges=ranges), index)
+            for index, local_cursor in self._query_shards(match_id, cursor)
+        ]
+        yield from heapq.merge(*streams, key=lambda sheet: sheet['id'], reverse=True)
+    
+    @metrics.timed_query('sharded_get_stat_sheets')
+    def get_stat_sheets(self, match_id=None, player_id=None, limit=None, item=None, cursor=None,
+                        start=None, end=None, ranges=None):
+        """Fetch up to limit sheets from every shard in parallel and keep the newest limit"""
+        targets = self._query_shards(match_id, cursor)
+        
+        def fetch(target):
+            index, local_cursor = target
+            stat_sheets = self.shards[index].get_stat_sheets(
+                match_id=match_id, player_id=player_id, limit=limit, item=item,
+                cursor=local_cursor, start=start, end=end, ranges=ranges)
+            return list(self._globalize_sheets(stat_sheets, index))
+        
+        partials = self._fan_out(fetch, targets)
+        merged = heapq.merge(*partials, key=lambda sheet: sheet['id'], reverse=True)
+        return list(islice(merged, limit))
+    
+    def get_stat_sheets_page(self, match_id=None, player_id=None, item=None, cursor=None, limit=STAT_SHEET_CHUNK,
+                             start=None, end=None, ranges=None):
+        """Retrieve one page of stat sheets plus the next_cursor (None on the last page)"""
+        stat_sheets = self.get_stat_sheets(match_id=match_id, player_id=player_id, item=item,
+                                           cursor=cursor, limit=limit + 1, start=start, end=end,
+                                           ranges=ranges)
+        if len(stat_sheets) > limit:
+            stat_sheets = stat_sheets[:limit]
+            return stat_sheets, stat_sheets[-1]['id']
+        return stat_sheets, None
+    
+    @staticmethod
+    def _sum_totals(partials):
+        """Add up {item: total} dicts, keeping first-seen item order"""
+        totals = {}
+        for partial in partials:
+            for item, total in partial.items():
+                totals[item] = totals.get(item, 0) + total
+        return totals
+    
+    @metrics.timed_query('sharded_get_item_totals')
+    def get_item_totals(self, match_id=None, player_id=None):
+        """Sum looted items per item type across the shards that can hold matching sheets"""
+        indexes = [index for index, _ in self._query_shards(match_id)]
+        partials = self._fan_out(
+            lambda index: self.shards[index].get_item_totals(match_id=match_id, player_id=player_id), indexes)
+        return self._sum_totals(partials)
+    
+    @metrics.timed_query('sharded_get_aggregate_stats')
+    def get_aggregate_stats(self, approx=False, start=None, end=None, ranges=None):
+        """Merge every shard's rollups; players are unioned since one player spans matches.
+        
+        Exact counts add up the shards' player registries, where each player
+        is counted once; with approx=True their HyperLogLog sketches are
+        merged instead.
+        """
+        try:
+            def read(index):
+                shard = self.shards[index]
+                if ranges:
+                    return (shard.get_aggregate_stats(start=start, end=end, ranges=ranges),
+                            shard._filtered_player_ids(ranges, start, end))
+                if approx:
+                    return (shard.get_aggregate_stats(approx=True, start=start, end=end),
+                            {name: shard.get_distinct_sketch(name, start, end) for name in DISTINCT_SKETCHES})
+                return shard.get_aggregate_stats(), shard._registered_player_count()
+            
+            partials = self._fan_out(read)
+            if approx and not ranges:
+                distinct = {name: HyperLogLog() for name in DISTINCT_SKETCHES}
+                for _, sketches in partials:
+                    for name, sketch in sketches.items():
+                        distinct[name].merge(sketch)
+                total_matches = distinct['matches'].count()
+                total_players = distinct['players'].count()
+            else:
+                total_matches = sum(stats['total_matches'] for stats, _ in partials)
+                if ranges:
+                    total_players = len(set().union(*(player_ids for _, player_ids in partials)))
+                else:
+                    total_players = sum(registered for _, registered in partials)
+            return {
+                'total_items': self._sum_totals(stats['total_items'] for stats, _ in partials),
+                'total_matches': total_matches,
+                'total_players': total_players,
+                'total_stat_sheets': sum(stats['total_stat_sheets'] for stats, _ in partials)
+            }
+        except Exception as e:
+            print(f"Error getting aggregate stats: {e}")
+            metrics.record_db_error('sharded_get_aggregate_stats')
+            return {}
+    
+    def get_level_bands(self, item=None, ranges=None, start=None, end=None):
+        """Add up every shard's level bands"""
+        partials = self._fan_out(lambda index: self.shards[index].get_level_bands(item, ranges, start, end))
+        if any(bands is None for bands in partials):
+            return None
+        
+        totals = {}
+        for bands in partials:
+            for band, *sums in bands:
+                totals[band] = [a + b for a, b in zip(totals.get(band, [0, 0, 0, 0]), sums)]
+        return [(band, *totals[band]) for band in sorted(totals)]
+    
+    def get_distinct_sketch(self, name, start=None, end=None):
+        """Union of every shard's HyperLogLog"""
+        partials = self._fan_out(lambda index: self.shards[index].get_distinct_sketch(name, start, end))
+        if any(sketch is None for sketch in partials):
+            return None
+        merged = HyperLogLog()
+        for sketch in partials:
+            merged.merge(sketch)
+        return merged
+    
+    def get_quantile_sketch(self, item=None, start=None, end=None):
+        """Every shard's KLL sketch merged into one"""
+        partials = self._fan_out(lambda index: self.shards[index].get_quantile_sketch(item, start, end))
+        if any(sketch is None for sketch in partials):
+            return None
+        merged = KllSketch()
+        for sketch in partials:
+            merged.merge(sketch)
+        return merged
+    
+    @metrics.timed_query('sharded_get_timeseries')
+    def get_timeseries(self, item=None, start=None, end=None, bucket='hour', limit=TIMESERIES_MAX_POINTS):
+        """Add up every shard's time buckets"""
+        partials = self._fan_out(lambda index: self.shards[index].get_timeseries(
+            item=item, start=start, end=end, bucket=bucket, limit=limit))
+        if any(points is None for points in partials):
+            return None
+        
+        totals = self._sum_totals(dict(points) for points in partials)
+        return sorted(totals.items())[:limit]
+    
+    def get_leaderboard(self, board, item=None, k=LEADERBOARD_DEFAULT_K, start=None, end=None):
+        """Merge the shards' leaderboards into one exact top k.
+        
+        A match lives on one shard, so merging each shard's top k is enough.
+        A player can loot in matches on several shards, so the shards' top
+        `depth` players are re-summed across every shard, deepening until no
+        unseen player can beat the k-th total: an unseen player has at most
+        each shard's last listed total, so their combined total is bounded by
+        the sum of those (a threshold-algorithm stop rule).
+        """
+        depth = k
+        while True:
+            partials = self._fan_out(lambda index: self.shards[index].get_leaderboard(
+                board, item=item, k=depth, start=start, end=end))
+            if any(entries is None for entries in partials):
+                return None
+            if board != 'players':
+                break
+            
+            candidates = {owner_id for entries in partials for owner_id, _ in entries}
+            threshold = sum(entries[-1][1] for entries in partials if len(entries) == depth)
+            partials = self._fan_out(lambda index: self.shards[index].get_leaderboard(
+                board, item=item, k=len(candidates), start=start, end=end, owners=candidates))
+            if any(entries is None for entries in partials):
+                return None
+            
+            totals = self._sum_totals(dict(entries) for entries in partials)
+            ranked = sorted(totals.values(), reverse=True)
+            if not threshold or (len(ranked) >= k and ranked[k - 1] > threshold):
+                break
+            depth *= 4
+        
+        totals = self._sum_totals(dict(entries) for entries in partials)
+        return sorted(totals.items(), key=lambda entry: (-entry[1], entry[0]))[:k]
+    
+    def _merge_rows(self, partials, limit):
+        """Merge per-shard (rowid, ...) rows by descending global rowid"""
+        streams = [
+            [(self._global_id(row[0], index), *row[1:]) for row in rows]
+            for index, rows in partials
+        ]
+        merged = heapq.merge(*streams, key=lambda row: row[0], reverse=True)
+        return list(islice(merged, limit))
+    
+    def get_heatmap_data(self, item_name):
+        """Get location data for heatmap visualization"""
+        locations, _ = self.get_heatmap_page(item_name)
+        return locations
+    
+    @metrics.timed_query('sharded_get_heatmap_page')
+    def get_heatmap_page(self, item_name, limit=None, cursor=None):
+        """Get one page of heatmap points by descending global sheet_items rowid"""
+        try:
+            def fetch(target):
+                index, local_cursor = target
+                return index, self.shards[index]._heatmap_rows(item_name, limit, local_cursor)
+            
+            rows = self._merge_rows(self._fan_out(fetch, self._query_shards(cursor=cursor)), limit)
+            return DatabaseHandler._heatmap_page(rows, limit)
+        except Exception as e:
+            print(f"Error getting heatmap data: {e}")
+            metrics.record_db_error('sharded_get_heatmap_page')
+            return [], None
+    
+    @metrics.timed_query('sharded_get_locations')
+    def get_locations(self, bbox, item=None, limit=None, cursor=None):
+        """Get locations inside a bounding box from every shard, merged by global rowid"""
+        try:
+            def fetch(target):
+                index, local_cursor = target
+                rows = self.shards[index]._location_rows(bbox, item, limit, local_cursor)
+                # sheet_id is a local stat sheet ID too
+                return index, [(rowid, self._global_id(sheet_id, index), *rest)
+                               for rowid, sheet_id, *rest in rows]
+            
+            rows = self._merge_rows(self._fan_out(fetch, self._query_shards(cursor=cursor)), limit)
+            return DatabaseHandler._locations_page(rows, limit)
+        except Exception as e:
+            print(f"Error getting locations: {e}")
+            metrics.record_db_error('sharded_get_locations')
+            return [], None
+    
+    @metrics.timed_query('sharded_get_heatmap_grid')
+    def get_heatmap_grid(self, item_name, bins=HEATMAP_BINS, value_range=HEATMAP_RANGE):
+        """Add up every shard's heatmap grid"""
+        partials = self._fan_out(lambda index: self.shards[index].get_heatmap_grid(
+            item_name, bins=bins, value_range=value_range))
+        if any(grid is None for grid in partials):
+            return None
+        
+        grid = np.sum([partial['grid'] for partial in partials], axis=0, dtype=np.int64)
+        return {**partials[0], 'grid': grid.tolist(), 'total': int(grid.sum())}
+    
+    @metrics.timed_query('sharded_get_heatmap_grids')
+    def get_heatmap_grids(self, bins=HEATMAP_BINS, value_range=HEATMAP_RANGE):
+        """Add up every shard's per-item heatmap grids"""
+        partials = self._fan_out(lambda index: self.shards[index].get_heatmap_grids(
+            bins=bins, value_range=value_range))
+        if any(partial is None for partial in partials):
+            return None
+        
+        items = sorted({item for partial in partials for item in partial['grids']})
+        grids = {}
+        for item in items:
+            grids[item] = np.sum([partial['grids'][item] for partial in partials if item in partial['grids']],
+                                 axis=0, dtype=np.int64)
+        return {**partials[0],
+                'grids': {item: grid.tolist() for item, grid in grids.items()},
+                'totals': {item: int(grid.sum()) for item, grid in grids.items()}}
+    
+    def rebuild_rollups(self):
+        """Rebuild the rollup tables in every shard"""
+        return all(self._fan_out(lambda index: self.shards[index].rebuild_rollups()))
+    
+    def clear_database(self):
+        """Clear all stat sheets and registered players from every shard"""
+        self._fan_out(lambda index: self.shards[index].clear_database())
+        for shard in self.shards:
+            with shard.connection() as conn:
+                conn.execute("DELETE FROM registered_players")
+                # Clearing zeroed every counter; the now empty registry is still complete
+                conn.execute("UPDATE rollup_counters SET value = 1 WHERE name = 'players_registry_filled'")
+                conn.commit()
+    
+    def apply_retention(self, cutoff, archive_dir=ARCHIVE_DIR, chunk_size=ARCHIVE_CHUNK):
+        """Apply retention in every shard, archiving each into its own subdirectory"""
+        archived = self._fan_out(lambda index: self.shards[index].apply_retention(
+            cutoff, os.path.join(archive_dir, f"shard{index}"), chunk_size))
+        return None if any(count is None for count in archived) else sum(archived)
+    
+    def enable_incremental_vacuum(self):
+        """Enable incremental vacuum on every shard"""
+        return all(self._fan_out(lambda index: self.shards[index].enable_incremental_vacuum()))
     
     def close(self):
-        """Close database connection (if needed for cleanup)"""
-        pass  # Using context managers, so no explicit close needed
\ No newline at end of file
+        """Stop the fan-out pool and close every shard"""
+        self._executor.shutdown(wait=True)
+        for shard in self.shards:
+            shard.close()
+
+def open_database(db_path="loot_telemetry.db", num_shards=1):
+    """Open a DatabaseHandler, or a ShardedDatabaseHandler when num_shards > 1"""
+    if num_shards > 1:
+        return ShardedDatabaseHandler(db_path, num_shards)
+    return DatabaseHandler(db_path)
+
+class WriteBehindQueue:
+    """Bounded in-memory ingest queue drained by a background group-commit writer"""
+    
+    def __init__(self, db, max_size=INGEST_QUEUE_SIZE, flush_size=INGEST_FLUSH_SIZE,
+                 flush_interval=INGEST_FLUSH_INTERVAL):
+        self.db = db
+        self.max_size = max_size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_size)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        # Held across the stop check and put in submit(), and while close()
+        # sets stop, so no sheet is queued after the writer may have exited
+        self._submit_lock = threading.Lock()
+        
+        # Counters reported by stats()
+        self.enqueued = 0
+        self.rejected = 0
+        self.written = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_commit_lag = 0.0
+        self.max_commit_lag = 0.0
+        
+        self._thread = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+        self._thread.start()
+    
+    def submit(self, stat_sheet, block=False, on_commit=None):
+        """Queue a validated stat sheet, returning False if the queue is full.
+        
+        With block=True, wait for room instead, which pushes back on
+        streaming clients; False then means the queue was closed.
+        on_commit, if given, is called from the writer thread once the sheet
+        is settled: with its (id, duplicate) pair, or None if it failed.
+        """
+        while True:
+            with self._submit_lock:
+                if self._stop.is_set():
+                    return False
+                try:
+                    self._queue.put_nowait((time.monotonic(), stat_sheet, on_commit))
+                except queue.Full:
+                    if not block:
+                        with self._lock:
+                            self.rejected += 1
+                        return False
+                else:
+                    with self._lock:
+                        self.enqueued += 1
+                    return True
+            
+            # Wait for the writer to make room without holding up other
+            # submitters, re-checking for close at least every flush_interval
+            with self._queue.not_full:
+                self._queue.not_full.wait(self.flush_interval)
+    
+    def _run(self):
+        """Writer loop: keep committing batches until stopped and drained"""
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._drain()
+            if batch:
+                self._commit(batch)
+    
+    def _drain(self):
+        """Collect up to flush_size sheets, waiting at most flush_interval after the first"""
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.flush_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+    
+    def _insert(self, stat_sheets):
+        """Insert a group, splitting a failed one in halves so only the bad sheets are lost.
+        
+        Returns (id, duplicate) pairs in input order, with None for each sheet
+        that could not be stored on its own.
+        """
+        results = self.db.insert_stat_sheets(stat_sheets, report_duplicates=True)
+        if results is not None:
+            return results
+        if len(stat_sheets) == 1:
+            return [None]
+        middle = len(stat_sheets) // 2
+        return self._insert(stat_sheets[:middle]) + self._insert(stat_sheets[middle:])
+    
+    def _commit(self, batch):
+        """Write one batch in a single transaction and update counters"""
+        # Every sheet was already acknowledged, so a failed group commit is
+        # retried in smaller groups rather than dropped as a whole
+        results = self._insert([sheet for _, sheet, _ in batch])
+        lag = time.monotonic() - batch[0][0]
+        
+        with self._lock:
+            for result in results:
+                if result is None:
+                    self.failed += 1
+                else:
+                    # Resubmitted sheets are acknowledged but not stored again
+                    self.written += 1
+                    self.duplicates += result[1]
+            self.batches += 1
+            self.last_commit_lag = lag
+            self.max_commit_lag = max(self.max_commit_lag, lag)
+        
+        for (_, _, on_commit), result in zip(batch, results):
+            try:
+                if on_commit is not None:
+                    on_commit(result)
+            except Exception as e:
+                # A failing callback must not stop the writer or hang flush()
+                print(f"Error in ingest commit callback: {e}")
+            finally:
+                self._queue.task_done()
+    
+    def flush(self):
+        """Block until every queued stat sheet has been committed (or failed)"""
+        self._queue.join()
+    
+    def is_alive(self):
+        """Whether the writer thread is still running (it exits once closed and drained)"""
+        return self._thread.is_alive()
+    
+    def close(self, timeout=30):
+        """Stop accepting sheets and drain the queue before returning"""
+        with self._submit_lock:
+            self._stop.set()
+        self._thread.join(timeout)
+    
+    def stats(self):
+        """Queue depth, lag and throughput counters"""
+        with self._queue.mutex:
+            oldest = self._queue.queue[0][0] if self._queue.queue else None
+        
+        with self._lock:
+            return {
+                'depth': self._queue.qsize(),
+                'pending': self.enqueued - self.written - self.failed,
+                'capacity': self.max_size,
+                'enqueued': self.enqueued,
+                'rejected': self.rejected,
+                'written': self.written,
+                'duplicates': self.duplicates,
+                'failed': self.failed,
+                'batches': self.batches,
+                'oldest_pending_ms': round((time.monotonic() - oldest) * 1000, 2) if oldest else 0.0,
+                'last_commit_lag_ms': round(self.last_commit_lag * 1000, 2),
+                'max_commit_lag_ms': round(self.max_commit_lag * 1000, 2)
+            }
+
+
+class RetentionJob:
+    """Background thread that archives stat sheets older than the retention window"""
+    
+    def __init__(self, db, retention_days, archive_dir=ARCHIVE_DIR, interval=RETENTION_INTERVAL):
+        self.db = db
+        self.retention_days = retention_days
+        self.archive_dir = archive_dir
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        
+        # Counters reported by stats()
+        self.runs = 0
+        self.archived = 0
+        self.failures = 0
+        self.last_run = None
+        self.last_cutoff = None
+        
+        self._thread = threading.Thread(target=self._run, name='retention', daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        """Run once at startup, then every interval seconds until closed"""
+        while True:
+            self.run_once()
+            if self._stop.wait(self.interval):
+                return
+    
+    def run_once(self):
+        """Archive everything older than the window now; returns sheets archived or None"""
+        cutoff = retention_cutoff(self.retention_days)
+        archived = self.db.apply_retention(cutoff, self.archive_dir)
+        with self._lock:
+            self.runs += 1
+            self.last_run = datetime.now().isoformat()
+            self.last_cutoff = cutoff
+            if archived is None:
+                self.failures += 1
+            else:
+                self.archived += archived
+        return archived
+    
+    def close(self, timeout=30):
+        """Stop scheduling runs, waiting for one in progress to finish"""
+        self._stop.set()
+        self._thread.join(timeout)
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'retention_days': self.retention_days,
+                'archive_dir': self.archive_dir,
+                'interval_s': self.interval,
+                'runs': self.runs,
+                'archived': self.archived,
+                'failures': self.failures,
+                'last_run': self.last_run,
+                'last_cutoff': self.last_cutoff
+            }
+
+
+def retention_cutoff(retention_days):
+    """created_at cutoff for a retention window, in SQLite's CURRENT_TIMESTAMP format (UTC)"""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+    return cutoff.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def spatial_cell_coords(x, y):
+    """Grid column and row for a map position, clamped to the grid edges"""
+    return (min(max(int(x / SPATIAL_CELL_SIZE), 0), SPATIAL_GRID - 1),
+            min(max(int(y / SPATIAL_CELL_SIZE), 0), SPATIAL_GRID - 1))
+
+
+def spatial_cell(x, y):
+    """sheet_items.cell value for a map position"""
+    cx, cy = spatial_cell_coords(x, y)
+    return cx * SPATIAL_GRID + cy
+
+
+def loot_per_minute(items, duration_seconds):
+    """Items looted per minute of match time, or None without a positive duration"""
+    if not duration_seconds or duration_seconds <= 0:
+        return None
+    return items * 60.0 / duration_seconds
+
+
+def level_band_range(band):
+    """(lowest, highest) player level in a level band"""
+    return band * LEVEL_BAND_SIZE + 1, (band + 1) * LEVEL_BAND_SIZE
+
+
+def time_bucket_start(timestamp, bucket):
+    """Start of the minute/hour/day bucket containing an ISO-8601 timestamp"""
+    prefix_length, suffix = TIME_BUCKETS[bucket]
+    return timestamp[:prefix_length].replace(' ', 'T') + suffix
+
+
+def _to_datetime64(values, unit):
+    """Convert timestamp strings to datetime64, using NaT for unparseable values"""
+    try:
+        return np.array(values, dtype=f'datetime64[{unit}]')
+    except ValueError:
+        converted = []
+        for value in values:
+            try:
+                converted.append(np.datetime64(value, unit))
+            except ValueError:
+                converted.append(np.datetime64('NaT'))
+        return np.array(converted, dtype=f'datetime64[{unit}]')
+
+
+def load_columnar(path, mmap_mode='r'):
+    """Load a columnar export as a dict of (memory-mapped) NumPy arrays.
+    
+    Column and vocabulary arrays are keyed by name, e.g. data['item_x'] or
+    data['items'][data['item_code']] to decode item names. The manifest is
+    available as data['manifest'].
+    """
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    
+    if manifest['format_version'] != COLUMNAR_FORMAT_VERSION:
+        raise ValueError(f"Unsupported columnar export version: {manifest['format_version']}")
+    
+    data = {'manifest': manifest}
+    for name in list(manifest['columns']) + manifest['vocabularies']:
+        data[name] = np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Loot telemetry database maintenance')
+    parser.add_argument('--db', default='loot_telemetry.db', help='Database file path')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('rebuild-rollups', help='Recompute rollup tables from the raw stat sheets')
+    export_parser = subparsers.add_parser('export-columnar', help='Export stat sheets as memory-mappable .npy columns')
+    export_parser.add_argument('out_dir', help='Directory to write the .npy columns into')
+    compact_parser = subparsers.add_parser('compact', help='Archive stat sheets older than the retention window')
+    compact_parser.add_argument('--retention-days', type=float, required=True, help='Days of raw stat sheets to keep')
+    compact_parser.add_argument('--archive-dir', default=ARCHIVE_DIR, help='Directory for gzip NDJSON archives')
+    subparsers.add_parser('vacuum', help='Enable incremental vacuum on an existing database (one full VACUUM)')
+    
+    args = parser.parse_args()
+    
+    db = DatabaseHandler(args.db)
+    try:
+        if args.command == 'rebuild-rollups':
+            db.rebuild_rollups()
+        elif args.command == 'export-columnar':
+            db.export_columnar(args.out_dir)
+        elif args.command == 'compact':
+            db.apply_retention(retention_cutoff(args.retention_days), args.archive_dir)
+        elif args.command == 'vacuum':
+            db.enable_incremental_vacuum()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
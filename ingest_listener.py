@@ -0,0 +1,310 @@
+"""
+Line-protocol ingest listener for Loot Telemetry Simulator
+Fire-and-forget alternative to POST /api/submit for game servers: stat sheets
+arrive as newline-delimited JSON over persistent TCP connections (or, lossily,
+UDP datagrams), go through the same validation as the HTTP API and are
+committed in batches by a write-behind queue
+"""
+
+import argparse
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+import payloads
+from db_handler import (
+    WriteBehindQueue, open_database,
+    INGEST_QUEUE_SIZE, INGEST_FLUSH_SIZE, INGEST_FLUSH_INTERVAL
+)
+
+DEFAULT_TCP_PORT = 5001
+DEFAULT_UDP_PORT = 5002
+
+# Longest accepted line (one stat sheet); longer lines are skipped as errors
+MAX_LINE_BYTES = 1024 * 1024
+# Datagrams carry whole lines; senders pack several per datagram up to this size
+# (Ethernet MTU minus IP and UDP headers, so datagrams are never fragmented)
+UDP_DATAGRAM_BYTES = 1472
+UDP_RECEIVE_BUFFER = 4 * 1024 * 1024
+# Errors reported back per TCP connection (the rest are only counted)
+MAX_REPORTED_ERRORS = 5
+# Seconds between checks that the writer is still running while a
+# connection waits for its sheets to be committed
+SETTLE_CHECK_INTERVAL = 1.0
+
+
+class IngestListener:
+    """TCP and optional UDP listeners feeding newline-delimited stat sheets into a WriteBehindQueue.
+
+    TCP is lossless: when the queue is full the reader stops reading, so
+    TCP flow control slows the sender down. When a client half-closes its
+    connection, the listener waits until that client's own sheets are
+    committed (or have failed) and replies with one JSON summary line. UDP never waits: sheets that
+    arrive while the queue is full are dropped and counted.
+    """
+
+    def __init__(self, db, host='0.0.0.0', tcp_port=DEFAULT_TCP_PORT, udp_port=None,
+                 max_size=INGEST_QUEUE_SIZE, flush_size=INGEST_FLUSH_SIZE,
+                 flush_interval=INGEST_FLUSH_INTERVAL):
+        self.host = host
+        self.tcp_port = tcp_port
+        self.udp_port = udp_port
+        self.queue = WriteBehindQueue(db, max_size=max_size, flush_size=flush_size,
+                                      flush_interval=flush_interval)
+        self._servers = []
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+
+        # Counters reported by stats(), per transport
+        self.connections = 0
+        self.received = {'tcp': 0, 'udp': 0}
+        self.rejected = {'tcp': 0, 'udp': 0}
+        self.dropped = 0
+        self.bytes_received = {'tcp': 0, 'udp': 0}
+
+    def start(self):
+        """Bind the listeners and serve them from background threads (port 0 picks a free port)"""
+        listener = self
+
+        class TcpHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                listener._handle_stream(self.rfile, self.wfile)
+
+        class UdpHandler(socketserver.BaseRequestHandler):
+            def handle(self):
+                listener._handle_datagram(self.request[0])
+
+        tcp_server = socketserver.ThreadingTCPServer((self.host, self.tcp_port), TcpHandler, bind_and_activate=False)
+        tcp_server.allow_reuse_address = True
+        tcp_server.daemon_threads = True
+        tcp_server.server_bind()
+        tcp_server.server_activate()
+        self.tcp_port = tcp_server.server_address[1]
+        self._servers.append(tcp_server)
+
+        if self.udp_port is not None:
+            udp_server = socketserver.UDPServer((self.host, self.udp_port), UdpHandler)
+            udp_server.max_packet_size = 65535
+            # A deeper kernel buffer absorbs bursts while a datagram is being parsed
+            udp_server.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_RECEIVE_BUFFER)
+            self.udp_port = udp_server.server_address[1]
+            self._servers.append(udp_server)
+
+        for server in self._servers:
+            threading.Thread(target=server.serve_forever, name='ingest-listener', daemon=True).start()
+        return self
+
+    def close(self, timeout=30):
+        """Stop listening and commit everything already queued, waiting up to timeout seconds"""
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers = []
+        self.queue.close(timeout)
+        # Connections still waiting for sheets the writer did not get to stop waiting
+        self._closed.set()
+
+    @staticmethod
+    def _parse_line(line):
+        """Decode and validate one line, returning (stat_sheet, error message or None)"""
+        try:
+            stat_sheet = payloads.json_loads(line)
+        except ValueError as e:
+            return None, f'Invalid JSON: {e}'
+        return stat_sheet, payloads.validate_stat_sheet(stat_sheet)
+
+    def _handle_stream(self, rfile, wfile):
+        """Read one TCP connection line by line; summarize it once the client half-closes"""
+        with self._lock:
+            self.connections += 1
+        received = accepted = 0
+        errors = []
+        # The queue is shared with every other connection, so this one counts
+        # its own sheets as the writer settles them
+        settled = threading.Condition()
+        outcome = {'committed': 0, 'duplicates': 0, 'failed': 0}
+
+        def on_commit(result):
+            with settled:
+                if result is None:
+                    outcome['failed'] += 1
+                else:
+                    outcome['committed'] += 1
+                    outcome['duplicates'] += result[1]
+                settled.notify()
+
+        while True:
+            line = rfile.readline(MAX_LINE_BYTES + 1)
+            if not line:
+                break
+            size = len(line)
+            if len(line) > MAX_LINE_BYTES and not line.endswith(b'\n'):
+                # Skip the rest of an oversized line
+                while line and not line.endswith(b'\n'):
+                    line = rfile.readline(MAX_LINE_BYTES)
+                    size += len(line)
+                error = f'Line longer than {MAX_LINE_BYTES} bytes'
+            elif not line.strip():
+                continue
+            else:
+                stat_sheet, error = self._parse_line(line)
+                if not error and not self.queue.submit(stat_sheet, block=True, on_commit=on_commit):
+                    error = 'Listener is shutting down'
+
+            received += 1
+            with self._lock:
+                self.received['tcp'] += 1
+                self.bytes_received['tcp'] += size
+                if error:
+                    self.rejected['tcp'] += 1
+            if error:
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({'line': received, 'error': error})
+            else:
+                accepted += 1
+
+        # Wait for this client's sheets only, however busy other connections
+        # keep the queue, but not for a writer that died or was given up on
+        with settled:
+            while outcome['committed'] + outcome['failed'] < accepted:
+                if self._closed.is_set() or not self.queue.is_alive():
+                    break
+                settled.wait(SETTLE_CHECK_INTERVAL)
+            # Sheets not settled by now are not known to be stored
+            summary = {'received': received, 'accepted': accepted, 'rejected': received - accepted,
+                       **outcome, 'errors': errors}
+            summary['failed'] = accepted - outcome['committed']
+        try:
+            wfile.write(payloads.json_dumps(summary) + b'\n')
+        except OSError:
+            pass  # the client closed without waiting for the summary
+
+    def _handle_datagram(self, data):
+        """Queue every line in a datagram, dropping what does not fit"""
+        received = rejected = dropped = 0
+        for line in data.splitlines():
+            if not line.strip():
+                continue
+            received += 1
+            stat_sheet, error = self._parse_line(line)
+            if error:
+                rejected += 1
+            elif not self.queue.submit(stat_sheet):
+                dropped += 1
+        with self._lock:
+            self.received['udp'] += received
+            self.rejected['udp'] += rejected
+            self.dropped += dropped
+            self.bytes_received['udp'] += len(data)
+
+    def stats(self):
+        """Per-transport receive counters plus the write-behind queue's"""
+        with self._lock:
+            return {
+                'tcp_port': self.tcp_port,
+                'udp_port': self.udp_port,
+                'connections': self.connections,
+                'received': dict(self.received),
+                'rejected': dict(self.rejected),
+                'dropped': self.dropped,
+                'bytes_received': dict(self.bytes_received),
+                'queue': self.queue.stats()
+            }
+
+
+class LineSender:
+    """Client side of the listener: sends stat sheets as NDJSON over TCP or packed UDP datagrams.
+
+    A TCP sender keeps one connection open for all its sends; close() half-
+    closes it and returns the listener's summary once every sheet sent is
+    committed or has failed. UDP sends get no reply, and close() returns None.
+    """
+
+    def __init__(self, host, port, transport='tcp', timeout=30):
+        self.transport = transport
+        self.address = (host, port)
+        if transport == 'tcp':
+            self.sock = socket.create_connection(self.address, timeout=timeout)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        elif transport == 'udp':
+            self.sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_DGRAM)
+        else:
+            raise ValueError(f'Unknown transport: {transport}')
+
+    @staticmethod
+    def encode(stat_sheets):
+        """One JSON line per stat sheet"""
+        return [payloads.json_dumps(sheet) + b'\n' for sheet in stat_sheets]
+
+    def send_lines(self, lines):
+        """Send encoded lines; UDP packs as many whole lines per datagram as fit"""
+        if self.transport == 'tcp':
+            self.sock.sendall(b''.join(lines))
+            return
+        datagram = b''
+        for line in lines:
+            if datagram and len(datagram) + len(line) > UDP_DATAGRAM_BYTES:
+                self.sock.sendto(datagram, self.address)
+                datagram = b''
+            datagram += line
+        if datagram:
+            self.sock.sendto(datagram, self.address)
+
+    def close(self):
+        """Close the connection, returning the listener's summary for TCP"""
+        try:
+            if self.transport != 'tcp':
+                return None
+            self.sock.shutdown(socket.SHUT_WR)
+            reply = self.sock.makefile('rb').readline()
+            return payloads.json_loads(reply) if reply else None
+        finally:
+            self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Accept newline-delimited stat sheets over TCP (and optionally UDP)')
+    parser.add_argument('--host', default='0.0.0.0', help='Interface to listen on')
+    parser.add_argument('--tcp-port', type=int, default=DEFAULT_TCP_PORT, help='TCP port for NDJSON streams')
+    parser.add_argument('--udp-port', type=int, default=None,
+                        help=f'Also accept lossy UDP datagrams on this port (e.g. {DEFAULT_UDP_PORT})')
+    parser.add_argument('--queue-size', type=int, default=INGEST_QUEUE_SIZE, help='Max queued stat sheets (UDP drops beyond this)')
+    parser.add_argument('--flush-size', type=int, default=INGEST_FLUSH_SIZE, help='Max stat sheets per group commit')
+    parser.add_argument('--flush-interval', type=float, default=INGEST_FLUSH_INTERVAL, help='Max seconds a sheet waits before a commit')
+    parser.add_argument('--shards', type=int, default=None, help='Number of database shards (must match the server)')
+    args = parser.parse_args()
+
+    # Same database selection as server.py, so both can run side by side
+    db = open_database(os.environ.get('LOOT_DB_PATH', 'loot_telemetry.db'),
+                       args.shards or int(os.environ.get('LOOT_DB_SHARDS', 1)))
+    listener = IngestListener(db, args.host, args.tcp_port, args.udp_port, max_size=args.queue_size,
+                              flush_size=args.flush_size, flush_interval=args.flush_interval).start()
+    print("📡 Loot Telemetry Ingest Listener")
+    print(f"🔌 TCP NDJSON on {args.host}:{listener.tcp_port}")
+    if listener.udp_port is not None:
+        print(f"📨 UDP datagrams on {args.host}:{listener.udp_port} (lossy: dropped when the queue is full)")
+
+    # SIGTERM drains the queue like Ctrl+C does
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            time.sleep(1)
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        listener.close()
+        db.close()
+        stats = listener.stats()
+        received, rejected = stats['received'], stats['rejected']
+        print(f"\n📊 Received {received['tcp']} stat sheets over {stats['connections']} TCP connections "
+              f"and {received['udp']} over UDP")
+        print(f"❌ Rejected {rejected['tcp'] + rejected['udp']}, dropped {stats['dropped']} (UDP, queue full)")
+        print(f"💾 Committed {stats['queue']['written']} ({stats['queue']['duplicates']} already stored)")
+
+
+if __name__ == '__main__':
+    main()
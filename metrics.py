@@ -0,0 +1,230 @@
+"""
+Metrics for Loot Telemetry Simulator
+In-process counters, gauges and histograms rendered in Prometheus text format
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Latency buckets in seconds, and row-count buckets for rows scanned per request
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROW_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{str(value)}"' for key, value in labels)
+    return '{' + pairs + '}'
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    """Gauge whose value is read from a callback at scrape time"""
+
+    def __init__(self, name, help_text, callback):
+        self.name = name
+        self.help_text = help_text
+        self.callback = callback
+
+    def render(self):
+        try:
+            value = self.callback()
+        except Exception:
+            return []
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge",
+                f"{self.name} {_format_value(value)}"]
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def count(self, **labels):
+        series = self._series.get(tuple(sorted(labels.items())))
+        return series['count'] if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series['counts']):
+                    lines.append(f"{self.name}_bucket{_format_labels(key + (('le', _format_value(bound)),))} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {series['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series['sum']!r}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds every metric and renders them for /api/metrics"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text):
+        return self.register(Counter(name, help_text))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, buckets))
+
+    def gauge(self, name, help_text, callback):
+        return self.register(Gauge(name, help_text, callback))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+# HTTP layer
+HTTP_REQUESTS = REGISTRY.counter('loot_http_requests_total', 'HTTP requests by method, route and status')
+HTTP_ERRORS = REGISTRY.counter('loot_http_request_errors_total', 'HTTP requests answered with a 5xx status')
+HTTP_LATENCY = REGISTRY.histogram('loot_http_request_duration_seconds', 'HTTP request latency by route')
+HTTP_DB_TIME = REGISTRY.histogram('loot_http_request_db_seconds', 'Time spent in SQLite per request')
+HTTP_JSON_TIME = REGISTRY.histogram('loot_http_request_json_seconds', 'Time spent encoding JSON per request')
+HTTP_ROWS = REGISTRY.histogram('loot_http_request_rows_scanned', 'Database rows read per request', ROW_BUCKETS)
+INGEST_BYTES = REGISTRY.counter('loot_ingest_bytes_total', 'Ingest request body bytes on the wire by encoding')
+INGEST_DECODE = REGISTRY.histogram('loot_ingest_decode_seconds', 'Time to decompress and decode an ingest body by encoding')
+
+# Database layer
+DB_LATENCY = REGISTRY.histogram('loot_db_query_duration_seconds', 'DatabaseHandler call latency by operation')
+DB_ROWS = REGISTRY.counter('loot_db_rows_scanned_total', 'Database rows read by operation')
+DB_ERRORS = REGISTRY.counter('loot_db_errors_total', 'DatabaseHandler errors by operation')
+RETENTION_ARCHIVED = REGISTRY.counter('loot_retention_archived_total', 'Stat sheets moved to archive files')
+
+# Per-thread accounting for the request currently being served
+_request = threading.local()
+
+
+def begin_request():
+    """Start per-request accounting on the current thread"""
+    _request.start = time.perf_counter()
+    _request.db_seconds = 0.0
+    _request.json_seconds = 0.0
+    _request.rows = 0
+
+
+def end_request(method, route, status):
+    """Record the finished request's latency and its DB/JSON/rows breakdown"""
+    start = getattr(_request, 'start', None)
+    if start is None:
+        return
+    _request.start = None
+
+    HTTP_REQUESTS.inc(method=method, route=route, status=status)
+    if status >= 500:
+        HTTP_ERRORS.inc(route=route)
+    HTTP_LATENCY.observe(time.perf_counter() - start, route=route)
+    HTTP_DB_TIME.observe(_request.db_seconds, route=route)
+    HTTP_JSON_TIME.observe(_request.json_seconds, route=route)
+    HTTP_ROWS.observe(_request.rows, route=route)
+
+
+def _in_request():
+    return getattr(_request, 'start', None) is not None
+
+
+def record_rows(operation, rows):
+    """Count rows read by a database operation"""
+    DB_ROWS.inc(rows, operation=operation)
+    if _in_request():
+        _request.rows += rows
+
+
+def record_db_error(operation):
+    DB_ERRORS.inc(operation=operation)
+
+
+@contextmanager
+def db_timer(operation):
+    """Time a block of database work under the given operation name"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        DB_LATENCY.observe(elapsed, operation=operation)
+        if _in_request():
+            _request.db_seconds += elapsed
+
+
+def timed_query(operation):
+    """Decorator form of db_timer for DatabaseHandler methods"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with db_timer(operation):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def json_timer():
+    """Time JSON encoding for the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if _in_request():
+            _request.json_seconds += time.perf_counter() - start
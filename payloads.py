@@ -0,0 +1,318 @@
+"""
+Ingest payloads for Loot Telemetry Simulator
+Encoders and decoders shared by the server and the data generator: JSON (using
+orjson when installed), msgpack (optional) and a dependency-free struct-packed
+binary format, each optionally gzip-compressed; plus the stat sheet validation
+every ingest path applies
+"""
+
+import gzip
+import json
+import math
+import struct
+import zlib
+from datetime import datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Request encodings and their Content-Type headers
+JSON_CONTENT_TYPE = 'application/json'
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+MSGPACK_CONTENT_TYPE = 'application/msgpack'
+STRUCT_CONTENT_TYPE = 'application/x-loot-struct'
+CONTENT_TYPES = {
+    'json': JSON_CONTENT_TYPE,
+    'msgpack': MSGPACK_CONTENT_TYPE,
+    'struct': STRUCT_CONTENT_TYPE,
+}
+ENCODINGS = tuple(CONTENT_TYPES)
+ENCODING_NAMES = {
+    **{content_type: encoding for encoding, content_type in CONTENT_TYPES.items()},
+    NDJSON_CONTENT_TYPE: 'json',
+    'application/x-msgpack': 'msgpack',
+}
+
+# Refuse compressed bodies that inflate past this (guards against gzip bombs)
+MAX_DECOMPRESSED_BYTES = 64 * 1024 * 1024
+
+# Struct-packed stat sheets, all little-endian:
+#   payload := b'LSH1' uint32 sheet_count sheet*
+#   sheet   := str match_id, str player_id, str timestamp ('' = absent),
+#              int32 match_duration (-1 = absent), int16 player_level (-1 = absent),
+#              uint16 item_count item*
+#   item    := str name, uint32 count, uint8 has_location [float64 x, float64 y]
+#   str     := uint16 byte_length + UTF-8 bytes
+STRUCT_MAGIC = b'LSH1'
+_COUNT = struct.Struct('<I')
+_STR_LEN = struct.Struct('<H')
+_SHEET_TAIL = struct.Struct('<ihH')
+_ITEM = struct.Struct('<IB')
+_LOCATION = struct.Struct('<dd')
+
+# Largest values the struct format can carry. Validation applies them to every
+# encoding, so a sheet accepted in one encoding can be sent in any other
+MAX_MATCH_DURATION = 2 ** 31 - 1
+MAX_PLAYER_LEVEL = 2 ** 15 - 1
+MAX_ITEM_COUNT = 2 ** 32 - 1
+
+
+class PayloadError(ValueError):
+    """Request body that cannot be decoded with its declared encoding"""
+
+
+class UnsupportedEncoding(PayloadError):
+    """Request body in an encoding this process cannot decode"""
+
+
+def json_dumps(obj, sort_keys=False, indent=False, default=None):
+    """Encode obj as compact JSON bytes, with orjson when it is installed"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, default=default, option=option)
+        except TypeError:
+            pass  # e.g. integers too large for orjson; the stdlib handles them
+    separators = None if indent else (',', ':')
+    return json.dumps(obj, sort_keys=sort_keys, indent=2 if indent else None,
+                      separators=separators, default=default).encode('utf-8')
+
+
+def json_loads(data):
+    """Decode JSON from str or bytes, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _is_number(value):
+    """True for a finite int or float (bools are not numbers here)"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return False
+    return math.isfinite(value)
+
+
+def _is_integer_in(value, maximum):
+    """True for an int (not a bool) from 0 to maximum"""
+    return isinstance(value, int) and not isinstance(value, bool) and 0 <= value <= maximum
+
+
+def validate_stat_sheet(stat_sheet):
+    """Validate a stat sheet in place, returning an error message or None.
+    
+    Shared by every ingest path (HTTP submits and the TCP/UDP listener), so a
+    malformed sheet is turned away with a message instead of failing later in
+    the database; a missing timestamp is filled in with the time of receipt.
+    """
+    if not isinstance(stat_sheet, dict) or not stat_sheet:
+        return 'No JSON data provided'
+    required_fields = ['match_id', 'player_id', 'looted_items']
+    for field in required_fields:
+        if field not in stat_sheet:
+            return f'Missing required field: {field}'
+    for field in ('match_id', 'player_id', 'timestamp'):
+        if field in stat_sheet and not isinstance(stat_sheet[field], str):
+            return f'{field} must be a string'
+    
+    looted_items = stat_sheet['looted_items']
+    if not isinstance(looted_items, dict):
+        return 'looted_items must be an object of item counts'
+    for item, count in looted_items.items():
+        # msgpack bodies can carry non-string keys, which JSON cannot
+        if not isinstance(item, str):
+            return 'looted_items keys must be strings'
+        if not _is_integer_in(count, MAX_ITEM_COUNT):
+            return f'looted_items.{item} must be an integer from 0 to {MAX_ITEM_COUNT}'
+    
+    locations = stat_sheet.get('locations')
+    if locations is not None:
+        if not isinstance(locations, dict):
+            return 'locations must be an object of [x, y] positions'
+        for item, position in locations.items():
+            if not isinstance(item, str):
+                return 'locations keys must be strings'
+            if (not isinstance(position, (list, tuple)) or len(position) != 2
+                    or not all(_is_number(value) for value in position)):
+                return f'locations.{item} must be an [x, y] pair of numbers'
+    
+    for field, maximum in (('match_duration', MAX_MATCH_DURATION), ('player_level', MAX_PLAYER_LEVEL)):
+        value = stat_sheet.get(field)
+        if value is not None and not _is_integer_in(value, maximum):
+            return f'{field} must be an integer from 0 to {maximum}'
+    if 'timestamp' not in stat_sheet:
+        stat_sheet['timestamp'] = datetime.now().isoformat()
+    return None
+
+
+def _pack_str(parts, value):
+    encoded = value.encode('utf-8')
+    parts.append(_STR_LEN.pack(len(encoded)))
+    parts.append(encoded)
+
+
+def pack_stat_sheets(stat_sheets):
+    """Encode stat sheets in the struct-packed binary format"""
+    parts = [STRUCT_MAGIC, _COUNT.pack(len(stat_sheets))]
+    for sheet in stat_sheets:
+        _pack_str(parts, str(sheet['match_id']))
+        _pack_str(parts, str(sheet['player_id']))
+        _pack_str(parts, str(sheet.get('timestamp', '')))
+        locations = sheet.get('locations') or {}
+        looted_items = sheet['looted_items']
+        match_duration, player_level = sheet.get('match_duration'), sheet.get('player_level')
+        parts.append(_SHEET_TAIL.pack(-1 if match_duration is None else match_duration,
+                                      -1 if player_level is None else player_level,
+                                      len(looted_items)))
+        for item, count in looted_items.items():
+            _pack_str(parts, item)
+            location = locations.get(item)
+            parts.append(_ITEM.pack(count, location is not None))
+            if location is not None:
+                parts.append(_LOCATION.pack(*location))
+    return b''.join(parts)
+
+
+def unpack_stat_sheets(data):
+    """Decode a struct-packed payload into a list of stat sheet dicts"""
+    view = memoryview(data)
+    if bytes(view[:4]) != STRUCT_MAGIC:
+        raise PayloadError('Not a struct-packed stat sheet payload')
+    offset = 4
+
+    def read(fmt):
+        nonlocal offset
+        values = fmt.unpack_from(view, offset)
+        offset += fmt.size
+        return values
+
+    def read_str():
+        nonlocal offset
+        (length,) = read(_STR_LEN)
+        value = str(view[offset:offset + length], 'utf-8')
+        offset += length
+        return value
+
+    try:
+        (sheet_count,) = read(_COUNT)
+        stat_sheets = []
+        for _ in range(sheet_count):
+            sheet = {'match_id': read_str(), 'player_id': read_str()}
+            timestamp = read_str()
+            if timestamp:
+                sheet['timestamp'] = timestamp
+            match_duration, player_level, item_count = read(_SHEET_TAIL)
+            looted_items = {}
+            locations = {}
+            for _ in range(item_count):
+                item = read_str()
+                count, has_location = read(_ITEM)
+                looted_items[item] = count
+                if has_location:
+                    locations[item] = list(read(_LOCATION))
+            sheet['looted_items'] = looted_items
+            sheet['locations'] = locations
+            if match_duration >= 0:
+                sheet['match_duration'] = match_duration
+            if player_level >= 0:
+                sheet['player_level'] = player_level
+            stat_sheets.append(sheet)
+    except (struct.error, UnicodeDecodeError) as e:
+        raise PayloadError(f'Truncated or corrupt struct payload: {e}')
+
+    if offset != len(view):
+        raise PayloadError('Trailing bytes after struct payload')
+    return stat_sheets
+
+
+def encode(obj, encoding='json', compress=False):
+    """Encode a stat sheet (or list of sheets) for upload; returns (body, headers)"""
+    if encoding == 'json':
+        body = json_dumps(obj)
+    elif encoding == 'msgpack':
+        if msgpack is None:
+            raise RuntimeError("msgpack encoding requires the 'msgpack' package")
+        body = msgpack.packb(obj)
+    elif encoding == 'struct':
+        body = pack_stat_sheets(obj if isinstance(obj, list) else [obj])
+    else:
+        raise ValueError(f'Unknown encoding: {encoding}')
+
+    headers = {'Content-Type': CONTENT_TYPES[encoding]}
+    if compress:
+        body = gzip.compress(body, compresslevel=6)
+        headers['Content-Encoding'] = 'gzip'
+    return body, headers
+
+
+def decompress(body, content_encoding):
+    """Undo a Content-Encoding of identity or gzip, capped at MAX_DECOMPRESSED_BYTES"""
+    content_encoding = (content_encoding or 'identity').strip().lower()
+    if content_encoding == 'identity':
+        return body
+    if content_encoding not in ('gzip', 'x-gzip'):
+        raise UnsupportedEncoding(f'Unsupported Content-Encoding: {content_encoding}')
+
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)  # gzip header and trailer
+    try:
+        data = decompressor.decompress(body, MAX_DECOMPRESSED_BYTES)
+    except zlib.error as e:
+        raise PayloadError(f'Invalid gzip body: {e}')
+    if decompressor.unconsumed_tail:
+        raise PayloadError(f'Decompressed body exceeds {MAX_DECOMPRESSED_BYTES} bytes')
+    if not decompressor.eof:
+        raise PayloadError('Truncated gzip body')
+    return data
+
+
+def encoding_label(content_type, content_encoding):
+    """Short name for a body's encoding, e.g. 'struct+gzip', with a bounded set of values"""
+    mimetype = (content_type or JSON_CONTENT_TYPE).split(';')[0].strip().lower()
+    label = ENCODING_NAMES.get(mimetype, 'json')  # other types are parsed as JSON
+    content_encoding = (content_encoding or 'identity').strip().lower()
+    if content_encoding != 'identity':
+        label += '+gzip' if content_encoding in ('gzip', 'x-gzip') else '+other'
+    return label
+
+
+def decode(body, content_type, ndjson=False):
+    """Decode a request body by Content-Type into a stat sheet or a list of them.
+
+    JSON bodies are parsed as one document, or with ndjson=True (or an
+    application/x-ndjson Content-Type) as one document per line unless they
+    start with '['. msgpack and struct payloads decode to whatever was packed
+    (struct is always a list). Raises PayloadError when the body does not
+    parse.
+    """
+    mimetype = (content_type or JSON_CONTENT_TYPE).split(';')[0].strip().lower()
+    try:
+        if mimetype == STRUCT_CONTENT_TYPE:
+            return unpack_stat_sheets(body)
+        if mimetype in (MSGPACK_CONTENT_TYPE, 'application/x-msgpack'):
+            if msgpack is None:
+                raise UnsupportedEncoding("msgpack bodies need the 'msgpack' package on the server")
+            return msgpack.unpackb(body)
+
+        body = body.strip()
+        if not body:
+            return None
+        if (ndjson or mimetype == NDJSON_CONTENT_TYPE) and not body.startswith(b'['):
+            return [json_loads(line) for line in body.splitlines() if line.strip()]
+        return json_loads(body)
+    except PayloadError:
+        raise
+    except (ValueError, TypeError) as e:
+        raise PayloadError(str(e))
+    except Exception as e:
+        # msgpack raises its own exception types for malformed input
+        raise PayloadError(f'Invalid {mimetype} body: {e}')
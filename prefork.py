@@ -0,0 +1,252 @@
+"""
+Pre-fork server for Loot Telemetry Simulator
+The parent binds the listening socket once and forks worker processes that all
+accept on it, so requests spread across cores. Each worker builds its own app
+(and so its own SQLite connections) after the fork; the parent replaces
+workers that exit or stop heartbeating and restarts them gracefully on SIGHUP
+"""
+
+import os
+import select
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+# Seconds between the parent's checks on its workers
+WORKER_CHECK_INTERVAL = 1.0
+# A worker whose accept loop has not heartbeated for this long is killed and replaced
+WORKER_HEALTH_TIMEOUT = 30.0
+# Seconds a stopping worker gets to finish in-flight requests before SIGKILL
+GRACEFUL_TIMEOUT = 30.0
+# Idle keep-alive connections are closed after this many seconds, so a
+# stopping worker is never held open by a client that went quiet
+KEEPALIVE_TIMEOUT = 5.0
+LISTEN_BACKLOG = 1024
+
+
+class WorkerRequestHandler(WSGIRequestHandler):
+    """Request handler with a keep-alive timeout and no per-request access log"""
+
+    timeout = KEEPALIVE_TIMEOUT
+
+    def log_request(self, *args, **kwargs):
+        pass  # one stderr line per request costs more than the request itself
+
+
+class Worker:
+    """A forked worker process plus the temp file whose mtime is its heartbeat"""
+
+    def __init__(self, worker_id, pid, heartbeat):
+        self.worker_id = worker_id
+        self.pid = pid
+        self.heartbeat = heartbeat
+        self.stopping_since = None
+
+    def last_heartbeat(self):
+        return os.fstat(self.heartbeat.fileno()).st_mtime
+
+    def signal(self, signum):
+        try:
+            os.kill(self.pid, signum)
+        except ProcessLookupError:
+            pass  # already exited; reaped on the next check
+
+
+class PreforkServer:
+    """Serve app_factory(worker_id) apps from several processes sharing one listening socket.
+
+    Worker ids run from 0 to workers - 1 and a replacement worker reuses the
+    id it replaces, so a factory can give one-per-server duties (such as the
+    retention job) to worker 0. Signals to the parent: SIGTERM or SIGINT
+    stop every worker gracefully; SIGHUP starts a fresh set of workers and
+    then retires the old ones, without ever closing the socket.
+    """
+
+    def __init__(self, app_factory, host, port, workers, on_worker_exit=None,
+                 health_timeout=WORKER_HEALTH_TIMEOUT, graceful_timeout=GRACEFUL_TIMEOUT):
+        self.app_factory = app_factory
+        self.host = host
+        self.port = port
+        self.num_workers = workers
+        self.on_worker_exit = on_worker_exit  # called in the worker after its last request
+        self.health_timeout = health_timeout
+        self.graceful_timeout = graceful_timeout
+        self.workers = {}  # pid -> Worker
+        self.socket = None
+        self._signals = []
+
+    def bind(self):
+        """Open the shared listening socket (port 0 picks a free port)"""
+        family = socket.AF_INET6 if ':' in self.host else socket.AF_INET
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.listen(LISTEN_BACKLOG)
+        self.port = self.socket.getsockname()[1]
+
+    def run(self):
+        """Bind, fork the workers and supervise them until SIGTERM or SIGINT"""
+        if self.socket is None:
+            self.bind()
+
+        # Signal handlers only queue the signal; writing to the wakeup pipe
+        # interrupts the select() below so the loop reacts immediately
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_w, False)
+        signal.set_wakeup_fd(self._wakeup_w)
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(signum, self._on_signal)
+
+        try:
+            self._spawn_missing()
+            while True:
+                signals, self._signals = self._signals, []
+                if signal.SIGTERM in signals or signal.SIGINT in signals:
+                    break
+                if signal.SIGHUP in signals:
+                    self.reload()
+                self._reap()
+                self._check_health()
+                self._spawn_missing()
+                if select.select([self._wakeup_r], [], [], WORKER_CHECK_INTERVAL)[0]:
+                    os.read(self._wakeup_r, 4096)
+        finally:
+            self.stop()
+            signal.set_wakeup_fd(-1)
+            os.close(self._wakeup_r)
+            os.close(self._wakeup_w)
+            self.socket.close()
+
+    def _on_signal(self, signum, frame):
+        self._signals.append(signum)
+
+    def reload(self):
+        """Start a new set of workers, then ask the old ones to finish up and exit"""
+        old_workers = [worker for worker in self.workers.values() if worker.stopping_since is None]
+        now = time.time()
+        for worker in old_workers:
+            worker.stopping_since = now
+        print(f"🔄 Graceful restart: replacing {len(old_workers)} workers")
+        self._spawn_missing()
+        # Connections arriving while the new workers boot wait in the listen backlog
+        for worker in old_workers:
+            worker.signal(signal.SIGTERM)
+
+    def stop(self):
+        """Ask every worker to finish its in-flight requests and exit, killing stragglers"""
+        now = time.time()
+        for worker in self.workers.values():
+            if worker.stopping_since is None:
+                worker.stopping_since = now
+            worker.signal(signal.SIGTERM)
+
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.workers and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.05)
+        for worker in list(self.workers.values()):
+            print(f"⚠️  Worker {worker.worker_id} (pid {worker.pid}) did not stop in time; killing it")
+            worker.signal(signal.SIGKILL)
+            os.waitpid(worker.pid, 0)
+            self._forget(worker)
+
+    def _forget(self, worker):
+        self.workers.pop(worker.pid, None)
+        worker.heartbeat.close()
+
+    def _reap(self):
+        """Collect exited workers; ones that were not asked to stop are reported"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            worker = self.workers.get(pid)
+            if worker is None:
+                continue
+            self._forget(worker)
+            if worker.stopping_since is None:
+                print(f"⚠️  Worker {worker.worker_id} (pid {pid}) exited with code "
+                      f"{os.waitstatus_to_exitcode(status)}; restarting it")
+
+    def _check_health(self):
+        """Kill workers whose accept loop stopped heartbeating or that overran a graceful stop"""
+        now = time.time()
+        for worker in list(self.workers.values()):
+            if worker.stopping_since is not None:
+                if now - worker.stopping_since > self.graceful_timeout:
+                    worker.signal(signal.SIGKILL)
+            elif now - worker.last_heartbeat() > self.health_timeout:
+                print(f"⚠️  Worker {worker.worker_id} (pid {worker.pid}) stopped responding; replacing it")
+                worker.stopping_since = now
+                worker.signal(signal.SIGKILL)
+
+    def _spawn_missing(self):
+        active = {worker.worker_id for worker in self.workers.values() if worker.stopping_since is None}
+        for worker_id in range(self.num_workers):
+            if worker_id not in active:
+                self._spawn(worker_id)
+
+    def _spawn(self, worker_id):
+        heartbeat = tempfile.TemporaryFile(prefix='loot-worker-')
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = Worker(worker_id, pid, heartbeat)
+            return
+
+        # In the worker: never return into the parent's supervision loop
+        exit_code = 1
+        try:
+            self._serve(worker_id, heartbeat)
+            exit_code = 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(exit_code)
+
+    def _serve(self, worker_id, heartbeat):
+        """Worker main: build the app, then accept on the shared socket until SIGTERM"""
+        # Undo the parent's signal plumbing; SIGINT and SIGHUP are the parent's to act on
+        signal.set_wakeup_fd(-1)
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
+        for worker in self.workers.values():
+            worker.heartbeat.close()
+        self.workers = {}
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+        app = self.app_factory(worker_id)
+        server = make_server(self.host, self.port, app, threaded=True,
+                             request_handler=WorkerRequestHandler, fd=self.socket.fileno())
+        # werkzeug makes request threads daemons, which server_close() would not
+        # wait for; tracked threads let a stopping worker finish in-flight requests
+        server.daemon_threads = False
+        # serve_forever calls service_actions between polls, so the heartbeat
+        # only advances while the accept loop is actually running
+        server.service_actions = lambda: os.utime(heartbeat.fileno())
+        # shutdown() blocks until serve_forever returns, so it cannot run in the handler itself
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(
+            target=server.shutdown, daemon=True).start())
+
+        print(f"👷 Worker {worker_id} (pid {os.getpid()}) accepting requests")
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()  # joins the in-flight request threads
+            if self.on_worker_exit is not None:
+                self.on_worker_exit()
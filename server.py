@@ -3,19 +3,216 @@ Flask Server for Loot Telemetry Simulator
 REST API for receiving and serving loot data
 """
 
-from flask import Flask, request, jsonify, render_template_string
+from flask import Blueprint, Flask, Response, current_app, request, jsonify, render_template_string
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-import json
-from datetime import datetime
-from db_handler import DatabaseHandler
+from werkzeug.http import is_resource_modified
+import argparse
+import atexit
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+from itertools import islice
+import metrics
+import payloads
+import sketches
+from prefork import PreforkServer, GRACEFUL_TIMEOUT
+from db_handler import (
+    RetentionJob, WriteBehindQueue, open_database,
+    ARCHIVE_DIR, RETENTION_INTERVAL, INGEST_QUEUE_SIZE, INGEST_FLUSH_SIZE, INGEST_FLUSH_INTERVAL,
+    HEATMAP_BINS, HEATMAP_RANGE, STAT_SHEET_CHUNK, TIME_BUCKETS, TIMESERIES_MAX_POINTS,
+    LEADERBOARDS, LEADERBOARD_DEFAULT_K, LEADERBOARD_MAX_K, SKETCH_ALL_ITEMS, RANGE_FILTERS,
+    level_band_range, loot_per_minute
+)
 
-app = Flask(__name__)
-CORS(app)  # Enable CORS for web client access
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that uses orjson when installed and records encoding time"""
+    
+    def dumps(self, obj, **kwargs):
+        with metrics.json_timer():
+            if payloads.orjson is None:
+                return super().dumps(obj, **kwargs)
+            return payloads.json_dumps(
+                obj, sort_keys=kwargs.get('sort_keys', self.sort_keys),
+                indent=bool(kwargs.get('indent')), default=self.default
+            ).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return payloads.json_loads(s)
+
+# Routes live on a blueprint so create_app can build the app in each process
+api = Blueprint('api', __name__)
+
+# Per-process database handle, opened by create_app (after any fork, so
+# worker processes never share SQLite connections)
+db = None
+
+# Optional write-behind ingest queue (see enable_async_ingest)
+ingest_queue = None
+
+def enable_async_ingest(max_size=INGEST_QUEUE_SIZE, flush_size=INGEST_FLUSH_SIZE,
+                        flush_interval=INGEST_FLUSH_INTERVAL):
+    """Switch submits to the write-behind queue: 202 on enqueue, 429 when full"""
+    global ingest_queue
+    if ingest_queue is not None:
+        ingest_queue.close()
+    ingest_queue = WriteBehindQueue(db, max_size=max_size, flush_size=flush_size,
+                                    flush_interval=flush_interval)
+    return ingest_queue
+
+def ingest_queue_stat(name):
+    """Read one write-behind queue stat for a metrics gauge (0 in sync mode)"""
+    return ingest_queue.stats()[name] if ingest_queue is not None else 0
+
+# Optional background retention job (see enable_retention)
+retention_job = None
+
+def enable_retention(retention_days, archive_dir=ARCHIVE_DIR, interval=RETENTION_INTERVAL):
+    """Archive stat sheets older than retention_days in the background"""
+    global retention_job
+    if retention_job is not None:
+        retention_job.close()
+    retention_job = RetentionJob(db, retention_days, archive_dir=archive_dir, interval=interval)
+    return retention_job
+
+def shutdown():
+    """Drain the ingest queue, stop the retention job and close the database"""
+    global db, ingest_queue, retention_job
+    # The queue drains before the database closes underneath it
+    if ingest_queue is not None:
+        ingest_queue.close()
+        ingest_queue = None
+    if retention_job is not None:
+        retention_job.close()
+        retention_job = None
+    if db is not None:
+        db.close()
+        db = None
+
+atexit.register(shutdown)
+
+metrics.REGISTRY.gauge('loot_ingest_queue_depth', 'Stat sheets waiting in the write-behind queue',
+                       lambda: ingest_queue_stat('depth'))
+metrics.REGISTRY.gauge('loot_ingest_queue_pending', 'Stat sheets accepted but not yet committed',
+                       lambda: ingest_queue_stat('pending'))
+metrics.REGISTRY.gauge('loot_ingest_oldest_pending_seconds', 'Age of the oldest queued stat sheet',
+                       lambda: ingest_queue_stat('oldest_pending_ms') / 1000)
+metrics.REGISTRY.gauge('loot_db_connections_opened', 'SQLite connections opened by the pool',
+                       lambda: db.connections_opened if db is not None else 0)
+
+@api.before_app_request
+def start_request_metrics():
+    metrics.begin_request()
+
+@api.after_app_request
+def record_request_metrics(response):
+    # Label by route pattern, not raw path, so /api/heatmap/<item_name> is one series
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.end_request(request.method, route, response.status_code)
+    return response
+
+# Response cache defaults (see ResponseCache)
+RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+RESPONSE_CACHE_MAX_ENTRIES = 1024
+
+CACHE_LOOKUPS = metrics.REGISTRY.counter('loot_response_cache_lookups_total', 'Response cache lookups by result')
+
+class ResponseCache:
+    """LRU cache of encoded responses, valid for a single data generation"""
+    
+    def __init__(self, max_bytes=RESPONSE_CACHE_MAX_BYTES, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key, generation):
+        """Return the cached (body, mimetype) for key at this generation, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != generation:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1], entry[2]
+    
+    def put(self, key, generation, body, mimetype):
+        """Store a response body, evicting least recently used entries to fit"""
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self._entries[key] = (generation, body, mimetype)
+            self.size += len(body)
+            while self.size > self.max_bytes or len(self._entries) > self.max_entries:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+    
+    def __len__(self):
+        return len(self._entries)
+
+response_cache = ResponseCache()
+
+metrics.REGISTRY.gauge('loot_response_cache_bytes', 'Bytes held by the response cache',
+                       lambda: response_cache.size)
+
+def cached_response(view):
+    """Serve a read endpoint from the response cache with ETag/Last-Modified.
+    
+    Entries are keyed by path and query string and are only valid for the
+    data generation they were computed at; any insert or clear bumps the
+    generation. Clients revalidating with If-None-Match or If-Modified-Since
+    get 304 Not Modified while the data is unchanged.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        generation, modified_at = db.get_data_generation()
+        if generation is None or response_cache.max_bytes <= 0:
+            return view(*args, **kwargs)
+        
+        etag = f"gen-{generation}"
+        last_modified = datetime.fromtimestamp(int(modified_at), tz=timezone.utc)
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            CACHE_LOOKUPS.inc(result='not_modified')
+            response = Response(status=304)
+        else:
+            key = (request.path, tuple(sorted(request.args.items(multi=True))))
+            cached = response_cache.get(key, generation)
+            if cached is not None:
+                CACHE_LOOKUPS.inc(result='hit')
+                response = Response(cached[0], mimetype=cached[1])
+            else:
+                CACHE_LOOKUPS.inc(result='miss')
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                response_cache.put(key, generation, response.get_data(), response.mimetype)
+        
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.cache_control.no_cache = True  # Clients must revalidate, cheaply via 304
+        return response
+    return wrapper
 
-# Initialize database
-db = DatabaseHandler()
+def queue_full_response():
+    """429 response telling clients to back off while the ingest queue drains"""
+    response = jsonify({'error': 'Ingest queue is full, retry later'})
+    response.status_code = 429
+    response.headers['Retry-After'] = '1'
+    return response
 
-@app.route('/')
+@api.route('/')
 def home():
     """Simple home page with API documentation"""
     html = """
@@ -37,24 +234,83 @@ def home():
         
         <div class="endpoint">
             <span class="method">POST</span> <strong>/api/submit</strong><br>
-            Submit a stat sheet from a game client<br>
-            <em>Body: JSON stat sheet data</em>
+            Submit a stat sheet from a game client (idempotent per match_id + player_id)<br>
+            <em>Body: JSON, msgpack or x-loot-struct stat sheet (optionally Content-Encoding: gzip)</em>
+        </div>
+        
+        <div class="endpoint">
+            <span class="method">POST</span> <strong>/api/submit/batch</strong><br>
+            Submit many stat sheets in one request (stored in a single transaction)<br>
+            <em>Body: JSON array, NDJSON, msgpack or x-loot-struct stat sheets (max 1000, optionally gzip)</em>
         </div>
         
         <div class="endpoint">
             <span class="method">GET</span> <strong>/api/stats</strong><br>
-            Get all stat sheets (with optional filtering)<br>
-            <em>Query params: match_id, player_id, limit</em>
+            Get stat sheets newest first (with optional filtering), paged by cursor<br>
+            <em>Query params: match_id, player_id, item, start, end, min_level, max_level, min_duration, max_duration, min_loot_rate, max_loot_rate, limit, cursor (pass back next_cursor), format=ndjson (streamed export)</em>
         </div>
         
         <div class="endpoint">
             <span class="method">GET</span> <strong>/api/aggregate</strong><br>
-            Get aggregated statistics across all matches
+            Get aggregated statistics across all matches, with loot per level band<br>
+            <em>Query params: approx=true (HyperLogLog distinct counts), min_level, max_level, min_duration, max_duration, min_loot_rate, max_loot_rate (exact, from the stat sheets), start, end (ISO-8601; with approx or a range filter)</em>
+        </div>
+        
+        <div class="endpoint">
+            <span class="method">GET</span> <strong>/api/quantiles</strong><br>
+            Quantiles of items looted per stat sheet (from KLL sketches)<br>
+            <em>Query params: item, q (e.g. 0.5,0.9,0.99), start, end (ISO-8601, whole days)</em>
+        </div>
+        
+        <div class="endpoint">
+            <span class="method">GET</span> <strong>/api/timeseries</strong><br>
+            Items looted per minute, hour or day (from time-bucketed rollups)<br>
+            <em>Query params: item, start, end (ISO-8601), bucket=minute|hour|day</em>
+        </div>
+        
+        <div class="endpoint">
+            <span class="method">GET</span> <strong>/api/leaderboard/players</strong> and <strong>/api/leaderboard/matches</strong><br>
+            Top k players or matches by items looted (from pre-aggregated totals)<br>
+            <em>Query params: item, k (default 10, max 1000), start, end (ISO-8601; windows sum retained raw stat sheets)</em>
         </div>
         
         <div class="endpoint">
             <span class="method">GET</span> <strong>/api/heatmap/{item_name}</strong><br>
-            Get location data for heatmap visualization
+            Get raw location data for heatmap visualization (paginated)<br>
+            <em>Query params: limit, cursor (pass back next_cursor)</em>
+        </div>
+        
+        <div class="endpoint">
+            <span class="method">GET</span> <strong>/api/heatmap/{item_name}/grid</strong><br>
+            Get a binned heatmap computed on the server<br>
+            <em>Query params: bins, xmin, xmax, ymin, ymax</em>
+        </div>
+        
+        <div class="endpoint">
+            <span class="method">GET</span> <strong>/api/dashboard</strong><br>
+            Aggregates, summary metrics, level bands and a binned heatmap for every item in one response<br>
+            <em>Query params: bins (default 20, max 100)</em>
+        </div>
+        
+        <div class="endpoint">
+            <span class="method">GET</span> <strong>/api/locations</strong><br>
+            Get looted-item locations inside a map region (paginated)<br>
+            <em>Query params: bbox=x0,y0,x1,y1 (required), item, limit, cursor (pass back next_cursor)</em>
+        </div>
+        
+        <div class="endpoint">
+            <span class="method">GET</span> <strong>/api/ingest/status</strong><br>
+            Ingest mode plus write-behind queue depth and commit lag
+        </div>
+        
+        <div class="endpoint">
+            <span class="method">GET</span> <strong>/api/retention/status</strong><br>
+            Raw-data retention window, archived sheet counts and last compaction run
+        </div>
+        
+        <div class="endpoint">
+            <span class="method">GET</span> <strong>/api/metrics</strong><br>
+            Prometheus metrics: request counts, per-route latency, SQLite vs JSON time, rows scanned, queue depth
         </div>
         
         <div class="endpoint">
@@ -68,77 +324,318 @@ def home():
     """
     return render_template_string(html)
 
-@app.route('/api/health')
+@api.route('/api/health')
 def health_check():
     """Health check endpoint"""
     return jsonify({
         'status': 'healthy',
+        'pid': os.getpid(),  # tells pre-fork workers apart
         'timestamp': datetime.now().isoformat(),
         'message': 'Loot Telemetry Server is running'
     })
 
-@app.route('/api/submit', methods=['POST'])
+# Maximum number of stat sheets accepted by a single batch request
+MAX_BATCH_SIZE = 1000
+
+def read_payload(ndjson=False):
+    """Decompress and decode the request body according to its Content-Encoding and Content-Type.
+    
+    Raises payloads.PayloadError for bodies that cannot be decoded; wire
+    size and decode time are recorded per encoding.
+    """
+    body = request.get_data()
+    content_type = request.headers.get('Content-Type', payloads.JSON_CONTENT_TYPE)
+    content_encoding = request.headers.get('Content-Encoding', 'identity')
+    encoding = payloads.encoding_label(content_type, content_encoding)
+    
+    metrics.INGEST_BYTES.inc(len(body), encoding=encoding)
+    start = time.perf_counter()
+    try:
+        return payloads.decode(payloads.decompress(body, content_encoding), content_type, ndjson=ndjson)
+    finally:
+        metrics.INGEST_DECODE.observe(time.perf_counter() - start, encoding=encoding)
+
+def payload_error_response(error):
+    """400 for a malformed body, 415 for an encoding the server cannot read"""
+    status = 415 if isinstance(error, payloads.UnsupportedEncoding) else 400
+    return jsonify({'error': f'Invalid request body: {str(error)}'}), status
+
+def parse_batch_body():
+    """Parse a batch request body as a JSON array, NDJSON (one sheet per line), msgpack or struct payload"""
+    return read_payload(ndjson=True)
+
+@api.route('/api/submit', methods=['POST'])
 def submit_stat_sheet():
     """Receive and store a stat sheet from game client"""
     try:
-        # Get JSON data from request
-        stat_sheet = request.get_json()
-        
-        if not stat_sheet:
-            return jsonify({'error': 'No JSON data provided'}), 400
+        # Decode the body (JSON, msgpack or struct, optionally gzip-compressed)
+        try:
+            stat_sheet = read_payload()
+        except payloads.PayloadError as e:
+            return payload_error_response(e)
+        if isinstance(stat_sheet, list):
+            if len(stat_sheet) != 1:
+                return jsonify({'error': 'Expected one stat sheet; use /api/submit/batch for several'}), 400
+            stat_sheet = stat_sheet[0]
         
-        # Validate required fields
-        required_fields = ['match_id', 'player_id', 'looted_items']
-        for field in required_fields:
-            if field not in stat_sheet:
-                return jsonify({'error': f'Missing required field: {field}'}), 400
+        error = payloads.validate_stat_sheet(stat_sheet)
+        if error:
+            return jsonify({'error': error}), 400
         
-        # Add timestamp if not provided
-        if 'timestamp' not in stat_sheet:
-            stat_sheet['timestamp'] = datetime.now().isoformat()
+        # Asynchronous mode: acknowledge once queued, the writer commits later
+        if ingest_queue is not None:
+            if not ingest_queue.submit(stat_sheet):
+                return queue_full_response()
+            return jsonify({
+                'success': True,
+                'message': 'Stat sheet queued for storage',
+                'queued': True,
+                'timestamp': datetime.now().isoformat()
+            }), 202
         
-        # Insert into database
-        sheet_id = db.insert_stat_sheet(stat_sheet)
+        # Insert into database (a resubmitted match/player sheet is not stored twice)
+        results = db.insert_stat_sheets([stat_sheet], report_duplicates=True)
         
-        if sheet_id:
+        if results:
+            sheet_id, duplicate = results[0]
             return jsonify({
                 'success': True,
-                'message': 'Stat sheet received successfully',
+                'message': 'Stat sheet already stored' if duplicate else 'Stat sheet received successfully',
                 'id': sheet_id,
+                'duplicate': duplicate,
                 'timestamp': datetime.now().isoformat()
-            }), 201
+            }), 200 if duplicate else 201
         else:
             return jsonify({'error': 'Failed to store stat sheet'}), 500
             
     except Exception as e:
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
-@app.route('/api/stats')
+@api.route('/api/submit/batch', methods=['POST'])
+def submit_stat_sheet_batch():
+    """Receive many stat sheets and store the valid ones in a single transaction"""
+    try:
+        try:
+            stat_sheets = parse_batch_body()
+        except payloads.PayloadError as e:
+            return payload_error_response(e)
+        
+        if not stat_sheets or not isinstance(stat_sheets, list):
+            return jsonify({'error': 'Expected a JSON array or NDJSON body of stat sheets'}), 400
+        
+        if len(stat_sheets) > MAX_BATCH_SIZE:
+            return jsonify({'error': f'Batch too large: {len(stat_sheets)} sheets (max {MAX_BATCH_SIZE})'}), 413
+        
+        # Validate each sheet, keeping per-item results in request order
+        results = []
+        valid_sheets = []
+        for index, stat_sheet in enumerate(stat_sheets):
+            error = payloads.validate_stat_sheet(stat_sheet)
+            if error:
+                results.append({'index': index, 'success': False, 'error': error})
+            else:
+                results.append({'index': index, 'success': True})
+                valid_sheets.append(stat_sheet)
+        
+        if not valid_sheets:
+            return jsonify({'success': False, 'accepted': 0, 'rejected': len(results), 'results': results}), 400
+        
+        # Asynchronous mode: queue each sheet, reporting the ones that did not fit
+        if ingest_queue is not None:
+            accepted = 0
+            for result in results:
+                if not result['success']:
+                    continue
+                if ingest_queue.submit(stat_sheets[result['index']]):
+                    result['queued'] = True
+                    accepted += 1
+                else:
+                    result.update(success=False, error='Ingest queue is full', retryable=True)
+            
+            if not accepted:
+                return queue_full_response()
+            
+            return jsonify({
+                'success': True,
+                'message': 'Stat sheet batch queued for storage',
+                'accepted': accepted,
+                'rejected': len(results) - accepted,
+                'results': results,
+                'timestamp': datetime.now().isoformat()
+            }), 202
+        
+        # Insert all valid sheets with one transaction
+        stored = db.insert_stat_sheets(valid_sheets, report_duplicates=True)
+        if stored is None:
+            return jsonify({'error': 'Failed to store stat sheet batch'}), 500
+        
+        stored = iter(stored)
+        duplicates = 0
+        for result in results:
+            if result['success']:
+                result['id'], result['duplicate'] = next(stored)
+                duplicates += result['duplicate']
+        
+        return jsonify({
+            'success': True,
+            'message': 'Stat sheet batch received successfully',
+            'accepted': len(valid_sheets),
+            'duplicates': duplicates,
+            'rejected': len(results) - len(valid_sheets),
+            'results': results,
+            'timestamp': datetime.now().isoformat()
+        }), 201
+        
+    except Exception as e:
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+# /api/stats page sizes (full exports should use format=ndjson instead)
+STATS_PAGE_SIZE = 1000
+MAX_STATS_PAGE_SIZE = 10000
+
+def time_range_args():
+    """Parse the start/end query params as ISO-8601 timestamps (ValueError if malformed).
+    
+    Stat sheet timestamps are stored as naive UTC, so a bound with a UTC
+    offset is converted to UTC first; a naive bound is taken as UTC already.
+    """
+    bounds = []
+    for name in ('start', 'end'):
+        value = request.args.get(name)
+        if value:
+            try:
+                bound = datetime.fromisoformat(value)
+            except ValueError:
+                raise ValueError(f'{name} must be an ISO-8601 timestamp')
+            if bound.tzinfo is not None:
+                bound = bound.astimezone(timezone.utc).replace(tzinfo=None)
+            value = bound.isoformat()
+        bounds.append(value or None)
+    return bounds
+
+def range_filter_args():
+    """Parse the RANGE_FILTERS query params (min_level, max_duration, ...) into typed bounds (ValueError if malformed)"""
+    ranges = {}
+    for name, (_, _, value_type) in RANGE_FILTERS.items():
+        value = request.args.get(name)
+        if value:
+            try:
+                value = value_type(value)
+            except ValueError:
+                value = None
+            if value is None or not math.isfinite(value):
+                raise ValueError(f'{name} must be {"an integer" if value_type is int else "a number"}')
+            ranges[name] = value
+    return ranges
+
+def level_band_entries(bands):
+    """JSON entries for level band rows, deriving loot per minute from their sums"""
+    entries = []
+    for band, stat_sheets, total, timed_total, duration_seconds in bands:
+        min_level, max_level = level_band_range(band)
+        entries.append({
+            'min_level': min_level,
+            'max_level': max_level,
+            'stat_sheets': stat_sheets,
+            'total': total,
+            'loot_per_minute': loot_per_minute(timed_total, duration_seconds)
+        })
+    return entries
+
+def wants_ndjson():
+    """True if the client asked for a streamed NDJSON response"""
+    if request.args.get('format') == 'ndjson':
+        return True
+    return request.accept_mimetypes.best == 'application/x-ndjson'
+
+def ndjson_stream(records, lines_per_chunk=STAT_SHEET_CHUNK):
+    """Encode records as NDJSON, yielding a few hundred lines per write"""
+    lines = []
+    for record in records:
+        with metrics.json_timer():
+            lines.append(payloads.json_dumps(record).decode('utf-8'))
+        if len(lines) >= lines_per_chunk:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+@api.route('/api/stats')
 def get_stats():
-    """Retrieve stat sheets with optional filtering"""
+    """Retrieve stat sheets with optional filtering, paged by cursor or streamed as NDJSON"""
     try:
         # Get query parameters
         match_id = request.args.get('match_id')
         player_id = request.args.get('player_id')
+        item = request.args.get('item')
         limit = request.args.get('limit', type=int)
+        cursor = request.args.get('cursor', type=int)
+        try:
+            start, end = time_range_args()
+            ranges = range_filter_args()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Streaming export: rows are read and encoded chunk by chunk
+        if wants_ndjson():
+            # Exports have no page size cap, but the same lower bound as pages
+            if limit is not None and limit < 1:
+                return jsonify({'error': 'limit must be at least 1'}), 400
+            stat_sheets = db.iter_stat_sheets(match_id=match_id, player_id=player_id,
+                                              item=item, cursor=cursor, start=start, end=end,
+                                              ranges=ranges)
+            return Response(ndjson_stream(islice(stat_sheets, limit)), mimetype='application/x-ndjson')
+        
+        if limit is None:
+            limit = STATS_PAGE_SIZE
+        if not 1 <= limit <= MAX_STATS_PAGE_SIZE:
+            return jsonify({'error': f'limit must be between 1 and {MAX_STATS_PAGE_SIZE}'}), 400
         
         # Retrieve from database
-        stat_sheets = db.get_stat_sheets(match_id=match_id, player_id=player_id, limit=limit)
+        stat_sheets, next_cursor = db.get_stat_sheets_page(match_id=match_id, player_id=player_id,
+                                                          item=item, cursor=cursor, limit=limit,
+                                                          start=start, end=end, ranges=ranges)
         
         return jsonify({
             'success': True,
             'count': len(stat_sheets),
-            'data': stat_sheets
+            'data': stat_sheets,
+            'next_cursor': next_cursor
         })
         
     except Exception as e:
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
-@app.route('/api/aggregate')
+@api.route('/api/aggregate')
+@cached_response
 def get_aggregate_stats():
     """Get aggregated statistics across all matches"""
     try:
-        stats = db.get_aggregate_stats()
+        approx = request.args.get('approx', '').lower() in ('1', 'true', 'yes')
+        try:
+            start, end = time_range_args()
+            ranges = range_filter_args()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if approx and ranges:
+            return jsonify({'error': 'Range filters cannot be combined with approx=true'}), 400
+        if (start or end) and not (approx or ranges):
+            return jsonify({'error': 'start/end require approx=true or a range filter'}), 400
+        
+        if approx:
+            stats = db.get_aggregate_stats(approx=True, start=start, end=end)
+            if stats:
+                stats['approximate'] = True
+                stats['distinct_relative_error'] = sketches.HyperLogLog().relative_error
+                stats['start'] = start
+                stats['end'] = end
+        else:
+            stats = db.get_aggregate_stats(start=start, end=end, ranges=ranges)
+            bands = db.get_level_bands(ranges=ranges, start=start, end=end)
+            if stats and bands is not None:
+                stats['level_bands'] = level_band_entries(bands)
+            if stats and ranges:
+                stats['filters'] = {**ranges, 'start': start, 'end': end}
         
         return jsonify({
             'success': True,
@@ -148,17 +645,154 @@ def get_aggregate_stats():
     except Exception as e:
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
-@app.route('/api/heatmap/<item_name>')
+@api.route('/api/timeseries')
+@cached_response
+def get_timeseries():
+    """Items looted per minute/hour/day, answered from the time rollups"""
+    try:
+        item = request.args.get('item')
+        bucket = request.args.get('bucket', 'hour')
+        if bucket not in TIME_BUCKETS:
+            return jsonify({'error': f'bucket must be one of: {", ".join(TIME_BUCKETS)}'}), 400
+        try:
+            start, end = time_range_args()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # One extra point tells us whether the range was truncated
+        points = db.get_timeseries(item=item, start=start, end=end, bucket=bucket,
+                                   limit=TIMESERIES_MAX_POINTS + 1)
+        if points is None:
+            return jsonify({'error': 'Failed to compute timeseries'}), 500
+        
+        truncated = len(points) > TIMESERIES_MAX_POINTS
+        points = points[:TIMESERIES_MAX_POINTS]
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'item': item,
+                'bucket': bucket,
+                'start': start,
+                'end': end,
+                'points': [{'bucket_start': bucket_start, 'total': total} for bucket_start, total in points],
+                'total': sum(total for _, total in points),
+                'truncated': truncated
+            }
+        })
+        
+    except Exception as e:
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+MAX_QUANTILES = 100
+
+@api.route('/api/quantiles')
+@cached_response
+def get_quantiles():
+    """Quantiles of per-stat-sheet item counts, answered from the merged KLL sketches"""
+    try:
+        item = request.args.get('item')
+        try:
+            fractions = [float(value) for value in request.args['q'].split(',')] \
+                if request.args.get('q') else list(DEFAULT_QUANTILES)
+        except ValueError:
+            return jsonify({'error': 'q must be a comma-separated list of numbers'}), 400
+        if not fractions or len(fractions) > MAX_QUANTILES or not all(0 <= q <= 1 for q in fractions):
+            return jsonify({'error': f'q must list 1 to {MAX_QUANTILES} fractions between 0 and 1'}), 400
+        try:
+            start, end = time_range_args()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        sketch = db.get_quantile_sketch(item=item, start=start, end=end)
+        if sketch is None:
+            return jsonify({'error': 'Failed to read quantile sketch'}), 500
+        
+        minimum, maximum = sketch.min_max()
+        return jsonify({
+            'success': True,
+            'data': {
+                'item': item or SKETCH_ALL_ITEMS,
+                'start': start,
+                'end': end,
+                'stat_sheets': sketch.n,
+                'quantiles': [{'q': q, 'value': value}
+                              for q, value in zip(fractions, sketch.quantiles(fractions))],
+                'min': minimum,
+                'max': maximum,
+                'rank_error': sketch.rank_error
+            }
+        })
+        
+    except Exception as e:
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+@api.route('/api/leaderboard/<board>')
+@cached_response
+def get_leaderboard(board):
+    """Top k players or matches by items looted, answered from the leaderboard totals"""
+    try:
+        if board not in LEADERBOARDS:
+            return jsonify({'error': f'Unknown leaderboard: {board} (expected one of: {", ".join(LEADERBOARDS)})'}), 404
+        
+        item = request.args.get('item')
+        try:
+            k = int(request.args.get('k', LEADERBOARD_DEFAULT_K))
+        except ValueError:
+            return jsonify({'error': 'k must be an integer'}), 400
+        if not 1 <= k <= LEADERBOARD_MAX_K:
+            return jsonify({'error': f'k must be between 1 and {LEADERBOARD_MAX_K}'}), 400
+        try:
+            start, end = time_range_args()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        entries = db.get_leaderboard(board, item=item, k=k, start=start, end=end)
+        if entries is None:
+            return jsonify({'error': 'Failed to compute leaderboard'}), 500
+        
+        _, owner = LEADERBOARDS[board]
+        return jsonify({
+            'success': True,
+            'data': {
+                'board': board,
+                'item': item,
+                'k': k,
+                'start': start,
+                'end': end,
+                'entries': [{'rank': rank, owner: owner_id, 'total': total}
+                            for rank, (owner_id, total) in enumerate(entries, start=1)]
+            }
+        })
+        
+    except Exception as e:
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+# Raw heatmap points are paged by sheet_items row (each row may expand to several points)
+HEATMAP_PAGE_SIZE = 10000
+MAX_HEATMAP_PAGE_SIZE = 100000
+MAX_HEATMAP_BINS = 500
+
+@api.route('/api/heatmap/<item_name>')
+@cached_response
 def get_heatmap_data(item_name):
-    """Get location data for heatmap visualization"""
+    """Get one page of raw location data for heatmap visualization"""
     try:
-        locations = db.get_heatmap_data(item_name)
+        limit = request.args.get('limit', HEATMAP_PAGE_SIZE, type=int)
+        cursor = request.args.get('cursor', type=int)
+        
+        if not 1 <= limit <= MAX_HEATMAP_PAGE_SIZE:
+            return jsonify({'error': f'limit must be between 1 and {MAX_HEATMAP_PAGE_SIZE}'}), 400
+        
+        locations, next_cursor = db.get_heatmap_page(item_name, limit=limit, cursor=cursor)
         
         # Convert to format suitable for frontend
         heatmap_data = {
             'item_name': item_name,
             'locations': locations,
-            'count': len(locations)
+            'count': len(locations),
+            'next_cursor': next_cursor
         }
         
         return jsonify({
@@ -169,11 +803,165 @@ def get_heatmap_data(item_name):
     except Exception as e:
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
-@app.route('/api/clear', methods=['POST'])
+@api.route('/api/heatmap/<item_name>/grid')
+@cached_response
+def get_heatmap_grid(item_name):
+    """Get a server-side binned heatmap (2D histogram) for an item"""
+    try:
+        bins = request.args.get('bins', HEATMAP_BINS, type=int)
+        (default_xmin, default_xmax), (default_ymin, default_ymax) = HEATMAP_RANGE
+        xmin = request.args.get('xmin', default_xmin, type=float)
+        xmax = request.args.get('xmax', default_xmax, type=float)
+        ymin = request.args.get('ymin', default_ymin, type=float)
+        ymax = request.args.get('ymax', default_ymax, type=float)
+        
+        if not 1 <= bins <= MAX_HEATMAP_BINS:
+            return jsonify({'error': f'bins must be between 1 and {MAX_HEATMAP_BINS}'}), 400
+        if xmin >= xmax or ymin >= ymax:
+            return jsonify({'error': 'Expected xmin < xmax and ymin < ymax'}), 400
+        
+        grid = db.get_heatmap_grid(item_name, bins=bins, value_range=((xmin, xmax), (ymin, ymax)))
+        if grid is None:
+            return jsonify({'error': 'Failed to compute heatmap grid'}), 500
+        
+        return jsonify({
+            'success': True,
+            'data': grid
+        })
+        
+    except Exception as e:
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+# The dashboard carries a grid per item, so it allows fewer bins than a single grid
+MAX_DASHBOARD_BINS = 100
+
+def dashboard_summary(stats, sketch):
+    """Headline metrics derived from the aggregate stats and the items-per-sheet sketch"""
+    total_items = stats['total_items']
+    total_looted = sum(total_items.values())
+    
+    def ratio(numerator, denominator):
+        return numerator / denominator if denominator else 0.0
+    
+    return {
+        'total_looted': total_looted,
+        'distinct_items': len(total_items),
+        'top_item': max(total_items, key=total_items.get) if total_items else None,
+        'items_per_stat_sheet': ratio(total_looted, stats['total_stat_sheets']),
+        'items_per_player': ratio(total_looted, stats['total_players']),
+        'items_per_match': ratio(total_looted, stats['total_matches']),
+        'players_per_match': ratio(stats['total_players'], stats['total_matches']),
+        'items_per_stat_sheet_quantiles': [{'q': q, 'value': value} for q, value in
+                                           zip(DEFAULT_QUANTILES, sketch.quantiles(DEFAULT_QUANTILES))]
+    }
+
+@api.route('/api/dashboard')
+@cached_response
+def get_dashboard():
+    """Everything the analysis dashboard draws, in one response: aggregates,
+    summary metrics, level bands and a binned heatmap for every item"""
+    try:
+        bins = request.args.get('bins', HEATMAP_BINS, type=int)
+        if not 1 <= bins <= MAX_DASHBOARD_BINS:
+            return jsonify({'error': f'bins must be between 1 and {MAX_DASHBOARD_BINS}'}), 400
+        
+        stats = db.get_aggregate_stats()
+        bands = db.get_level_bands()
+        sketch = db.get_quantile_sketch()
+        heatmaps = db.get_heatmap_grids(bins=bins)
+        if not stats or bands is None or sketch is None or heatmaps is None:
+            return jsonify({'error': 'Failed to compute dashboard'}), 500
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'aggregate': stats,
+                'summary': dashboard_summary(stats, sketch),
+                'level_bands': level_band_entries(bands),
+                'heatmaps': heatmaps
+            }
+        })
+        
+    except Exception as e:
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+# Bounding-box location queries are paged like the raw heatmap points
+LOCATIONS_PAGE_SIZE = 10000
+MAX_LOCATIONS_PAGE_SIZE = 100000
+
+@api.route('/api/locations')
+@cached_response
+def get_locations():
+    """Get looted-item locations inside a bounding box (read via the spatial grid index)"""
+    try:
+        item = request.args.get('item')
+        limit = request.args.get('limit', LOCATIONS_PAGE_SIZE, type=int)
+        cursor = request.args.get('cursor', type=int)
+        
+        try:
+            bbox = [float(value) for value in request.args.get('bbox', '').split(',')]
+        except ValueError:
+            bbox = []
+        if len(bbox) != 4:
+            return jsonify({'error': 'bbox must be x0,y0,x1,y1'}), 400
+        if bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+            return jsonify({'error': 'Expected x0 <= x1 and y0 <= y1'}), 400
+        if not 1 <= limit <= MAX_LOCATIONS_PAGE_SIZE:
+            return jsonify({'error': f'limit must be between 1 and {MAX_LOCATIONS_PAGE_SIZE}'}), 400
+        
+        locations, next_cursor = db.get_locations(bbox, item=item, limit=limit, cursor=cursor)
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'item': item,
+                'bbox': bbox,
+                'locations': locations,
+                'count': len(locations),
+                'total': sum(location['count'] for location in locations),
+                'next_cursor': next_cursor
+            }
+        })
+        
+    except Exception as e:
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+@api.route('/api/ingest/status')
+def get_ingest_status():
+    """Report write-behind queue depth, lag and throughput counters"""
+    if ingest_queue is None:
+        return jsonify({'success': True, 'data': {'mode': 'sync'}})
+    
+    return jsonify({
+        'success': True,
+        'data': {'mode': 'async', **ingest_queue.stats()}
+    })
+
+@api.route('/api/retention/status')
+def get_retention_status():
+    """Report the retention window and background compaction counters"""
+    if retention_job is None:
+        return jsonify({'success': True, 'data': {'enabled': False}})
+    
+    return jsonify({
+        'success': True,
+        'data': {'enabled': True, **retention_job.stats()}
+    })
+
+@api.route('/api/metrics')
+def get_metrics():
+    """Expose request, database and ingest metrics in Prometheus text format"""
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@api.route('/api/clear', methods=['POST'])
 def clear_database():
     """Clear all data (useful for testing)"""
     try:
+        # Let queued sheets land first so they are not written after the clear
+        if ingest_queue is not None:
+            ingest_queue.flush()
         db.clear_database()
+        response_cache.clear()
         return jsonify({
             'success': True,
             'message': 'Database cleared successfully'
@@ -182,27 +970,124 @@ def clear_database():
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
 # Error handlers
-@app.errorhandler(404)
+@api.app_errorhandler(404)
 def not_found(error):
     return jsonify({'error': 'Endpoint not found'}), 404
 
-@app.errorhandler(405)
+@api.app_errorhandler(405)
 def method_not_allowed(error):
     return jsonify({'error': 'Method not allowed'}), 405
 
-@app.errorhandler(500)
+@api.app_errorhandler(500)
 def internal_error(error):
     return jsonify({'error': 'Internal server error'}), 500
 
+def default_config():
+    """create_app settings; LOOT_DB_PATH and LOOT_DB_SHARDS in the environment
+    pick the database (benchmark.py points them at scratch files)"""
+    return {
+        'DB_PATH': os.environ.get('LOOT_DB_PATH', 'loot_telemetry.db'),
+        'DB_SHARDS': int(os.environ.get('LOOT_DB_SHARDS', 1)),
+        'ASYNC_INGEST': False,
+        'QUEUE_SIZE': INGEST_QUEUE_SIZE,
+        'FLUSH_SIZE': INGEST_FLUSH_SIZE,
+        'FLUSH_INTERVAL': INGEST_FLUSH_INTERVAL,
+        'CACHE_BYTES': RESPONSE_CACHE_MAX_BYTES,
+        'RETENTION_DAYS': None,
+        'ARCHIVE_DIR': ARCHIVE_DIR,
+        'RETENTION_INTERVAL': RETENTION_INTERVAL,
+    }
+
+def create_app(config=None):
+    """Build the Flask app and open this process's database handle.
+    
+    config overrides default_config(). The database handle, ingest queue
+    and retention job belong to the calling process, so pre-fork workers
+    each call this after forking; calling it again replaces them.
+    """
+    global db
+    config = {**default_config(), **(config or {})}
+    
+    app = Flask(__name__)
+    app.json = TimedJSONProvider(app)
+    app.config.update(config)
+    CORS(app)  # Enable CORS for web client access
+    app.register_blueprint(api)
+    
+    shutdown()
+    db = open_database(config['DB_PATH'], config['DB_SHARDS'])
+    response_cache.max_bytes = config['CACHE_BYTES']
+    response_cache.clear()
+    if config['ASYNC_INGEST']:
+        enable_async_ingest(config['QUEUE_SIZE'], config['FLUSH_SIZE'], config['FLUSH_INTERVAL'])
+    if config['RETENTION_DAYS'] is not None:
+        enable_retention(config['RETENTION_DAYS'], config['ARCHIVE_DIR'], config['RETENTION_INTERVAL'])
+    return app
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the Loot Telemetry Simulator server')
+    parser.add_argument('--host', default='0.0.0.0', help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=5000, help='Port to listen on')
+    parser.add_argument('--no-debug', action='store_true', help='Disable debug mode and the auto-reloader')
+    parser.add_argument('--workers', type=int, default=None, help='Production mode: fork this many worker processes sharing the port (no debug mode)')
+    parser.add_argument('--graceful-timeout', type=float, default=GRACEFUL_TIMEOUT, help='Seconds a stopping worker gets to finish its requests')
+    parser.add_argument('--async-ingest', action='store_true', help='Queue submits and commit them in background batches')
+    parser.add_argument('--queue-size', type=int, default=INGEST_QUEUE_SIZE, help='Max queued stat sheets before returning 429')
+    parser.add_argument('--flush-size', type=int, default=INGEST_FLUSH_SIZE, help='Max stat sheets per group commit')
+    parser.add_argument('--flush-interval', type=float, default=INGEST_FLUSH_INTERVAL, help='Max seconds a sheet waits before a commit')
+    parser.add_argument('--shards', type=int, default=None, help='Hash-partition stat sheets by match_id across this many database files')
+    parser.add_argument('--cache-mb', type=float, default=RESPONSE_CACHE_MAX_BYTES / (1024 * 1024), help='Response cache size in MB (0 disables it)')
+    parser.add_argument('--retention-days', type=float, default=None, help='Archive stat sheets older than this many days (default: keep everything)')
+    parser.add_argument('--archive-dir', default=ARCHIVE_DIR, help='Directory for archived stat sheets (gzip NDJSON)')
+    parser.add_argument('--retention-interval', type=float, default=RETENTION_INTERVAL, help='Seconds between background retention runs')
+    args = parser.parse_args()
+    if args.workers is not None and args.workers < 1:
+        parser.error('--workers must be at least 1')
+    
+    config = {
+        **default_config(),
+        'ASYNC_INGEST': args.async_ingest,
+        'QUEUE_SIZE': args.queue_size,
+        'FLUSH_SIZE': args.flush_size,
+        'FLUSH_INTERVAL': args.flush_interval,
+        'CACHE_BYTES': int(args.cache_mb * 1024 * 1024),
+        'RETENTION_DAYS': args.retention_days,
+        'ARCHIVE_DIR': args.archive_dir,
+        'RETENTION_INTERVAL': args.retention_interval,
+    }
+    if args.shards is not None:
+        config['DB_SHARDS'] = args.shards
+    
     print("🎮 Starting Loot Telemetry Simulator Server...")
+    if args.workers is None:
+        app = create_app(config)
+    else:
+        # Create or migrate the schema once, before forking, so workers don't race to
+        open_database(config['DB_PATH'], config['DB_SHARDS']).close()
     print("📊 Database initialized")
-    print("🌐 Server will be available at: http://localhost:5000")
-    print("📖 API documentation at: http://localhost:5000")
-    
-    # Run the server
-    app.run(
-        host='0.0.0.0',  # Accept connections from any IP
-        port=5000,
-        debug=True  # Enable debug mode for development
-    )
\ No newline at end of file
+    if config['DB_SHARDS'] > 1:
+        print(f"🧩 Sharded across {config['DB_SHARDS']} database files by match_id")
+    if args.async_ingest:
+        print(f"📥 Async ingest enabled (queue: {args.queue_size}, flush: {args.flush_size} sheets / {args.flush_interval}s)")
+    if args.retention_days is not None:
+        print(f"🗄️  Retention enabled (keeping {args.retention_days:g} days raw, archiving to {args.archive_dir})")
+    print(f"🌐 Server will be available at: http://localhost:{args.port}")
+    print(f"📖 API documentation at: http://localhost:{args.port}")
+    
+    if args.workers is not None:
+        print(f"👷 Production mode: {args.workers} worker processes (SIGHUP restarts them gracefully)")
+        # Each worker opens its own database handle; only worker 0 runs the retention job
+        prefork = PreforkServer(
+            lambda worker_id: create_app(config if worker_id == 0 else {**config, 'RETENTION_DAYS': None}),
+            args.host, args.port, args.workers, on_worker_exit=shutdown,
+            graceful_timeout=args.graceful_timeout
+        )
+        prefork.run()
+    else:
+        # Run the development server
+        app.run(
+            host=args.host,  # 0.0.0.0 accepts connections from any IP
+            port=args.port,
+            debug=not args.no_debug,  # Debug mode for development
+            threaded=True
+        )
@@ -3,10 +3,39 @@ Test the Loot Telemetry Server
 Run this to test database operations and server functionality
 """
 
+import copy
+import gzip
 import json
+import os
+import signal
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import numpy as np
 import requests
 from datetime import datetime
-from db_handler import DatabaseHandler
+from benchmark import ServerProcess, compare_results, find_free_port
+from data_generator import (
+    LootTelemetryDataGenerator, TokenBucket, UploadCheckpoint, UploadStats, LATENCY_BUCKETS
+)
+from db_handler import DatabaseHandler, RetentionJob, ShardedDatabaseHandler, WriteBehindQueue, load_columnar
+from ingest_listener import IngestListener, LineSender
+import metrics
+import payloads
+import sketches
+
+_server_app = None
+
+def server_app():
+    """The in-process server app, created once against a scratch database"""
+    global _server_app
+    if _server_app is None:
+        os.environ.setdefault('LOOT_DB_PATH', os.path.join(tempfile.mkdtemp(), "server_loot.db"))
+        import server
+        _server_app = server.create_app()
+    return _server_app
 
 def test_database():
     """Test database operations"""
@@ -52,6 +81,1364 @@ def test_database():
     db.clear_database()
     print("✅ Database test completed successfully!")
 
+def test_batch_insert():
+    """Test inserting many stat sheets in one transaction"""
+    print("\n📦 Testing Batch Insert...")
+    
+    db = DatabaseHandler("test_loot.db")
+    db.clear_database()
+    
+    batch = [
+        {
+            "match_id": "batch_match_001",
+            "player_id": f"batch_player_{i}",
+            "timestamp": datetime.now().isoformat(),
+            "looted_items": {"rubber_duck": i, "gold_coin": 1},
+            "locations": {"rubber_duck": (10.0 * i, 20.0)}
+        }
+        for i in range(1, 6)
+    ]
+    
+    sheet_ids = db.insert_stat_sheets(batch)
+    assert len(sheet_ids) == len(batch)
+    assert sheet_ids == list(range(sheet_ids[0], sheet_ids[0] + len(batch)))
+    print(f"✅ Inserted batch with IDs: {sheet_ids}")
+    
+    stats = db.get_aggregate_stats()
+    assert stats['total_stat_sheets'] == 5
+    assert stats['total_items']['rubber_duck'] == 15
+    print(f"✅ Batch aggregate stats: {stats}")
+    
+    db.clear_database()
+    print("✅ Batch insert test completed successfully!")
+
+def test_connection_pool():
+    """Test pooled WAL connections under concurrent readers and writers"""
+    print("\n🔌 Testing Connection Pool...")
+    
+    db = DatabaseHandler("test_loot.db")
+    db.clear_database()
+    
+    with db.connection() as conn:
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    assert journal_mode == 'wal'
+    print(f"✅ Journal mode: {journal_mode}")
+    
+    def writer(worker):
+        for i in range(20):
+            db.insert_stat_sheet({
+                "match_id": f"pool_match_{worker}",
+                "player_id": f"pool_player_{worker}_{i}",
+                "timestamp": datetime.now().isoformat(),
+                "looted_items": {"medkit": 1}
+            })
+    
+    def reader():
+        for _ in range(20):
+            db.get_aggregate_stats()
+    
+    threads = [threading.Thread(target=writer, args=(w,)) for w in range(4)]
+    threads += [threading.Thread(target=reader) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    stats = db.get_aggregate_stats()
+    assert stats['total_stat_sheets'] == 80
+    assert db.pool.opened <= len(threads) + 1
+    print(f"✅ {stats['total_stat_sheets']} concurrent inserts using {db.pool.opened} connections")
+    
+    db.clear_database()
+    db.close()
+    print("✅ Connection pool test completed successfully!")
+
+def test_write_behind_queue():
+    """Test asynchronous ingest with group commits"""
+    print("\n📥 Testing Write-Behind Queue...")
+    
+    db = DatabaseHandler("test_loot.db")
+    db.clear_database()
+    ingest_queue = WriteBehindQueue(db, max_size=100, flush_size=20, flush_interval=0.01)
+    
+    for i in range(50):
+        queued = ingest_queue.submit({
+            "match_id": "queue_match_001",
+            "player_id": f"queue_player_{i}",
+            "timestamp": datetime.now().isoformat(),
+            "looted_items": {"grenade": 2}
+        })
+        assert queued
+    
+    ingest_queue.flush()
+    stats = ingest_queue.stats()
+    assert stats['written'] == 50 and stats['depth'] == 0
+    assert stats['batches'] < 50
+    print(f"✅ Queue stats after flush: {stats}")
+    
+    assert db.get_aggregate_stats()['total_items']['grenade'] == 100
+    
+    # A bad sheet in a group commit is the only one lost, not its whole batch
+    for i in range(6):
+        ingest_queue.submit({
+            "match_id": "queue_match_002",
+            "player_id": f"queue_player_{i}",
+            "timestamp": datetime.now().isoformat(),
+            "looted_items": {"duck": "x"} if i == 3 else {"duck": 1}
+        })
+    ingest_queue.flush()
+    stats = ingest_queue.stats()
+    assert stats['written'] == 55 and stats['failed'] == 1 and stats['pending'] == 0
+    assert db.get_aggregate_stats()['total_items']['duck'] == 5
+    print(f"✅ Batch with one bad sheet: {stats['written'] - 50} written, {stats['failed']} failed")
+    
+    # A commit callback that raises neither stops the writer nor hangs flush()
+    settled = []
+    def on_commit(result):
+        settled.append(result)
+        raise RuntimeError("callback bug")
+    for i in range(3):
+        assert ingest_queue.submit({"match_id": "queue_match_003", "player_id": f"queue_player_{i}",
+                                    "timestamp": datetime.now().isoformat(), "looted_items": {}},
+                                   on_commit=on_commit)
+    ingest_queue.flush()
+    assert len(settled) == 3 and all(result is not None for result in settled)
+    
+    # Sheets accepted while the queue closes are all written before close() returns
+    accepted = []
+    def submitter(worker):
+        for i in range(10000):
+            if not ingest_queue.submit({"match_id": f"queue_close_{worker}", "player_id": f"queue_player_{i}",
+                                        "timestamp": datetime.now().isoformat(), "looted_items": {}}, block=True):
+                break
+            accepted.append(i)
+    threads = [threading.Thread(target=submitter, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    ingest_queue.close()
+    for thread in threads:
+        thread.join()
+    assert ingest_queue.stats()['written'] == 58 + len(accepted)
+    assert not ingest_queue.submit({"match_id": "late", "player_id": "late", "looted_items": {}})
+    print(f"✅ Closed queue wrote all {len(accepted)} sheets accepted while closing, then rejects new sheets")
+    
+    db.clear_database()
+    db.close()
+    print("✅ Write-behind queue test completed successfully!")
+
+def test_rollups():
+    """Test rollup tables against a rebuild and a legacy-database migration"""
+    print("\n📈 Testing Rollup Tables...")
+    
+    db_path = os.path.join(tempfile.mkdtemp(), "legacy_loot.db")
+    
+    # A database from before the rollup tables existed
+    with sqlite3.connect(db_path) as conn:
+        conn.execute('''
+            CREATE TABLE stat_sheets (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                match_id TEXT NOT NULL,
+                player_id TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                looted_items TEXT NOT NULL,
+                locations TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.executemany(
+            "INSERT INTO stat_sheets (match_id, player_id, timestamp, looted_items, locations) VALUES (?, ?, ?, ?, ?)",
+            [("legacy_match", f"legacy_player_{i}", datetime.now().isoformat(),
+              json.dumps({"medkit": i, "ammo_box": 1}), "{}") for i in range(3)]
+        )
+    
+    db = DatabaseHandler(db_path)
+    stats = db.get_aggregate_stats()
+    assert stats == {
+        'total_items': {'medkit': 3, 'ammo_box': 3},
+        'total_matches': 1,
+        'total_players': 3,
+        'total_stat_sheets': 3
+    }
+    print(f"✅ Migrated legacy rollups: {stats}")
+    
+    db.insert_stat_sheets([
+        {"match_id": "legacy_match", "player_id": "legacy_player_3",
+         "timestamp": datetime.now().isoformat(), "looted_items": {"medkit": 2}},
+        {"match_id": "new_match", "player_id": "new_player",
+         "timestamp": datetime.now().isoformat(), "looted_items": {"gold_coin": 4}}
+    ])
+    incremental = db.get_aggregate_stats()
+    assert incremental['total_matches'] == 2 and incremental['total_players'] == 5
+    assert incremental['total_items'] == {'medkit': 5, 'ammo_box': 3, 'gold_coin': 4}
+    
+    assert db.rebuild_rollups()
+    assert db.get_aggregate_stats() == incremental
+    print(f"✅ Incremental rollups match a full rebuild: {incremental}")
+    
+    db.close()
+    print("✅ Rollup test completed successfully!")
+
+def test_sheet_items():
+    """Test normalized per-item storage and its legacy JSON migration"""
+    print("\n🧩 Testing Normalized Item Storage...")
+    
+    db_path = os.path.join(tempfile.mkdtemp(), "legacy_json.db")
+    legacy_items = {"rubber_duck": 2, "medkit": 0, "gold_coin": 1}
+    legacy_locations = {"rubber_duck": [12.5, 40.0], "gold_coin": [90.0, 5.5]}
+    
+    with sqlite3.connect(db_path) as conn:
+        conn.execute('''
+            CREATE TABLE stat_sheets (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                match_id TEXT NOT NULL,
+                player_id TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                looted_items TEXT NOT NULL,
+                locations TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute(
+            "INSERT INTO stat_sheets (match_id, player_id, timestamp, looted_items, locations) VALUES (?, ?, ?, ?, ?)",
+            ("json_match", "json_player", "2025-10-27T10:30:00",
+             json.dumps(legacy_items), json.dumps(legacy_locations))
+        )
+    
+    db = DatabaseHandler(db_path)
+    sheet = db.get_stat_sheets()[0]
+    assert sheet['looted_items'] == legacy_items
+    assert sheet['locations'] == legacy_locations
+    print(f"✅ Migrated legacy sheet: {sheet['looted_items']} @ {sheet['locations']}")
+    
+    db.insert_stat_sheet({
+        "match_id": "json_match",
+        "player_id": "second_player",
+        "timestamp": datetime.now().isoformat(),
+        "looted_items": {"rubber_duck": 1, "medkit": 3},
+        "locations": {"rubber_duck": (60.0, 60.0), "medkit": (1.0, 2.0)}
+    })
+    
+    assert db.get_heatmap_data("rubber_duck") == [(60.0, 60.0), (12.5, 40.0), (12.5, 40.0)]
+    assert [s['player_id'] for s in db.get_stat_sheets(item="medkit")] == ["second_player"]
+    assert db.get_item_totals(match_id="json_match") == {"rubber_duck": 3, "medkit": 3, "gold_coin": 1}
+    assert db.get_item_totals(player_id="json_player") == legacy_items
+    print("✅ Heatmap, item filter and item totals answered from sheet_items")
+    
+    db.close()
+    print("✅ Normalized item storage test completed successfully!")
+
+def test_heatmap_grid():
+    """Test server-side heatmap binning and raw point pagination"""
+    print("\n🗺️  Testing Heatmap Grid...")
+    
+    db = DatabaseHandler(os.path.join(tempfile.mkdtemp(), "heatmap_loot.db"))
+    db.insert_stat_sheets([
+        {
+            "match_id": "heatmap_match",
+            "player_id": f"heatmap_player_{i}",
+            "timestamp": datetime.now().isoformat(),
+            "looted_items": {"rubber_duck": i % 3, "medkit": 1},
+            "locations": {"rubber_duck": (i * 9.5, 100.0 - i * 9.5)} if i % 3 else {}
+        }
+        for i in range(10)
+    ])
+    
+    points = db.get_heatmap_data("rubber_duck")
+    grid = db.get_heatmap_grid("rubber_duck", bins=10)
+    expected, _, _ = np.histogram2d(
+        [x for x, _ in points], [y for _, y in points], bins=10, range=[[0, 100], [0, 100]]
+    )
+    assert grid['grid'] == expected.astype(int).tolist()
+    assert grid['total'] == len(points)
+    print(f"✅ Binned {grid['total']} rubber duck locations into a 10x10 grid")
+    
+    paged = []
+    cursor = None
+    while True:
+        page, cursor = db.get_heatmap_page("rubber_duck", limit=2, cursor=cursor)
+        paged.extend(page)
+        if cursor is None:
+            break
+    assert paged == points
+    print(f"✅ Paginated {len(paged)} raw points")
+    
+    db.close()
+    print("✅ Heatmap grid test completed successfully!")
+
+def test_stat_sheet_pagination():
+    """Test keyset pagination and chunked iteration over stat sheets"""
+    print("\n📄 Testing Stat Sheet Pagination...")
+    
+    db = DatabaseHandler(os.path.join(tempfile.mkdtemp(), "paging_loot.db"))
+    sheet_ids = db.insert_stat_sheets([
+        {
+            "match_id": f"page_match_{i % 4}",
+            "player_id": f"page_player_{i}",
+            "timestamp": datetime.now().isoformat(),
+            "looted_items": {"ammo_box": i}
+        }
+        for i in range(25)
+    ])
+    
+    streamed = [sheet['id'] for sheet in db.iter_stat_sheets(chunk_size=4)]
+    assert streamed == sorted(sheet_ids, reverse=True)
+    print(f"✅ Iterated {len(streamed)} sheets in chunks of 4")
+    
+    paged = []
+    cursor = None
+    while True:
+        page, cursor = db.get_stat_sheets_page(match_id="page_match_1", cursor=cursor, limit=3)
+        paged.extend(sheet['player_id'] for sheet in page)
+        if cursor is None:
+            break
+    assert paged == [f"page_player_{i}" for i in range(21, 0, -4)]
+    print(f"✅ Paged through {len(paged)} sheets for page_match_1")
+    
+    db.close()
+    
+    # Streamed exports take the same limit as pages, without the page size cap
+    client = server_app().test_client()
+    client.post('/api/submit/batch', json=[{"match_id": "page_api_match", "player_id": f"page_api_player_{i}",
+                                            "looted_items": {"ammo_box": i}} for i in range(3)])
+    response = client.get('/api/stats?format=ndjson&match_id=page_api_match&limit=2')
+    assert response.status_code == 200 and len(response.data.splitlines()) == 2
+    for limit in (-1, 0):
+        assert client.get(f'/api/stats?format=ndjson&limit={limit}').status_code == 400
+        assert client.get(f'/api/stats?limit={limit}').status_code == 400
+    print("✅ Pagination test completed successfully!")
+
+def test_upload_rate_limiter():
+    """Test the uploader's token bucket and latency percentiles"""
+    print("\n🚦 Testing Upload Rate Limiter...")
+    
+    bucket = TokenBucket(rate=200, capacity=10)
+    start = time.monotonic()
+    for _ in range(50):
+        bucket.acquire()
+    elapsed = time.monotonic() - start
+    # 10 burst tokens, then 40 more at 200/sec takes about 0.2s
+    assert 0.15 <= elapsed < 1.0
+    print(f"✅ 50 tokens at 200/sec (burst 10) took {elapsed:.2f}s")
+    
+    stats = UploadStats()
+    for latency_ms in range(1, 101):
+        stats.record(1, 1, latency_ms / 1000)
+    p50, p99 = stats.percentiles(50, 99)
+    assert round(p50) == 51 and round(p99) == 100
+    print(f"✅ Latency percentiles: p50 {p50:.0f}ms, p99 {p99:.0f}ms")
+    
+    # A long run keeps a fixed-size histogram, accurate to about 1%
+    for i in range(100000):
+        stats.record(1, 1, (i % 1000 + 1) / 10000)
+    p50, p95 = stats.percentiles(50, 95)
+    assert len(stats.latency_buckets) == LATENCY_BUCKETS
+    assert abs(p50 - 50) < 0.5 and abs(p95 - 95) < 1
+    print(f"✅ {stats.requests} latencies in {LATENCY_BUCKETS} buckets: p50 {p50:.2f}ms, p95 {p95:.2f}ms")
+    print("✅ Rate limiter test completed successfully!")
+
+def test_vectorized_generation():
+    """Test seeded, chunked stat sheet generation"""
+    print("\n🎲 Testing Vectorized Generation...")
+    
+    def generate(seed):
+        generator = LootTelemetryDataGenerator(seed=seed)
+        chunks = list(generator.generate_chunks(num_matches=7, players_per_match=3, chunk_size=5))
+        for chunk in chunks:
+            for sheet in chunk:
+                sheet.pop('timestamp')
+        return chunks
+    
+    chunks = generate(seed=42)
+    assert [len(chunk) for chunk in chunks] == [5, 5, 5, 5, 1]
+    assert generate(seed=42) == chunks
+    assert generate(seed=43) != chunks
+    
+    sheets = [sheet for chunk in chunks for sheet in chunk]
+    assert sheets[-1]['match_id'] == "seed42_match_007" and sheets[-1]['player_id'] == "player_7_3"
+    # Unseeded runs get their own match IDs, so a second upload is not a resend
+    assert LootTelemetryDataGenerator().run_id != LootTelemetryDataGenerator().run_id
+    for sheet in sheets:
+        assert all(0 <= count <= 5 for count in sheet['looted_items'].values())
+        assert set(sheet['locations']) == {item for item, count in sheet['looted_items'].items() if count}
+        assert 300 <= sheet['match_duration'] <= 1800 and 1 <= sheet['player_level'] <= 50
+    print(f"✅ Generated {len(sheets)} reproducible stat sheets in {len(chunks)} chunks")
+    
+    output = os.path.join(tempfile.mkdtemp(), "sheets.ndjson")
+    written = LootTelemetryDataGenerator(seed=1).write_ndjson(output, num_matches=4, players_per_match=2)
+    with open(output) as f:
+        lines = [json.loads(line) for line in f]
+    assert written == len(lines) == 8
+    print(f"✅ Streamed {written} stat sheets to NDJSON")
+    print("✅ Vectorized generation test completed successfully!")
+
+def test_columnar_export():
+    """Test exporting stat sheets as memory-mapped columns"""
+    print("\n🧱 Testing Columnar Export...")
+    
+    workdir = tempfile.mkdtemp()
+    db = DatabaseHandler(os.path.join(workdir, "columnar_loot.db"))
+    generator = LootTelemetryDataGenerator(seed=3)
+    for chunk in generator.generate_chunks(num_matches=10, players_per_match=4, chunk_size=15):
+        db.insert_stat_sheets(chunk)
+    
+    export_dir = os.path.join(workdir, "columnar")
+    manifest = db.export_columnar(export_dir, chunk_size=7)
+    data = load_columnar(export_dir)
+    
+    assert manifest['num_sheets'] == 40 and len(data['sheet_id']) == 40
+    assert isinstance(data['item_x'], np.memmap)
+    assert set(data['matches'][data['match_code']]) == {f"seed3_match_{i:03d}" for i in range(1, 11)}
+    
+    totals = np.bincount(data['item_code'], weights=data['item_count'])
+    exported_totals = {str(item): int(total) for item, total in zip(data['items'], totals)}
+    assert exported_totals == db.get_aggregate_stats()['total_items']
+    
+    duck_code = list(data['items']).index('rubber_duck')
+    mask = (data['item_code'] == duck_code) & ~np.isnan(data['item_x'])
+    assert int(data['item_count'][mask].sum()) == len(db.get_heatmap_data('rubber_duck'))
+    print(f"✅ Exported and mapped {manifest['num_sheets']} sheets / {manifest['num_items']} item rows")
+    
+    db.close()
+    print("✅ Columnar export test completed successfully!")
+
+def test_benchmark_compare():
+    """Test regression detection against a saved benchmark baseline"""
+    print("\n🏁 Testing Benchmark Comparison...")
+    
+    def result(rps, p95, errors=0):
+        return {'rps': rps, 'p50_ms': p95 / 2, 'p95_ms': p95, 'p99_ms': p95 * 2, 'errors': errors}
+    
+    baseline = {'results': {'aggregate': result(1000, 10.0), 'stats': result(200, 40.0)}}
+    current = {'results': {'aggregate': result(950, 10.5), 'stats': result(150, 60.0, errors=2)}}
+    
+    regressions = compare_results(baseline, current, threshold=0.10)
+    assert not any(r.startswith('aggregate') for r in regressions)
+    assert len([r for r in regressions if r.startswith('stats')]) == 3
+    print(f"✅ Flagged regressions: {regressions}")
+    print("✅ Benchmark comparison test completed successfully!")
+
+def test_metrics():
+    """Test metrics rendering and per-request DB accounting"""
+    print("\n📈 Testing Metrics...")
+    
+    workdir = tempfile.mkdtemp()
+    db = DatabaseHandler(os.path.join(workdir, "metrics_loot.db"))
+    generator = LootTelemetryDataGenerator(seed=5)
+    db.insert_stat_sheets(next(generator.generate_chunks(num_matches=3, players_per_match=4)))
+    
+    metrics.begin_request()
+    db.get_stat_sheets(limit=5)
+    with metrics.json_timer():
+        json.dumps(db.get_aggregate_stats())
+    metrics.end_request('GET', '/test/metrics', 200)
+    
+    assert metrics.HTTP_REQUESTS.value(method='GET', route='/test/metrics', status=200) == 1
+    assert metrics.HTTP_LATENCY.count(route='/test/metrics') == 1
+    assert metrics.DB_LATENCY.count(operation='get_aggregate_stats') >= 1
+    assert metrics.DB_ROWS.value(operation='iter_stat_sheets') >= 5
+    
+    text = metrics.REGISTRY.render()
+    assert 'loot_http_request_rows_scanned_bucket{route="/test/metrics",le="+Inf"} 1' in text
+    assert '# TYPE loot_db_query_duration_seconds histogram' in text
+    print(f"✅ Rendered {len(text.splitlines())} metric lines")
+    
+    db.close()
+    print("✅ Metrics test completed successfully!")
+
+def test_response_cache():
+    """Test generation-based response caching and conditional requests"""
+    print("\n🗃️ Testing Response Cache...")
+    
+    app = server_app()
+    import server
+    
+    generation, _ = server.db.get_data_generation()
+    server.db.insert_stat_sheet({"match_id": "cache_001", "player_id": "cache_player",
+                                 "timestamp": datetime.now().isoformat(),
+                                 "looted_items": {"rubber_duck": 1}, "locations": {}})
+    assert server.db.get_data_generation()[0] == generation + 1
+    
+    client = app.test_client()
+    first = client.get('/api/aggregate')
+    etag = first.headers['ETag']
+    assert first.status_code == 200 and client.get('/api/aggregate').data == first.data
+    assert client.get('/api/aggregate', headers={'If-None-Match': etag}).status_code == 304
+    
+    server.db.clear_database()
+    refreshed = client.get('/api/aggregate', headers={'If-None-Match': etag})
+    assert refreshed.status_code == 200 and refreshed.headers['ETag'] != etag
+    assert refreshed.get_json()['data']['total_stat_sheets'] == 0
+    print(f"✅ ETag {etag} revalidated, then invalidated by clear")
+    
+    cache = server.ResponseCache(max_bytes=10)
+    cache.put('a', 1, b'12345', 'text/plain')
+    cache.put('b', 1, b'12345', 'text/plain')
+    cache.get('a', 1)
+    cache.put('c', 1, b'12345', 'text/plain')
+    assert cache.get('a', 1) and cache.get('b', 1) is None and cache.get('c', 2) is None
+    print("✅ Response cache test completed successfully!")
+
+def test_timeseries_rollups():
+    """Test minute/hour/day rollups and their backfill on upgrade"""
+    print("\n🕒 Testing Timeseries Rollups...")
+    
+    db_path = os.path.join(tempfile.mkdtemp(), "timeseries_loot.db")
+    db = DatabaseHandler(db_path)
+    for timestamp, ducks in [("2025-01-01T10:05:10", 2), ("2025-01-01T10:05:50", 3),
+                             ("2025-01-01T11:30:00", 1), ("2025-01-02T00:15:00", 4)]:
+        db.insert_stat_sheet({"match_id": f"ts_{timestamp}", "player_id": "ts_player", "timestamp": timestamp,
+                              "looted_items": {"rubber_duck": ducks, "gold_coin": 1}, "locations": {}})
+    
+    assert db.get_timeseries(item="rubber_duck", bucket="minute")[0] == ("2025-01-01T10:05:00", 5)
+    assert db.get_timeseries(bucket="day") == [("2025-01-01T00:00:00", 9), ("2025-01-02T00:00:00", 5)]
+    assert db.get_timeseries(item="rubber_duck", start="2025-01-01T11:00:00", end="2025-01-02T00:00:00",
+                             bucket="hour") == [("2025-01-01T11:00:00", 1)]
+    expected = db.get_timeseries(bucket="hour")
+    db.close()
+    
+    # Simulate a database from before the time rollups existed
+    conn = sqlite3.connect(db_path)
+    conn.execute("DROP TABLE item_totals_hour")
+    conn.execute("PRAGMA user_version = 3")
+    conn.commit()
+    conn.close()
+    
+    db = DatabaseHandler(db_path)
+    assert db.get_timeseries(bucket="hour") == expected
+    print(f"✅ Hourly series backfilled on upgrade: {expected}")
+    
+    db.close()
+    
+    # Bounds with a UTC offset select the same stored (naive UTC) timestamps
+    client = server_app().test_client()
+    client.post('/api/submit/batch', json=[
+        {"match_id": "ts_offset", "player_id": f"ts_offset_{hour}", "timestamp": f"2024-03-01T{hour:02d}:30:00",
+         "looted_items": {"ts_offset_item": hour}} for hour in (4, 5, 10)])
+    data = client.get('/api/timeseries?item=ts_offset_item&start=2024-03-01T10:00%2B05:00'
+                      '&end=2024-03-01T11:00:00Z').get_json()['data']
+    assert (data['start'], data['end']) == ('2024-03-01T05:00:00', '2024-03-01T11:00:00')
+    assert [point['total'] for point in data['points']] == [5, 10]
+    print("✅ Timeseries rollup test completed successfully!")
+
+def test_spatial_locations():
+    """Test bounding-box location queries and the grid cell backfill"""
+    print("\n🧭 Testing Spatial Locations...")
+    
+    db_path = os.path.join(tempfile.mkdtemp(), "spatial_loot.db")
+    db = DatabaseHandler(db_path)
+    generator = LootTelemetryDataGenerator(seed=9)
+    stat_sheets = next(generator.generate_chunks(num_matches=50, players_per_match=4))
+    db.insert_stat_sheets(stat_sheets)
+    
+    bbox = (20.0, 30.0, 45.0, 60.0)
+    expected = sorted(
+        (item, tuple(location)) for sheet in stat_sheets
+        for item, location in sheet['locations'].items()
+        if bbox[0] <= location[0] <= bbox[2] and bbox[1] <= location[1] <= bbox[3]
+        and sheet['looted_items'][item] > 0
+    )
+    locations, _ = db.get_locations(bbox)
+    assert sorted((loc['item'], (loc['x'], loc['y'])) for loc in locations) == expected
+    
+    ducks, _ = db.get_locations(bbox, item='rubber_duck')
+    assert ducks and all(loc['item'] == 'rubber_duck' for loc in ducks)
+    first_page, next_cursor = db.get_locations(bbox, limit=5)
+    second_page, _ = db.get_locations(bbox, limit=5, cursor=next_cursor)
+    assert first_page + second_page == locations[:10]
+    db.close()
+    
+    # Simulate a database from before sheet_items.cell existed
+    conn = sqlite3.connect(db_path)
+    conn.execute("DROP INDEX idx_sheet_items_cell")
+    conn.execute("ALTER TABLE sheet_items DROP COLUMN cell")
+    conn.execute("PRAGMA user_version = 4")
+    conn.commit()
+    conn.close()
+    
+    db = DatabaseHandler(db_path)
+    assert db.get_locations(bbox)[0] == locations
+    print(f"✅ Found {len(locations)} locations in {bbox} before and after the cell backfill")
+    
+    db.close()
+    print("✅ Spatial locations test completed successfully!")
+
+def test_sharded_database():
+    """Test sharded inserts and fan-out queries against a single database"""
+    print("\n🧩 Testing Sharded Database...")
+    
+    workdir = tempfile.mkdtemp()
+    single = DatabaseHandler(os.path.join(workdir, "single_loot.db"))
+    sharded = ShardedDatabaseHandler(os.path.join(workdir, "sharded_loot.db"), num_shards=3)
+    generator = LootTelemetryDataGenerator(seed=11)
+    stat_sheets = next(generator.generate_chunks(num_matches=30, players_per_match=4))
+    single.insert_stat_sheets(copy.deepcopy(stat_sheets))
+    sheet_ids = sharded.insert_stat_sheets(copy.deepcopy(stat_sheets))
+    
+    assert len(set(sheet_ids)) == len(stat_sheets)
+    assert all(sheet_id % 3 == sharded.shard_for(sheet['match_id']) for sheet_id, sheet in zip(sheet_ids, stat_sheets))
+    
+    expected, actual = single.get_aggregate_stats(), sharded.get_aggregate_stats()
+    assert sorted(actual.pop('total_items').items()) == sorted(expected.pop('total_items').items())
+    assert actual == expected
+    assert sharded.get_heatmap_grid('rubber_duck')['grid'] == single.get_heatmap_grid('rubber_duck')['grid']
+    assert sharded.get_timeseries(bucket='minute') == single.get_timeseries(bucket='minute')
+    
+    # Keyset pages across shards visit every sheet exactly once, newest global id first
+    seen, cursor = [], None
+    while True:
+        page, cursor = sharded.get_stat_sheets_page(limit=17, cursor=cursor)
+        seen.extend(sheet['id'] for sheet in page)
+        if cursor is None:
+            break
+    assert seen == sorted(sheet_ids, reverse=True)
+    assert [sheet['id'] for sheet in sharded.iter_stat_sheets(chunk_size=5)] == seen
+    match_id = stat_sheets[27]['match_id']
+    assert [s['match_id'] for s in sharded.get_stat_sheets(match_id=match_id)] == [match_id] * 4
+    
+    points, cursor = [], None
+    while True:
+        page, cursor = sharded.get_heatmap_page('rubber_duck', limit=9, cursor=cursor)
+        points.extend(page)
+        if cursor is None:
+            break
+    assert sorted(points) == sorted(single.get_heatmap_data('rubber_duck'))
+    print(f"✅ {len(seen)} sheets spread over {sharded.num_shards} shards, results match a single database")
+    
+    # Players who played matches on several shards are counted once, without unioning player sets
+    veterans = [{**stat_sheets[0], 'match_id': f'veteran_match_{i}', 'player_id': f'veteran_{i % 3}'}
+                for i in range(12)]
+    sharded.insert_stat_sheets(veterans + veterans[:2])
+    single.insert_stat_sheets(veterans)
+    assert len({sharded.shard_for(sheet['match_id']) for sheet in veterans}) > 1
+    assert sharded.get_aggregate_stats()['total_players'] == single.get_aggregate_stats()['total_players']
+    
+    # A registry lost (or predating the upgrade) is refilled from the shards' seen players on open
+    expected_players = sharded.get_aggregate_stats()['total_players']
+    sharded.close()
+    for index in range(3):
+        with sqlite3.connect(os.path.join(workdir, f"sharded_loot.shard{index}.db")) as conn:
+            conn.execute("DROP TABLE registered_players")
+            conn.execute("DELETE FROM rollup_counters WHERE name IN ('registered_players', 'players_registry_filled')")
+    sharded = ShardedDatabaseHandler(os.path.join(workdir, "sharded_loot.db"), num_shards=3)
+    assert sharded.get_aggregate_stats()['total_players'] == expected_players
+    print(f"✅ {expected_players} distinct players across shards, also after refilling the registry")
+    
+    sharded.close()
+    single.close()
+    print("✅ Sharded database test completed successfully!")
+
+def test_retention():
+    """Test archiving old stat sheets while totals, timeseries and heatmaps stay correct"""
+    print("\n🗄️  Testing Retention...")
+    
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, "retention_loot.db")
+    archive_dir = os.path.join(workdir, "archive")
+    db = DatabaseHandler(db_path)
+    generator = LootTelemetryDataGenerator(seed=13)
+    stat_sheets = next(generator.generate_chunks(num_matches=40, players_per_match=4))
+    db.insert_stat_sheets(stat_sheets)
+    
+    # Age the first 100 sheets past the retention window
+    with db.connection() as conn:
+        conn.execute("UPDATE stat_sheets SET created_at = '2020-01-01 00:00:00' WHERE id <= 100")
+        conn.commit()
+    
+    expected_stats = db.get_aggregate_stats()
+    expected_series = db.get_timeseries(bucket='hour')
+    expected_grid = db.get_heatmap_grid('rubber_duck')['grid']
+    
+    assert db.apply_retention('2021-01-01 00:00:00', archive_dir, chunk_size=30) == 100
+    assert len(db.get_stat_sheets()) == len(stat_sheets) - 100
+    with db.connection() as conn:
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        assert conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
+    
+    archived = []
+    for name in sorted(os.listdir(archive_dir)):
+        with gzip.open(os.path.join(archive_dir, name), 'rt', encoding='utf-8') as f:
+            archived.extend(json.loads(line) for line in f)
+    assert [sheet['id'] for sheet in archived] == list(range(1, 101))
+    
+    # Long-range results are unchanged, even after rebuilding the rollups from scratch
+    for _ in range(2):
+        assert db.get_aggregate_stats() == expected_stats
+        assert db.get_timeseries(bucket='hour') == expected_series
+        assert db.get_heatmap_grid('rubber_duck')['grid'] == expected_grid
+        db.rebuild_rollups()
+    
+    # Nothing is newer than a 1-day window's cutoff yet, so the job archives nothing
+    job = RetentionJob(db, retention_days=1, archive_dir=archive_dir, interval=3600)
+    job.close()
+    assert job.stats()['runs'] == 1 and job.stats()['archived'] == 0
+    print(f"✅ Archived {len(archived)} sheets into {len(os.listdir(archive_dir))} files, totals unchanged")
+    
+    db.close()
+    print("✅ Retention test completed successfully!")
+
+def test_ingest_payloads():
+    """Test gzip, struct-packed and JSON ingest bodies round-trip through the submit endpoints"""
+    print("\n📦 Testing Ingest Payloads...")
+    
+    client = server_app().test_client()
+    generator = LootTelemetryDataGenerator(seed=17)
+    stat_sheets = next(generator.generate_chunks(num_matches=10, players_per_match=4))
+    
+    decoded = payloads.unpack_stat_sheets(payloads.pack_stat_sheets(stat_sheets))
+    assert decoded == json.loads(json.dumps(stat_sheets))
+    
+    sizes = {}
+    for encoding in ('json', 'struct'):
+        for compress in (False, True):
+            body, headers = payloads.encode(stat_sheets, encoding, compress)
+            sizes[payloads.encoding_label(headers['Content-Type'], headers.get('Content-Encoding'))] = len(body)
+            response = client.post('/api/submit/batch', data=body, headers=headers)
+            assert response.status_code == 201 and response.get_json()['accepted'] == len(stat_sheets)
+            
+            single = {**stat_sheets[0], 'player_id': f'payload_{encoding}_{compress}'}
+            body, headers = payloads.encode(single, encoding, compress)
+            assert client.post('/api/submit', data=body, headers=headers).status_code == 201
+    assert sizes['struct+gzip'] < sizes['json+gzip'] < sizes['json']
+    
+    assert client.post('/api/submit', data=b'{"match_id": ', content_type='application/json').status_code == 400
+    assert client.post('/api/submit', data=b'LSH1\x05', content_type=payloads.STRUCT_CONTENT_TYPE).status_code == 400
+    assert client.post('/api/submit', data=b'{}', headers={'Content-Encoding': 'br'}).status_code == 415
+    bomb = gzip.compress(b' ' * (payloads.MAX_DECOMPRESSED_BYTES + 1))
+    assert client.post('/api/submit', data=bomb, headers={'Content-Encoding': 'gzip'}).status_code == 400
+    print(f"✅ Batch of {len(stat_sheets)} sheets accepted in every encoding; bytes on the wire: {sizes}")
+    
+    # Malformed sheets are a 400 (or a per-item rejection), never a database error
+    malformed = [
+        {'looted_items': {'medkit': 'x'}},
+        {'looted_items': {'medkit': -1}},
+        {'looted_items': ['medkit']},
+        {'match_id': 7},
+        {'player_id': None},
+        {'timestamp': 20250201},
+        {'locations': {'medkit': [1.0]}},
+        {'locations': {'medkit': ['a', 2.0]}},
+        {'locations': [[1.0, 2.0]]},
+        {'looted_items': {'medkit': payloads.MAX_ITEM_COUNT + 1}},
+        {'match_duration': payloads.MAX_MATCH_DURATION + 1},
+        {'player_level': payloads.MAX_PLAYER_LEVEL + 1},
+    ]
+    bad_sheets = [{**stat_sheets[0], 'player_id': f'malformed_{i}', **fields} for i, fields in enumerate(malformed)]
+    for bad_sheet in bad_sheets:
+        response = client.post('/api/submit', json=bad_sheet)
+        assert response.status_code == 400, bad_sheet
+    response = client.post('/api/submit/batch', json=[*bad_sheets, {**stat_sheets[0], 'player_id': 'well_formed'}])
+    result = response.get_json()
+    assert response.status_code == 201 and result['accepted'] == 1 and result['rejected'] == len(bad_sheets)
+    assert result['results'][0]['error'] == f'looted_items.medkit must be an integer from 0 to {payloads.MAX_ITEM_COUNT}'
+    # Item names from msgpack bodies can be other types than strings
+    assert payloads.validate_stat_sheet({**stat_sheets[0], 'looted_items': {1: 2}}) == 'looted_items keys must be strings'
+    # Explicit nulls travel in the struct format as absent fields
+    single = {**stat_sheets[0], 'player_id': 'payload_nulls', 'match_duration': None, 'player_level': None}
+    body, headers = payloads.encode(single, 'struct')
+    assert 'match_duration' not in payloads.decode(body, headers['Content-Type'])[0]
+    assert client.post('/api/submit', data=body, headers=headers).status_code == 201
+    print(f"✅ {len(bad_sheets)} malformed sheets rejected with 400 and per-item batch errors")
+    
+    print("✅ Ingest payload test completed successfully!")
+
+def test_idempotent_submits():
+    """Test duplicate stat sheets are stored once, deduplicated on upgrade, and upload checkpoints"""
+    print("\n🔁 Testing Idempotent Submits...")
+    
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, "idempotent_loot.db")
+    db = DatabaseHandler(db_path)
+    generator = LootTelemetryDataGenerator(seed=19)
+    stat_sheets = next(generator.generate_chunks(num_matches=5, players_per_match=4))
+    
+    sheet_ids = db.insert_stat_sheets(stat_sheets[:12])
+    expected = db.get_aggregate_stats()
+    
+    # A retried batch overlapping the stored sheets, with a repeat inside the batch too
+    retry = stat_sheets[8:] + [stat_sheets[15]]
+    results = db.insert_stat_sheets(retry, report_duplicates=True)
+    assert [duplicate for _, duplicate in results] == [True] * 4 + [False] * 8 + [True]
+    assert [sheet_id for sheet_id, _ in results[:4]] == sheet_ids[8:]
+    assert results[-1][0] == results[7][0]
+    
+    db.insert_stat_sheets(stat_sheets[:12])
+    stats = db.get_aggregate_stats()
+    assert stats['total_stat_sheets'] == len(stat_sheets) == len(db.get_stat_sheets())
+    assert db.rebuild_rollups() and db.get_aggregate_stats() == stats
+    db.close()
+    
+    # Simulate a database from before the unique constraint, holding duplicates
+    conn = sqlite3.connect(db_path)
+    conn.execute("DROP INDEX idx_match_player")
+    conn.execute("INSERT INTO stat_sheets (match_id, player_id, timestamp) SELECT match_id, player_id, timestamp FROM stat_sheets")
+    # ...and a later run that reused the first match's keys
+    conn.execute("INSERT INTO stat_sheets (match_id, player_id, timestamp) "
+                 "SELECT match_id, player_id, '2025-01-01T00:00:00' FROM stat_sheets WHERE match_id = ? AND id <= 4",
+                 (stat_sheets[0]['match_id'],))
+    conn.execute("UPDATE rollup_counters SET value = value * 2 + 4 WHERE name = 'stat_sheets'")
+    conn.execute("PRAGMA user_version = 5")
+    conn.commit()
+    conn.close()
+    
+    db = DatabaseHandler(db_path)
+    upgraded = db.get_aggregate_stats()
+    assert upgraded['total_stat_sheets'] == len(stat_sheets) + 4
+    assert upgraded['total_items'] == stats['total_items'] and upgraded['total_matches'] == stats['total_matches'] + 1
+    # The other run's sheets are kept under a renamed match
+    with db.connection() as conn:
+        renamed = conn.execute("SELECT DISTINCT match_id FROM stat_sheets WHERE timestamp LIKE '2025-%'").fetchall()
+    assert renamed == [(stat_sheets[0]['match_id'] + '~2',)]
+    # The removed copies are archived next to the database, not lost
+    duplicates_dir = os.path.join(workdir, "idempotent_loot.duplicates")
+    archived = []
+    for name in sorted(os.listdir(duplicates_dir)):
+        with gzip.open(os.path.join(duplicates_dir, name), 'rt') as f:
+            archived.extend(json.loads(line) for line in f)
+    assert len(archived) == len(stat_sheets)
+    assert sorted(sheet['player_id'] for sheet in archived) == sorted(sheet['player_id'] for sheet in stat_sheets)
+    
+    # Retries of sheets already moved out by retention are still duplicates
+    db.apply_retention('2999-01-01 00:00:00', os.path.join(workdir, "archive"))
+    results = db.insert_stat_sheets(stat_sheets[:3], report_duplicates=True)
+    assert results == [(sheet_id, True) for sheet_id in sheet_ids[:3]]
+    assert db.get_aggregate_stats() == upgraded
+    db.close()
+    print(f"✅ {len(stat_sheets)} unique sheets stored after retries, an upgrade of a duplicated database "
+          f"({len(archived)} copies archived) and retention")
+    
+    sharded = ShardedDatabaseHandler(os.path.join(workdir, "idempotent_sharded.db"), num_shards=3)
+    first = sharded.insert_stat_sheets(stat_sheets)
+    assert sharded.insert_stat_sheets(stat_sheets, report_duplicates=True) == [(sheet_id, True) for sheet_id in first]
+    assert sharded.get_aggregate_stats()['total_stat_sheets'] == len(stat_sheets)
+    sharded.close()
+    
+    # Chunks answered out of order only advance the checkpoint past a gap once it closes
+    checkpoint_path = os.path.join(workdir, "upload.checkpoint")
+    run = {'matches': 5, 'players': 4, 'seed': 19}
+    checkpoint = UploadCheckpoint(checkpoint_path, run)
+    checkpoint.mark_done(10, 10)
+    checkpoint.mark_done(0, 5)
+    assert checkpoint.completed == 5
+    checkpoint.mark_done(5, 5)
+    assert checkpoint.completed == 20
+    checkpoint.save()
+    assert UploadCheckpoint(checkpoint_path, run).completed == 20
+    try:
+        UploadCheckpoint(checkpoint_path, {**run, 'seed': 20})
+        assert False, "checkpoint of another run was accepted"
+    except ValueError:
+        pass
+    print("✅ Upload checkpoint resumes from the contiguous prefix of answered chunks")
+    
+    # Batch items an async server could not queue are resent, and the chunk
+    # only counts as answered (checkpointable) once every item got in
+    class QueueFullServer(LootTelemetryDataGenerator):
+        """Answers like an --async-ingest server whose queue takes 3 sheets per request"""
+        def send_stat_sheet_batch(self, stat_sheets):
+            self.requests.append([sheet['player_id'] for sheet in stat_sheets])
+            results = [{'index': index, 'success': True, 'queued': True} if index < 3 else
+                       {'index': index, 'success': False, 'error': 'Ingest queue is full', 'retryable': True}
+                       for index in range(len(stat_sheets))]
+            return True, {'accepted': min(3, len(stat_sheets)), 'results': results}
+    
+    client = QueueFullServer(seed=19)
+    client.requests = []
+    client.max_retries = 2
+    succeeded, errors, _, answered = client._send_chunk(stat_sheets[:8], 8, None)
+    assert (succeeded, errors, answered) == (8, [], True)
+    assert [len(request) for request in client.requests] == [8, 5, 2]
+    assert client.requests[1] == client.requests[0][3:] and client.requests[2] == client.requests[1][3:]
+    
+    client.max_retries = 1
+    succeeded, errors, _, answered = client._send_chunk(stat_sheets[:8], 8, None)
+    assert succeeded == 6 and [index for index, _ in errors] == [6, 7] and not answered
+    print("✅ Items refused with a full ingest queue are resent, or keep their chunk out of the checkpoint")
+    
+    # Requests the server refused for good count as answered; 429/5xx do not
+    class RefusingServer(LootTelemetryDataGenerator):
+        """Answers every request with one canned status and JSON body"""
+        def _post(self, path, obj, timeout):
+            response = requests.Response()
+            response.status_code, response._content = self.status, json.dumps(self.body).encode()
+            return response
+    
+    client = RefusingServer(seed=19)
+    invalid = {'success': False, 'accepted': 0, 'rejected': 8,
+               'results': [{'index': index, 'success': False, 'error': 'bad'} for index in range(8)]}
+    for status, body, batch_size, expected in ((400, {'error': 'Invalid JSON'}, 1, (0, 1, True)),
+                                               (413, {'error': 'Batch too large'}, 8, (0, 1, True)),
+                                               (400, invalid, 8, (0, 8, True)),
+                                               (429, {'error': 'Ingest queue is full'}, 8, (0, 1, False)),
+                                               (503, {'error': 'Unavailable'}, 1, (0, 1, False))):
+        client.status, client.body, client.max_retries = status, body, 0
+        succeeded, errors, _, answered = client._send_chunk(stat_sheets[:batch_size], batch_size, None)
+        assert (succeeded, len(errors), answered) == expected, (status, succeeded, errors, answered)
+    print("✅ Invalid sheets are answered; only transport errors and 429/5xx are resent on resume")
+    
+    print("✅ Idempotent submit test completed successfully!")
+
+def test_leaderboards():
+    """Test top-k player and match leaderboards against a brute-force ranking"""
+    print("\n🏆 Testing Leaderboards...")
+    
+    workdir = tempfile.mkdtemp()
+    generator = LootTelemetryDataGenerator(seed=20)
+    stat_sheets = next(generator.generate_chunks(num_matches=100, players_per_match=4))
+    for index, sheet in enumerate(stat_sheets):
+        # Players recur across matches (and so across shards) and days
+        sheet['player_id'] = f"lb_player_{index % 37}"
+        sheet['timestamp'] = f"2025-01-0{1 + index % 5}T12:00:00"
+    
+    def ranking(owner, item=None, days=None):
+        totals = {}
+        for sheet in stat_sheets:
+            if days and sheet['timestamp'][:10] not in days:
+                continue
+            looted = sum(count for name, count in sheet['looted_items'].items() if item in (None, name))
+            if looted:
+                totals[sheet[owner]] = totals.get(sheet[owner], 0) + looted
+        return sorted(totals.items(), key=lambda entry: (-entry[1], entry[0]))
+    
+    db = DatabaseHandler(os.path.join(workdir, "leaderboard_loot.db"))
+    sharded = ShardedDatabaseHandler(os.path.join(workdir, "leaderboard_sharded.db"), num_shards=3)
+    db.insert_stat_sheets(copy.deepcopy(stat_sheets))
+    sharded.insert_stat_sheets(copy.deepcopy(stat_sheets))
+    
+    for handler in (db, sharded):
+        assert handler.get_leaderboard('players', k=10) == ranking('player_id')[:10]
+        assert handler.get_leaderboard('matches', item='rubber_duck', k=5) == ranking('match_id', 'rubber_duck')[:5]
+        assert handler.get_leaderboard('players', item='medkit', k=50, start='2025-01-02T12:00:00', end='2025-01-04T12:00:00') == \
+            ranking('player_id', 'medkit', {'2025-01-02', '2025-01-03'})[:50]
+    
+    assert db.rebuild_rollups()
+    assert db.get_leaderboard('matches', k=1000) == ranking('match_id')
+    with db.connection() as conn:
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT player_id, total AS rank_total FROM player_totals "
+            "WHERE item = ? ORDER BY rank_total DESC, player_id LIMIT 10", ('*',)
+        ).fetchall()
+    assert 'COVERING INDEX idx_player_totals_rank' in plan[0][3] and len(plan) == 1
+    print(f"✅ Top players match a brute-force ranking: {db.get_leaderboard('players', k=3)}")
+    
+    sharded.close()
+    db.close()
+    
+    client = server_app().test_client()
+    client.post('/api/submit/batch', json=stat_sheets[:20])
+    response = client.get('/api/leaderboard/players?item=gold_coin&k=3')
+    entries = response.get_json()['data']['entries']
+    assert response.status_code == 200 and [entry['rank'] for entry in entries] == [1, 2, 3]
+    assert entries[0]['total'] >= entries[1]['total'] >= entries[2]['total']
+    assert client.get('/api/leaderboard/items').status_code == 404
+    assert client.get('/api/leaderboard/matches?k=0').status_code == 400
+    
+    print("✅ Leaderboard test completed successfully!")
+
+def test_sketches():
+    """Test HyperLogLog distinct counts and KLL quantiles, alone and stored per shard and day"""
+    print("\n📐 Testing Sketches...")
+    
+    def assert_rank_within(values, q, estimate, error):
+        ranked = np.sort(values)
+        below = np.searchsorted(ranked, estimate, side='left') / len(ranked)
+        at_or_below = np.searchsorted(ranked, estimate, side='right') / len(ranked)
+        assert below - error <= q <= at_or_below + error, (q, estimate, below, at_or_below)
+    
+    # Merged sketches answer for the union, within their error bounds
+    left, right = sketches.HyperLogLog(), sketches.HyperLogLog()
+    left.update(f"player_{i}" for i in range(30000))
+    right.update(f"player_{i}" for i in range(20000, 50000))
+    assert abs(left.merge(right).count() - 50000) <= 3 * left.relative_error * 50000
+    
+    rng = np.random.default_rng(21)
+    values = np.concatenate([rng.integers(0, 6, 20000), rng.exponential(100, 20000)])
+    first, second = sketches.KllSketch(), sketches.KllSketch()
+    first.update(values[:20000])
+    second.update(values[20000:])
+    merged = sketches.KllSketch.from_bytes(first.merge(second).to_bytes())
+    assert merged.n == len(values) and sum(len(level) for level in merged.levels) < 1000
+    for q, estimate in zip((0.1, 0.5, 0.9, 0.99), merged.quantiles([0.1, 0.5, 0.9, 0.99])):
+        assert_rank_within(values, q, estimate, merged.rank_error)
+    print(f"✅ Merged KLL sketch keeps {sum(len(level) for level in merged.levels)} of {merged.n} values")
+    
+    workdir = tempfile.mkdtemp()
+    generator = LootTelemetryDataGenerator(seed=22)
+    stat_sheets = next(generator.generate_chunks(num_matches=300, players_per_match=4))
+    for index, sheet in enumerate(stat_sheets):
+        sheet['player_id'] = f"sketch_player_{index % 500}"
+        sheet['timestamp'] = f"2025-02-0{1 + index % 3}T10:00:00"
+    sheet_totals = np.array([sum(sheet['looted_items'].values()) for sheet in stat_sheets])
+    
+    db = DatabaseHandler(os.path.join(workdir, "sketch_loot.db"))
+    sharded = ShardedDatabaseHandler(os.path.join(workdir, "sketch_sharded.db"), num_shards=3)
+    db.insert_stat_sheets(copy.deepcopy(stat_sheets))
+    sharded.insert_stat_sheets(copy.deepcopy(stat_sheets))
+    
+    for handler in (db, sharded):
+        exact = handler.get_aggregate_stats()
+        approx = handler.get_aggregate_stats(approx=True)
+        assert (exact['total_matches'], exact['total_players']) == (300, 500)
+        assert abs(approx['total_matches'] - 300) <= 3 and abs(approx['total_players'] - 500) <= 5
+        assert approx['total_items'] == exact['total_items']
+        
+        window = handler.get_aggregate_stats(approx=True, start='2025-02-02T12:00:00', end='2025-02-04')
+        assert window['total_stat_sheets'] == 800 and window['total_items']['medkit'] == \
+            sum(sheet['looted_items']['medkit'] for sheet in stat_sheets if sheet['timestamp'] >= '2025-02-02')
+        
+        sketch = handler.get_quantile_sketch()
+        assert sketch.n == 1200
+        for q, estimate in zip((0.5, 0.9), sketch.quantiles([0.5, 0.9])):
+            assert_rank_within(sheet_totals, q, estimate, sketch.rank_error)
+        assert handler.get_quantile_sketch('medkit', start='2025-02-03').n == 400
+    
+    # Single inserts skip the quantile sketches; reads merge them in until a compaction folds them
+    for index, sheet in enumerate(stat_sheets[:30]):
+        db.insert_stat_sheet({**sheet, 'match_id': f"staged_match_{index}"})
+    staged = db.get_quantile_sketch('medkit', start='2025-02-03')
+    assert db.get_quantile_sketch().n == 1230 and staged.n == 410
+    assert db.compact_sketches() == 30 and db.compact_sketches() == 0
+    compacted = db.get_quantile_sketch('medkit', start='2025-02-03')
+    assert compacted.n == 410 and compacted.min_max() == staged.min_max()
+    print(f"✅ {staged.n} medkit counts read before and after compacting 30 staged sheets")
+    
+    # Archived sheets stay in the sketches through a rebuild, staged ones included
+    for index, sheet in enumerate(stat_sheets[30:35]):
+        db.insert_stat_sheet({**sheet, 'match_id': f"late_match_{index}"})
+    with db.connection() as conn:
+        conn.execute("UPDATE stat_sheets SET created_at = '2020-01-01 00:00:00' "
+                     "WHERE id <= 200 OR match_id LIKE 'late_match_%'")
+        conn.commit()
+    assert db.apply_retention('2021-01-01 00:00:00', os.path.join(workdir, "archive")) == 205
+    assert db.get_quantile_sketch().n == 1235
+    assert db.rebuild_rollups()
+    assert db.get_quantile_sketch().n == 1235 and db.get_aggregate_stats(approx=True)['total_matches'] >= 330
+    
+    # Databases from before the watermark already had every sheet in their sketches
+    db.close()
+    with sqlite3.connect(os.path.join(workdir, "sketch_loot.db")) as conn:
+        conn.execute("UPDATE rollup_counters SET value = 0 WHERE name = 'sketched_through'")
+        conn.execute("PRAGMA user_version = 9")
+    db = DatabaseHandler(os.path.join(workdir, "sketch_loot.db"))
+    assert db.get_quantile_sketch().n == 1235
+    print(f"✅ Sketches after retention and rebuild: {db.get_aggregate_stats(approx=True)['total_players']} players")
+    
+    sharded.close()
+    db.close()
+    
+    client = server_app().test_client()
+    client.post('/api/submit/batch', json=stat_sheets[:40])
+    data = client.get('/api/quantiles?item=gold_coin&q=0,0.5,1').get_json()['data']
+    assert data['stat_sheets'] >= 40 and [entry['q'] for entry in data['quantiles']] == [0, 0.5, 1]
+    assert data['quantiles'][0]['value'] == data['min'] and data['quantiles'][2]['value'] == data['max']
+    assert client.get('/api/quantiles?q=2').status_code == 400
+    assert client.get('/api/aggregate?approx=true').get_json()['data']['approximate'] is True
+    assert client.get('/api/aggregate?start=2025-02-01').status_code == 400
+    
+    print("✅ Sketch test completed successfully!")
+
+def test_sheet_metrics():
+    """Test stored match durations and player levels, range filters and level bands"""
+    print("\n⏱️  Testing Match Duration and Player Level Columns...")
+    
+    workdir = tempfile.mkdtemp()
+    generator = LootTelemetryDataGenerator(seed=23)
+    stat_sheets = next(generator.generate_chunks(num_matches=150, players_per_match=4))
+    for sheet in stat_sheets[::10]:
+        del sheet['match_duration'], sheet['player_level']  # older clients send neither
+    
+    def matching(min_level=None, max_duration=None):
+        return [sheet for sheet in stat_sheets
+                if (min_level is None or sheet.get('player_level', -1) >= min_level)
+                and (max_duration is None or sheet.get('match_duration', float('inf')) <= max_duration)]
+    
+    db = DatabaseHandler(os.path.join(workdir, "metrics_loot.db"))
+    sharded = ShardedDatabaseHandler(os.path.join(workdir, "metrics_sharded.db"), num_shards=3)
+    db.insert_stat_sheets(copy.deepcopy(stat_sheets))
+    sharded.insert_stat_sheets(copy.deepcopy(stat_sheets))
+    
+    stored = {(sheet['match_id'], sheet['player_id']): sheet for sheet in db.get_stat_sheets()}
+    for sheet in stat_sheets:
+        row = stored[(sheet['match_id'], sheet['player_id'])]
+        assert row.get('player_level') == sheet.get('player_level')
+        if 'match_duration' in sheet:
+            assert abs(row['loot_per_minute'] - sum(sheet['looted_items'].values()) * 60 / sheet['match_duration']) < 1e-9
+        else:
+            assert 'loot_per_minute' not in row
+    
+    expected_bands = {}
+    for sheet in matching(min_level=1):
+        sums = expected_bands.setdefault((sheet['player_level'] - 1) // 10, [0, 0, 0, 0])
+        looted = sum(sheet['looted_items'].values())
+        sums[0] += 1
+        sums[1] += looted
+        sums[2] += looted
+        sums[3] += sheet['match_duration']
+    expected_bands = [(band, *expected_bands[band]) for band in sorted(expected_bands)]
+    
+    for handler in (db, sharded):
+        levels = [sheet['player_level'] for sheet in handler.get_stat_sheets(ranges={'min_level': 40})]
+        assert len(levels) == len(matching(min_level=40)) and min(levels) >= 40
+        
+        stats = handler.get_aggregate_stats(ranges={'min_level': 25, 'max_duration': 900})
+        expected = matching(min_level=25, max_duration=900)
+        assert stats['total_stat_sheets'] == len(expected)
+        assert stats['total_players'] == len({sheet['player_id'] for sheet in expected})
+        assert stats['total_items']['medkit'] == sum(sheet['looted_items']['medkit'] for sheet in expected)
+        
+        assert handler.get_level_bands() == expected_bands
+        assert handler.get_level_bands(ranges={'min_level': 1}) == expected_bands
+    
+    with db.connection() as conn:
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT COUNT(*) FROM stat_sheets WHERE player_level >= ? AND player_level <= ?", (20, 30)
+        ).fetchall()
+    assert 'idx_player_level' in plan[0][3]
+    print(f"✅ Level bands: {[(band, sheets) for band, sheets, *_ in expected_bands]}")
+    
+    # Archived sheets stay in the level bands through a rebuild
+    with db.connection() as conn:
+        conn.execute("UPDATE stat_sheets SET created_at = '2020-01-01 00:00:00' WHERE id <= 150")
+        conn.commit()
+    assert db.apply_retention('2021-01-01 00:00:00', os.path.join(workdir, "archive")) == 150
+    assert db.rebuild_rollups() and db.get_level_bands() == expected_bands
+    
+    sharded.close()
+    db.close()
+    
+    # Databases from before the columns existed are migrated in place
+    legacy_path = os.path.join(workdir, "legacy_metrics.db")
+    legacy = DatabaseHandler(legacy_path)
+    legacy.insert_stat_sheets(copy.deepcopy(stat_sheets[:20]))
+    legacy.close()
+    conn = sqlite3.connect(legacy_path)
+    for index in ('idx_player_level', 'idx_match_duration', 'idx_loot_per_minute'):
+        conn.execute(f"DROP INDEX {index}")
+    for column in ('match_duration', 'player_level', 'items_looted', 'loot_per_minute'):
+        conn.execute(f"ALTER TABLE stat_sheets DROP COLUMN {column}")
+    conn.execute("DROP TABLE level_band_totals")
+    conn.execute("PRAGMA user_version = 8")
+    conn.commit()
+    conn.close()
+    legacy = DatabaseHandler(legacy_path)
+    with legacy.connection() as conn:
+        assert conn.execute("SELECT SUM(items_looted) FROM stat_sheets").fetchone()[0] == \
+            sum(sum(sheet['looted_items'].values()) for sheet in stat_sheets[:20])
+    assert legacy.get_level_bands() == []
+    legacy.close()
+    
+    client = server_app().test_client()
+    client.post('/api/submit/batch', json=stat_sheets[:40])
+    sheets = client.get('/api/stats?min_level=30&max_duration=1200&limit=500').get_json()['data']
+    assert sheets and all(sheet['player_level'] >= 30 and sheet['match_duration'] <= 1200 for sheet in sheets)
+    data = client.get('/api/aggregate?min_level=30').get_json()['data']
+    assert data['filters']['min_level'] == 30 and data['level_bands'][0]['min_level'] >= 21
+    assert client.get('/api/aggregate').get_json()['data']['level_bands'][0]['loot_per_minute'] > 0
+    assert client.get('/api/stats?min_level=high').status_code == 400
+    assert client.get('/api/aggregate?min_level=10&approx=true').status_code == 400
+    bad_sheet = {**stat_sheets[0], 'player_id': 'bad_level_player', 'player_level': 'twelve'}
+    assert client.post('/api/submit', json=bad_sheet).status_code == 400
+    
+    print("✅ Match duration and player level test completed successfully!")
+
+def test_dashboard():
+    """Test the single-pass heatmap grids for every item and the /api/dashboard bundle"""
+    print("\n📋 Testing Dashboard...")
+    
+    workdir = tempfile.mkdtemp()
+    generator = LootTelemetryDataGenerator(seed=23)
+    stat_sheets = next(generator.generate_chunks(num_matches=100, players_per_match=4))
+    
+    db = DatabaseHandler(os.path.join(workdir, "dashboard_loot.db"))
+    sharded = ShardedDatabaseHandler(os.path.join(workdir, "dashboard_sharded.db"), num_shards=3)
+    db.insert_stat_sheets(copy.deepcopy(stat_sheets))
+    sharded.insert_stat_sheets(copy.deepcopy(stat_sheets))
+    
+    # Archive part of the single database so archived cells are binned too
+    with db.connection() as conn:
+        conn.execute("UPDATE stat_sheets SET created_at = '2020-01-01 00:00:00' WHERE id <= 100")
+        conn.commit()
+    assert db.apply_retention('2021-01-01 00:00:00', os.path.join(workdir, "archive")) == 100
+    
+    # One pass over every item matches the per-item grids exactly
+    for handler in (db, sharded):
+        grids = handler.get_heatmap_grids(bins=12)
+        assert grids['grids'] and len(grids['x_edges']) == 13
+        for item, grid in grids['grids'].items():
+            single = handler.get_heatmap_grid(item, bins=12)
+            assert grid == single['grid'] and grids['totals'][item] == single['total']
+    print(f"✅ Heatmap grids for {len(grids['grids'])} items match the per-item grids")
+    
+    sharded.close()
+    db.close()
+    
+    client = server_app().test_client()
+    client.post('/api/submit/batch', json=stat_sheets[:40])
+    data = client.get('/api/dashboard?bins=10').get_json()['data']
+    aggregate, summary = data['aggregate'], data['summary']
+    assert summary['total_looted'] == sum(aggregate['total_items'].values())
+    assert summary['top_item'] == max(aggregate['total_items'], key=aggregate['total_items'].get)
+    assert summary['items_per_stat_sheet'] == summary['total_looted'] / aggregate['total_stat_sheets']
+    assert [entry['q'] for entry in summary['items_per_stat_sheet_quantiles']] == [0.5, 0.9, 0.99]
+    assert data['level_bands'] and data['heatmaps']['bins'] == 10
+    for item, grid in data['heatmaps']['grids'].items():
+        assert grid == client.get(f'/api/heatmap/{item}/grid?bins=10').get_json()['data']['grid']
+    assert client.get('/api/dashboard?bins=1000').status_code == 400
+    
+    print("✅ Dashboard test completed successfully!")
+
+def test_prefork_server():
+    """Test production mode: forked workers share the port, are replaced and restart gracefully"""
+    print("\n👷 Testing Pre-fork Workers...")
+    
+    def worker_pids(base_url, requests_made=40):
+        return {requests.get(f"{base_url}/api/health", timeout=5).json()['pid'] for _ in range(requests_made)}
+    
+    def wait_for(condition, timeout=20):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                if condition():
+                    return True
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        return False
+    
+    def start_slow_submit(sheet):
+        """Send a submit's headers and half its body, leaving the request in flight"""
+        body = json.dumps(sheet).encode()
+        sock = socket.create_connection(('127.0.0.1', process.port), timeout=10)
+        sock.sendall(f"POST /api/submit HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body[:20])
+        time.sleep(0.5)  # let a worker pick it up before the signal
+        return sock, body[20:]
+    
+    def finish_slow_submit(sock, rest):
+        time.sleep(1)
+        sock.sendall(rest)
+        status_line = sock.makefile('rb').readline()
+        sock.close()
+        return status_line
+    
+    db_path = os.path.join(tempfile.mkdtemp(), "prefork_loot.db")
+    process = ServerProcess(db_path, find_free_port(), server_args=['--workers', '2'])
+    process.start()
+    try:
+        stat_sheets = next(LootTelemetryDataGenerator(seed=24).generate_chunks(num_matches=30, players_per_match=2))
+        for sheet in stat_sheets:
+            assert requests.post(f"{process.base_url}/api/submit", json=sheet, timeout=5).status_code == 201
+        
+        # A worker that dies is replaced; the survivors keep serving meanwhile
+        pids = worker_pids(process.base_url)
+        assert process.process.pid not in pids
+        os.kill(next(iter(pids)), signal.SIGKILL)
+        assert wait_for(lambda: len(worker_pids(process.base_url) - pids) >= 1)
+        print(f"✅ Killed worker replaced, serving from {len(worker_pids(process.base_url))} processes")
+        
+        # SIGHUP swaps in a whole new set of workers without closing the port,
+        # and a request in flight on an old worker still completes
+        before = worker_pids(process.base_url)
+        sock, rest = start_slow_submit(dict(stat_sheets[0], match_id='slow_sighup'))
+        process.process.send_signal(signal.SIGHUP)
+        assert finish_slow_submit(sock, rest).split()[1] == b'201'
+        assert wait_for(lambda: not worker_pids(process.base_url) & before)
+        data = requests.get(f"{process.base_url}/api/aggregate", timeout=5).json()['data']
+        assert data['total_stat_sheets'] == len(stat_sheets) + 1
+        print("✅ Graceful restart replaced every worker")
+        
+        # SIGTERM also lets the request in flight finish before the workers exit
+        sock, rest = start_slow_submit(dict(stat_sheets[0], match_id='slow_sigterm'))
+        process.process.terminate()
+        assert finish_slow_submit(sock, rest).split()[1] == b'201'
+    finally:
+        process.process.terminate()
+        assert process.process.wait(timeout=40) == 0
+    
+    db = DatabaseHandler(db_path)
+    assert db.get_aggregate_stats()['total_stat_sheets'] == len(stat_sheets) + 2
+    db.close()
+    
+    print("✅ Pre-fork server test completed successfully!")
+
+def test_ingest_listener():
+    """Test NDJSON ingest over TCP and UDP, and the data generator's line transports"""
+    print("\n📡 Testing Ingest Listener...")
+    
+    workdir = tempfile.mkdtemp()
+    db = DatabaseHandler(os.path.join(workdir, "listener_loot.db"))
+    listener = IngestListener(db, '127.0.0.1', tcp_port=0, udp_port=0, flush_interval=0.01).start()
+    stat_sheets = next(LootTelemetryDataGenerator(seed=25).generate_chunks(num_matches=60, players_per_match=2))
+    
+    # TCP: bad lines are counted and reported, the rest committed before the summary
+    sender = LineSender('127.0.0.1', listener.tcp_port)
+    sender.send_lines(LineSender.encode(stat_sheets[:50]))
+    sender.send_lines([b'not json\n', b'{"match_id": "m", "player_id": "p"}\n', b'\n'])
+    sender.send_lines(LineSender.encode(stat_sheets[:5]))  # resubmits are not stored twice
+    summary = sender.close()
+    assert (summary['received'], summary['accepted'], summary['rejected']) == (57, 55, 2)
+    assert (summary['committed'], summary['duplicates'], summary['failed']) == (55, 5, 0)
+    assert [error['line'] for error in summary['errors']] == [51, 52]
+    assert summary['errors'][1]['error'] == 'Missing required field: looted_items'
+    assert db.get_aggregate_stats()['total_stat_sheets'] == 50
+    print(f"✅ TCP stream committed 50 sheets, rejected {summary['rejected']} bad lines")
+    
+    # A sheet whose commit fails is reported as failed, not committed, and a
+    # connection left open does not hold up another connection's summary
+    insert_stat_sheets = db.insert_stat_sheets
+    db.insert_stat_sheets = lambda sheets, **kwargs: (
+        None if any(sheet['player_id'] == 'poison' for sheet in sheets) else insert_stat_sheets(sheets, **kwargs))
+    idle = LineSender('127.0.0.1', listener.tcp_port)
+    idle.send_lines(LineSender.encode(stat_sheets[:1]))
+    sender = LineSender('127.0.0.1', listener.tcp_port)
+    sender.send_lines(LineSender.encode(stat_sheets[:2] + [dict(stat_sheets[0], player_id='poison')]))
+    summary = sender.close()
+    assert (summary['accepted'], summary['committed'], summary['failed']) == (3, 2, 1)
+    db.insert_stat_sheets = insert_stat_sheets
+    assert idle.close()['committed'] == 1
+    
+    # UDP: several lines per datagram, no reply
+    udp = LineSender('127.0.0.1', listener.udp_port, transport='udp')
+    udp.send_lines(LineSender.encode(stat_sheets[50:80]))
+    assert udp.close() is None
+    deadline = time.monotonic() + 10
+    while listener.stats()['received']['udp'] < 30 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    listener.queue.flush()
+    assert db.get_aggregate_stats()['total_stat_sheets'] == 80
+    
+    # The generator streams over TCP and reports the listener's summary
+    generator = LootTelemetryDataGenerator(f"http://127.0.0.1:{find_free_port()}", seed=25,
+                                           transport='tcp', listener=('127.0.0.1', listener.tcp_port))
+    assert generator.upload_data_to_server(stat_sheets, batch_size=25, concurrency=2)
+    assert db.get_aggregate_stats()['total_stat_sheets'] == len(stat_sheets)
+    
+    listener.close()
+    stats = listener.stats()
+    # Two generator workers plus its connection check, and the three senders
+    assert stats['connections'] == 6 and stats['rejected'] == {'tcp': 2, 'udp': 0}
+    assert stats['queue']['written'] == 55 + 3 + 30 + len(stat_sheets)
+    
+    # A client still waiting when close() gives up on a stuck writer gets its
+    # summary, with the sheets that were never committed counted as failed
+    listener = IngestListener(db, '127.0.0.1', tcp_port=0, flush_interval=0.01).start()
+    release = threading.Event()
+    db.insert_stat_sheets = lambda sheets, **kwargs: release.wait() and None
+    sender = LineSender('127.0.0.1', listener.tcp_port)
+    sender.send_lines(LineSender.encode(stat_sheets[:3]))
+    summaries = []
+    closing = threading.Thread(target=lambda: summaries.append(sender.close()))
+    closing.start()
+    time.sleep(0.2)
+    listener.close(timeout=0.1)
+    closing.join(timeout=10)
+    release.set()
+    db.insert_stat_sheets = insert_stat_sheets
+    assert summaries and (summaries[0]['accepted'], summaries[0]['committed'], summaries[0]['failed']) == (3, 0, 3)
+    db.close()
+    
+    print("✅ Ingest listener test completed successfully!")
+
 def test_server_api():
     """Test server API endpoints (requires server to be running)"""
     print("\n🌐 Testing Server API...")
@@ -115,6 +1502,31 @@ if __name__ == "__main__":
     
     # Test database
     test_database()
+    test_batch_insert()
+    test_connection_pool()
+    test_write_behind_queue()
+    test_rollups()
+    test_sheet_items()
+    test_heatmap_grid()
+    test_stat_sheet_pagination()
+    test_upload_rate_limiter()
+    test_vectorized_generation()
+    test_columnar_export()
+    test_benchmark_compare()
+    test_metrics()
+    test_response_cache()
+    test_timeseries_rollups()
+    test_spatial_locations()
+    test_sharded_database()
+    test_retention()
+    test_ingest_payloads()
+    test_idempotent_submits()
+    test_leaderboards()
+    test_sketches()
+    test_sheet_metrics()
+    test_dashboard()
+    test_prefork_server()
+    test_ingest_listener()
     
     # Test server API
     test_server_api()